@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# Compares line counting throughput of ps.util.count_lines against the
+# per-line iteration previously used by guess_source_file.
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from ps.util import count_lines
+
+def generate_file(path, size, line_length, seed):
+    rng = random.Random(seed)
+    alphabet = b"abcdefghijklmnopqrstuvwxyz0123456789,;(){} "
+    with open(path, "wb") as file:
+        written = 0
+        while written < size:
+            line = bytes(rng.choice(alphabet) for _ in range(rng.randint(1, line_length * 2))) + b"\n"
+            file.write(line * 64)
+            written += len(line) * 64
+
+def count_lines_iterating(fd):
+    fd.seek(0)
+    return sum(1 for _ in fd)
+
+def measure(function, path, repeat):
+    best = None
+    with open(path, "rb") as fd:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = function(fd)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best == None else min(best, elapsed)
+    return result, best
+
+def main():
+    parser = argparse.ArgumentParser(description="Line counting micro-benchmark")
+    parser.add_argument("--size", help="file size in MiB", type=int, default=64)
+    parser.add_argument("--repeat", help="repetitions (best time is reported)", type=int, default=3)
+    args = parser.parse_args()
+
+    methods = [
+        ("iterate lines", count_lines_iterating),
+        ("blocks", count_lines),
+    ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, line_length in [("source", 40), ("csv", 12), ("generated", 400)]:
+            path = os.path.join(directory, name)
+            generate_file(path, args.size << 20, line_length, 0)
+            size = os.path.getsize(path)
+
+            expected = None
+            for method_name, function in methods:
+                result, elapsed = measure(function, path, args.repeat)
+                if expected == None:
+                    expected = result
+                elif result != expected:
+                    print("{}: {} counted {} lines, expected {}".format(name, method_name, result, expected), file=sys.stderr)
+                    sys.exit(1)
+                print("{:10} {:14} {:10.1f} MB/s".format(name, method_name, size / elapsed / 1e6))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# Measures memory used by the in-memory tree built by walk_directory, in bytes
+# per node. Run it with --package-dir pointing at a checkout of an older
+# revision (e.g. a git worktree) to compare before and after.
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+EXTENSIONS = [".c", ".h", ".cpp", ".py", ".js", ".json", ".md", ".txt", ".csv", ".png", ".o", ".sh", ".xyz", ""]
+
+def generate_tree(root, files, files_per_directory, seed):
+    rng = random.Random(seed)
+    directories = [root]
+    for index in range(files):
+        if index % files_per_directory == 0 and index > 0:
+            directory = os.path.join(rng.choice(directories), "dir{}".format(index))
+            os.mkdir(directory)
+            directories.append(directory)
+        path = os.path.join(directories[-1], "file{}{}".format(index, rng.choice(EXTENSIONS)))
+        open(path, "w").close()
+    return files + len(directories)
+
+def main():
+    parser = argparse.ArgumentParser(description="Tree memory benchmark")
+    parser.add_argument("--files", help="number of files to generate", type=int, default=100000)
+    parser.add_argument("--files-per-directory", help="number of files in each directory", type=int, default=50)
+    parser.add_argument("--package-dir", help="directory containing the `ps` package to measure", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.abspath(args.package_dir))
+    import config
+    config.args = argparse.Namespace(no_formatting=True, no_unicode=True, no_open=True, verbose=False, include=[], exclude=[], more=False)
+    import ps.files
+
+    with tempfile.TemporaryDirectory() as directory:
+        nodes = generate_tree(directory, args.files, args.files_per_directory, 0)
+        ps.files.FileDescriptorManager()
+        # Guessers are loaded on first use; don't count them as a part of the tree.
+        registry = ps.files.DetectorRegistry.instance
+        if hasattr(registry, "load_guessers"):
+            registry.load_guessers()
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        if hasattr(ps.files, "walk_directory"):
+            root = ps.files.walk_directory(directory)
+        else:
+            root = ps.files.Directory(None, directory)
+        elapsed = time.perf_counter() - start
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print("nodes:          {}".format(nodes))
+        print("walk time:      {:.2f} s".format(elapsed))
+        print("tree size:      {:.1f} MiB".format(size / (1 << 20)))
+        print("peak:           {:.1f} MiB".format(peak / (1 << 20)))
+        print("bytes per node: {:.0f}".format(size / nodes))
+        del root
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# Times scans of a synthetic tree (see treegen.py) per command and per phase,
+# prints results as JSON and optionally compares them with a baseline.
+#
+# Every run is a separate process running the real project-status script, so
+# that nothing is shared between runs. Phases are measured by wrapping the
+# functions below; time of a phase excludes phases nested in it, and is summed
+# over threads with --jobs. Guessing done in other processes (--processes)
+# counts as walk time.
+#
+# Typical use:
+#   bench_scan.py --output baseline.json
+#   (change something)
+#   bench_scan.py --baseline baseline.json --threshold 10
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import treegen
+
+COMMANDS = {
+    "list": ["list"],
+    "display-tree": ["display-tree"],
+    "info": ["info"],
+    "list-files": ["list-files", "--guesses", "text/x-c,application/x-python"],
+}
+
+# phase -> (module, class or None, function). Functions missing in the
+# measured revision are skipped.
+PHASES = [
+    ("walk", "ps.files", None, "walk_directory"),
+    ("guess", "ps.detector", "DetectorRegistry", "guess_file_type"),
+    ("line count", "ps.files", "FileContent", "stream"),
+    ("collapse", "ps.files", None, "collapse_tree"),
+    # Streaming collapses every directory as it's finished.
+    ("collapse", "ps.files", "Directory", "release_files"),
+    ("render", "ps.files", "Directory", "__str__"),
+    ("render", "ps.files", "TreePrinter", "print_tree"),
+    ("render", "ps.files", "TreeStreamPrinter", "visit_file"),
+    ("render", "ps.files", "TreeStreamPrinter", "leave_directory"),
+    ("render", "ps.files", "Directory", "print_projects"),
+    ("render", "ps.files", "Directory", "print_if_has_guesses"),
+    ("render", "ps.display", None, "directory_fancy_display"),
+]
+
+class PhaseTimer:
+    def __init__(self):
+        self.times = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def wrap(self, owner, name, phase):
+        function = getattr(owner, name)
+        timer = self
+        self.times[phase] = 0.0
+
+        def wrapper(*args, **kwargs):
+            stack = getattr(timer.local, "stack", None)
+            if stack == None:
+                stack = timer.local.stack = []
+            # Recursive calls are timed by the outermost one.
+            if len(stack) > 0 and stack[-1][0] == phase:
+                return function(*args, **kwargs)
+
+            entry = [phase, 0.0]
+            stack.append(entry)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                stack.pop()
+                if len(stack) > 0:
+                    stack[-1][1] += elapsed
+                with timer.lock:
+                    timer.times[phase] += elapsed - entry[1]
+
+        setattr(owner, name, wrapper)
+
+# Runs one command in this process and writes its timings as JSON to stdout.
+# Output of the command itself is discarded.
+def run_worker(package_dir, columns, argv):
+    start = time.perf_counter()
+    sys.path.insert(0, package_dir)
+    import importlib
+    timer = PhaseTimer()
+    for phase, module_name, class_name, function_name in PHASES:
+        module = importlib.import_module(module_name)
+        owner = getattr(module, class_name, None) if class_name != None else module
+        if owner != None and hasattr(owner, function_name):
+            timer.wrap(owner, function_name, phase)
+    startup = time.perf_counter() - start
+
+    # Renders get a fixed width, so that they are comparable and work without a terminal.
+    os.get_terminal_size = lambda fd=1: os.terminal_size((columns, 24))
+    result_fd = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+
+    import runpy
+    sys.argv = [os.path.join(package_dir, "project-status")] + argv
+    start = time.perf_counter()
+    runpy.run_path(sys.argv[0], run_name="__main__")
+    sys.stdout.flush()
+    total = time.perf_counter() - start
+
+    phases = dict(timer.times)
+    phases["startup"] = startup
+    phases["other"] = max(total - sum(timer.times.values()), 0.0)
+    with os.fdopen(result_fd, "w") as output:
+        json.dump({"total": total + startup, "phases": phases}, output)
+
+def run_command(args, command, root):
+    argv = args.cli_args.split() + COMMANDS[command] + [root]
+    worker = [sys.executable, os.path.abspath(__file__), "--worker", "--package-dir", args.package_dir, "--columns", str(args.columns), "--"] + argv
+    best = None
+    for _ in range(args.repeat):
+        process = subprocess.run(worker, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stderr = process.stderr.decode(errors="replace")
+        # project-status exits quietly on exceptions and usage errors.
+        if process.returncode != 0 or "Traceback" in stderr or "usage:" in stderr:
+            raise RuntimeError("{} failed:\n{}".format(command, stderr))
+        result = json.loads(process.stdout)
+        if best == None:
+            best = result
+            continue
+        best["total"] = min(best["total"], result["total"])
+        for phase, elapsed in result["phases"].items():
+            best["phases"][phase] = min(best["phases"].get(phase, elapsed), elapsed)
+    return best
+
+# Returns list of (name, baseline, current) slower by more than `threshold`
+# percent. Times below `min_time` are too noisy and ignored.
+def find_regressions(baseline, current, threshold, min_time):
+    regressions = []
+    def check(name, old, new):
+        if old != None and new != None and max(old, new) >= min_time and new > old * (1 + threshold / 100):
+            regressions.append((name, old, new))
+
+    for command, result in current["commands"].items():
+        old_result = baseline["commands"].get(command)
+        if old_result == None:
+            continue
+        check(command, old_result["total"], result["total"])
+        for phase, elapsed in result["phases"].items():
+            check(command + ": " + phase, old_result["phases"].get(phase), elapsed)
+    return regressions
+
+def print_summary(results, baseline):
+    for command, result in results["commands"].items():
+        old_result = baseline["commands"].get(command) if baseline != None else None
+        def line(name, new, old):
+            change = " ({:+.1f}%)".format((new / old - 1) * 100) if old != None and old > 0 else ""
+            return "  {:<12} {:8.3f} s{}".format(name, new, change)
+        print(command, file=sys.stderr)
+        print(line("total", result["total"], old_result["total"] if old_result != None else None), file=sys.stderr)
+        for phase, elapsed in sorted(result["phases"].items(), key=lambda item: -item[1]):
+            print(line(phase, elapsed, old_result["phases"].get(phase) if old_result != None else None), file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="Scan benchmark on synthetic trees")
+    parser.add_argument("--commands", help="comma-separated commands to run", default=",".join(COMMANDS))
+    parser.add_argument("--repeat", help="runs of each command (best time of every phase is reported)", type=int, default=3)
+    parser.add_argument("--tree", help="directory with the tree; it is generated there if it doesn't exist, and kept")
+    parser.add_argument("--package-dir", help="directory containing project-status to measure", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    parser.add_argument("--cli-args", help="global options of project-status, e.g. '--no-cache --jobs 4'", default="--no-cache")
+    parser.add_argument("--columns", help="terminal width used for rendering", type=int, default=120)
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    parser.add_argument("--baseline", help="JSON results to compare with")
+    parser.add_argument("--threshold", help="slowdown in percent reported as regression", type=float, default=10)
+    parser.add_argument("--min-time", help="ignore phases faster than this in both runs, in seconds", type=float, default=0.01)
+    parser.add_argument("--worker", help=argparse.SUPPRESS, action="store_true")
+    parser.add_argument("worker_args", nargs="*", help=argparse.SUPPRESS)
+    treegen.add_shape_arguments(parser)
+    args = parser.parse_args()
+    args.package_dir = os.path.abspath(args.package_dir)
+
+    if args.worker:
+        run_worker(args.package_dir, args.columns, args.worker_args)
+        return
+
+    for command in args.commands.split(","):
+        if not command in COMMANDS:
+            parser.error("unknown command: " + command)
+
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        root = args.tree
+        if root == None:
+            root = os.path.join(temporary_directory, "tree")
+        if not os.path.exists(root):
+            os.makedirs(root)
+            print("Generating tree in " + root, file=sys.stderr)
+            stats = treegen.generate_tree(root, args).as_dict()
+        else:
+            stats = treegen.tree_stats(root).as_dict()
+
+        shape = {name: getattr(args, name) for name in ["seed", "depth", "fan_out", "files_per_directory", "mix", "median_size",
+                                                         "size_sigma", "max_size", "special_ratio", "project_ratio", "symlink_ratio"]}
+        results = {"tree": {"shape": shape, "stats": stats}, "cli_args": args.cli_args, "commands": {}}
+        for command in args.commands.split(","):
+            print("Running " + command, file=sys.stderr)
+            results["commands"][command] = run_command(args, command, root)
+
+    baseline = None
+    if args.baseline != None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    print_summary(results, baseline)
+
+    if args.output != None:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if baseline != None:
+        if baseline["tree"]["shape"] != results["tree"]["shape"]:
+            print("warning: baseline was measured on a tree of different shape", file=sys.stderr)
+        regressions = find_regressions(baseline, results, args.threshold, args.min_time)
+        for name, old, new in regressions:
+            print("REGRESSION {}: {:.3f} s -> {:.3f} s ({:+.1f}%)".format(name, old, new, (new / old - 1) * 100), file=sys.stderr)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# Measures startup of commands which don't scan anything, or have a server
+# answer them, using `python -X importtime`. project-status runs from shell
+# prompts, where this is all the time it takes.
+#
+# Reports time spent importing modules (not counting those the interpreter
+# imports by itself) and the wall time of the whole command, and exits with 1
+# if the import time is over --budget, or if a command imports a module it
+# shouldn't need (see HEAVY_MODULES). The latter doesn't depend on how fast
+# the machine is.
+#
+# Typical use:
+#   bench_startup.py --budget 40
+import argparse
+import json
+import os
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+COMMANDS = {
+    "version": ["version"],
+    "config": ["config", "guessers"],
+    # Answered by EmptyServer, so this is the client side of a query.
+    "served query": ["--socket", "{socket}", "list", "{tree}"],
+}
+
+# Modules which only scanning, rendering or running processes needs.
+HEAVY_MODULES = ["asyncio", "subprocess", "concurrent.futures", "ps.guessers", "ps.gitreader", "ps.files", "ps.display",
+                 "ps.records", "ps.server", "ps.watch"]
+
+# Answers every query with no output, like `project-status serve` would for
+# a directory without projects.
+class EmptyServer(socketserver.UnixStreamServer):
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            self.rfile.readline()
+            self.wfile.write(json.dumps({"exit": 0}).encode() + b"\n")
+
+    def __init__(self, socket_path):
+        socketserver.UnixStreamServer.__init__(self, socket_path, EmptyServer.Handler)
+
+# Returns {module: cumulative import time in seconds} of modules imported at
+# top level (not by other modules), and the set of all imported modules.
+def parse_importtime(stderr):
+    top_level = {}
+    modules = set()
+    for line in stderr.split("\n"):
+        if not line.startswith("import time:") or line.endswith("| imported package"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        modules.add(name.strip())
+        if name.startswith(" ") and not name.startswith("  "):
+            top_level[name.strip()] = int(fields[1]) / 1e6
+    return top_level, modules
+
+def run_importtime(argv):
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime"] + argv, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    return time.perf_counter() - start, process.stderr
+
+# Best of `repeat` runs of one command.
+def measure(script, argv, interpreter_modules, repeat):
+    best = None
+    for _ in range(repeat):
+        wall_time, stderr = run_importtime([script] + argv)
+        top_level, modules = parse_importtime(stderr)
+        import_time = sum([elapsed for name, elapsed in top_level.items() if not name in interpreter_modules])
+        if best == None or import_time < best["import_time"]:
+            best = {"import_time": import_time, "wall_time": wall_time, "heavy_modules": [name for name in HEAVY_MODULES if name in modules],
+                    "slowest": sorted([(elapsed, name) for name, elapsed in top_level.items() if not name in interpreter_modules])[-5:]}
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time benchmark")
+    parser.add_argument("--commands", help="comma-separated commands to run", default=",".join(COMMANDS))
+    parser.add_argument("--repeat", help="runs of each command (best one is reported)", type=int, default=5)
+    parser.add_argument("--budget", help="maximum import time of a command in milliseconds", type=float, default=40)
+    parser.add_argument("--package-dir", help="directory containing project-status to measure", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    script = os.path.join(os.path.abspath(args.package_dir), "project-status")
+    _, stderr = run_importtime(["-c", "pass"])
+    interpreter_modules = set(parse_importtime(stderr)[0])
+
+    failed = False
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        server = EmptyServer(os.path.join(directory, "server.sock"))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        for command in args.commands.split(","):
+            if not command in COMMANDS:
+                parser.error("unknown command: " + command)
+            argv = [argument.format(socket=server.server_address, tree=directory) for argument in COMMANDS[command]]
+            result = measure(script, argv, interpreter_modules, args.repeat)
+            results[command] = result
+
+            over_budget = result["import_time"] * 1000 > args.budget
+            print("{:<14} imports {:6.1f} ms{}, total {:6.1f} ms".format(command, result["import_time"] * 1000, " (over budget)" if over_budget else "",
+                                                                         result["wall_time"] * 1000))
+            print("  slowest: " + ", ".join(["{} {:.1f} ms".format(name, elapsed * 1000) for elapsed, name in reversed(result["slowest"])]))
+            if len(result["heavy_modules"]) > 0:
+                print("  imports " + ", ".join(result["heavy_modules"]))
+            failed = failed or over_budget or len(result["heavy_modules"]) > 0
+        server.shutdown()
+        server.server_close()
+
+    if args.output != None:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# Generates reproducible synthetic source trees for benchmarks. The same seed
+# and shape always give the same tree (names, contents and symlinks), so scans
+# of trees generated on different machines or revisions are comparable.
+import argparse
+import hashlib
+import math
+import os
+import random
+import zlib
+
+# extension -> kind of generated content
+LANGUAGES = {
+    "c": "c", "h": "c", "cpp": "c", "py": "python", "js": "javascript", "sh": "shell", "md": "text",
+    "txt": "text", "json": "json", "csv": "csv", "png": "png", "o": "binary",
+}
+
+DEFAULT_MIX = "c=3,h=2,cpp=1,py=3,js=2,sh=1,md=1,txt=1,json=1,csv=1,png=1,o=1"
+
+# Build system files that make a directory a project.
+PROJECT_FILES = [
+    ("Makefile", "all:\n\tcc -o main main.c\n"),
+    ("CMakeLists.txt", "cmake_minimum_required(VERSION 3.10)\nproject(generated)\n"),
+    ("package.json", "{\n  \"name\": \"generated\",\n  \"version\": \"1.0.0\"\n}\n"),
+]
+
+WORDS = ["value", "count", "index", "buffer", "result", "name", "path", "size", "data", "node", "item", "state"]
+
+def parse_mix(text):
+    mix = []
+    for entry in text.split(","):
+        extension, _, weight = entry.partition("=")
+        mix.append((extension.strip(), float(weight) if weight != "" else 1.0))
+    return mix
+
+def source_line(rng, kind):
+    a, b = rng.choice(WORDS), rng.choice(WORDS)
+    number = rng.randint(0, 1000)
+    if kind == "c":
+        return rng.choice(["    int {} = {} + {};", "    {}[{}] = {};", "    if ({} > {}) return {};", "// {} {} {}"]).format(a, b, number)
+    if kind == "python":
+        return rng.choice(["    {} = {} + {}", "    {}.append({})  # {}", "    if {} > {}: return {}", "# {} {} {}"]).format(a, b, number)
+    if kind == "javascript":
+        return rng.choice(["  const {} = {} + {};", "  {}.push({}); // {}", "  if ({} > {}) return {};"]).format(a, b, number)
+    if kind == "shell":
+        return rng.choice(["{}={}{}", "echo \"${} ${}\" {}", "# {} {} {}"]).format(a, b, number)
+    if kind == "json":
+        return "  \"{}_{}\": {},".format(a, b, number)
+    if kind == "csv":
+        return "{},{},{}".format(a, b, number)
+    return "{} {} {}".format(a, b, number)
+
+def file_content(rng, kind, size):
+    if kind == "png":
+        return b"\x89PNG\r\n\x1a\n" + rng.randbytes(max(size - 8, 0))
+    if kind == "binary":
+        return b"\x7fELF" + rng.randbytes(max(size - 4, 0))
+
+    header = {"shell": "#!/bin/sh\n", "python": "#!/usr/bin/env python\n", "json": "{\n"}.get(kind, "")
+    lines = [header]
+    length = len(header)
+    while length < size:
+        line = source_line(rng, kind) + "\n"
+        lines.append(line)
+        length += len(line)
+    if kind == "json":
+        lines.append("  \"end\": 0\n}\n")
+    return "".join(lines).encode()
+
+def write_git_object(git_dir, type_name, content):
+    data = type_name.encode() + b" " + str(len(content)).encode() + b"\0" + content
+    sha = hashlib.sha1(data).hexdigest()
+    object_dir = os.path.join(git_dir, "objects", sha[:2])
+    os.makedirs(object_dir, exist_ok=True)
+    with open(os.path.join(object_dir, sha[2:]), "wb") as file:
+        file.write(zlib.compress(data))
+    return sha
+
+# Writes a repository with a single commit, without needing the git binary.
+def generate_git_repository(path, rng):
+    git_dir = os.path.join(path, ".git")
+    for directory in ["refs/heads", "refs/tags", "objects/info", "objects/pack"]:
+        os.makedirs(os.path.join(git_dir, directory))
+    with open(os.path.join(git_dir, "HEAD"), "w") as file:
+        file.write("ref: refs/heads/master\n")
+    with open(os.path.join(git_dir, "config"), "w") as file:
+        file.write("[core]\n\trepositoryformatversion = 0\n\tfilemode = true\n\tbare = false\n")
+
+    blob = write_git_object(git_dir, "blob", b"generated\n")
+    tree = write_git_object(git_dir, "tree", b"100644 README\0" + bytes.fromhex(blob))
+    timestamp = 1600000000 + rng.randint(0, 10 ** 7)
+    commit = write_git_object(git_dir, "commit", "tree {}\nauthor Bench <bench@example.com> {} +0000\ncommitter Bench <bench@example.com> {} +0000\n\nGenerated commit\n"
+                              .format(tree, timestamp, timestamp).encode())
+    with open(os.path.join(git_dir, "refs", "heads", "master"), "w") as file:
+        file.write(commit + "\n")
+
+class TreeStats:
+    def __init__(self):
+        self.files = 0
+        self.directories = 0
+        self.symlinks = 0
+        self.bytes = 0
+
+    def as_dict(self):
+        return {"files": self.files, "directories": self.directories, "symlinks": self.symlinks, "bytes": self.bytes}
+
+# Generates the tree into the existing, empty directory `root`. `shape` has the
+# attributes of the command line options below (see add_shape_arguments()).
+def generate_tree(root, shape):
+    rng = random.Random(shape.seed)
+    mix = parse_mix(shape.mix)
+    extensions = [extension for extension, _ in mix]
+    weights = [weight for _, weight in mix]
+    regular_files = []
+
+    def write_file(path, content):
+        with open(path, "wb") as file:
+            file.write(content)
+
+    def generate_special(path):
+        kind = rng.choice(["git", "node_modules", "__pycache__"])
+        if kind == "git":
+            generate_git_repository(path, rng)
+        elif kind == "node_modules":
+            for index in range(rng.randint(1, 3)):
+                module = os.path.join(path, "node_modules", "module{}".format(index))
+                os.makedirs(module)
+                write_file(os.path.join(module, "package.json"), PROJECT_FILES[2][1].encode())
+                write_file(os.path.join(module, "index.js"), file_content(rng, "javascript", 512))
+        else:
+            os.mkdir(os.path.join(path, "__pycache__"))
+            for index in range(rng.randint(1, 4)):
+                write_file(os.path.join(path, "__pycache__", "module{}.cpython-311.pyc".format(index)), rng.randbytes(256))
+
+    # Iterative, in a fixed order, so that deep trees don't hit the recursion limit.
+    stack = [(root, 0)]
+    while len(stack) > 0:
+        path, depth = stack.pop()
+
+        if rng.random() < shape.project_ratio:
+            name, content = rng.choice(PROJECT_FILES)
+            write_file(os.path.join(path, name), content.encode())
+        if rng.random() < shape.special_ratio:
+            generate_special(path)
+
+        for index in range(rng.randint(shape.files_per_directory // 2, shape.files_per_directory * 3 // 2)):
+            extension = rng.choices(extensions, weights)[0]
+            size = min(int(rng.lognormvariate(math.log(shape.median_size), shape.size_sigma)), shape.max_size)
+            file_path = os.path.join(path, "file{}.{}".format(index, extension))
+            write_file(file_path, file_content(rng, LANGUAGES.get(extension, "text"), size))
+            regular_files.append(file_path)
+
+            if rng.random() < shape.symlink_ratio:
+                link_path = os.path.join(path, "link{}.{}".format(index, extension))
+                # Some links point nowhere, like in real checkouts.
+                target = rng.choice(regular_files) if rng.random() < 0.9 else os.path.join(path, "missing")
+                os.symlink(os.path.relpath(target, path), link_path)
+
+        if depth < shape.depth:
+            for index in reversed(range(shape.fan_out)):
+                child = os.path.join(path, "dir{}".format(index))
+                os.mkdir(child)
+                stack.append((child, depth + 1))
+
+    return tree_stats(root)
+
+# Counts entries of a tree, not following symlinks.
+def tree_stats(root):
+    stats = TreeStats()
+    for dirpath, dirnames, filenames in os.walk(root):
+        stats.directories += 1
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path):
+                stats.symlinks += 1
+            elif name in filenames:
+                stats.files += 1
+                stats.bytes += os.path.getsize(path)
+    return stats
+
+def add_shape_arguments(parser):
+    parser.add_argument("--seed", help="random seed", type=int, default=0)
+    parser.add_argument("--depth", help="depth of directory tree", type=int, default=4)
+    parser.add_argument("--fan-out", help="subdirectories in each directory", type=int, default=4)
+    parser.add_argument("--files-per-directory", help="average number of files in each directory", type=int, default=20)
+    parser.add_argument("--mix", help="file extensions with weights, e.g. 'c=3,py=1'", default=DEFAULT_MIX)
+    parser.add_argument("--median-size", help="median file size in bytes (sizes are log-normal)", type=int, default=2048)
+    parser.add_argument("--size-sigma", help="sigma of log-normal file size distribution", type=float, default=1.5)
+    parser.add_argument("--max-size", help="maximum file size in bytes", type=int, default=4 << 20)
+    parser.add_argument("--special-ratio", help="probability of a nested .git, node_modules or __pycache__ in a directory", type=float, default=0.1)
+    parser.add_argument("--project-ratio", help="probability of a build system file in a directory", type=float, default=0.2)
+    parser.add_argument("--symlink-ratio", help="probability of a symlink next to a file", type=float, default=0.02)
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic source tree generator")
+    parser.add_argument("path", help="directory to create")
+    add_shape_arguments(parser)
+    args = parser.parse_args()
+
+    os.makedirs(args.path)
+    stats = generate_tree(args.path, args)
+    print("{} files, {} directories, {} symlinks, {} bytes".format(stats.files, stats.directories, stats.symlinks, stats.bytes))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import os
+import pickle
+import time
+
+from collections import OrderedDict
+
+import config as config
+from .detector import DetectorRegistry
+from .guess import FileType
+from .logging import *
+
+# Persistent cache of file guesses and directory listings, so that unchanged
+# files don't need to be read again on the next run.
+#
+# File guesses are keyed on (device, inode, size, mtime_ns), directory listings
+# on the directory mtime and repository commit counts on a fingerprint of all
+# ref tips. Entries are kept in LRU order; when the pickled cache
+# grows over `max_size` bytes, least recently used entries are dropped.
+class ScanCache:
+    instance = None
+    version = 2
+
+    # Files modified that recently may still change within the same mtime tick,
+    # so they aren't cached.
+    min_age_ns = 2 * 10**9
+
+    def __init__(self, path, **kwargs):
+        if ScanCache.instance == None:
+            ScanCache.instance = self
+        else:
+            raise AssertionError("Double singleton")
+
+        self.path = path
+        self.max_size = kwargs.get("max_size")
+        self.cwd = os.getcwd()
+        self.files = OrderedDict()
+        self.directories = OrderedDict()
+        self.repositories = OrderedDict()
+        self.modified = False
+        self.settings = None
+
+        if not kwargs.get("rebuild"):
+            self.load()
+
+    @staticmethod
+    def default_path():
+        cache_home = os.environ.get("XDG_CACHE_HOME")
+        if cache_home == None or cache_home == "":
+            cache_home = os.path.join(os.path.expanduser("~"), ".cache")
+        return os.path.join(cache_home, "project-status", "scan-cache.pickle")
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as file:
+                data = pickle.load(file)
+        except FileNotFoundError:
+            return
+        except Exception:
+            print_error("Failed to load scan cache " + self.path + ", ignoring it")
+            return
+
+        if not isinstance(data, dict) or data.get("version") != ScanCache.version:
+            return
+        self.files = data["files"]
+        self.directories = data["directories"]
+        self.repositories = data["repositories"]
+
+    def save(self):
+        if not self.modified:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            data = self.serialize()
+            temp_path = self.path + "." + str(os.getpid())
+            with open(temp_path, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, self.path)
+            self.modified = False
+        except OSError:
+            excinfo = sys.exc_info()[1]
+            print_error("Failed to save scan cache " + self.path + ": " + str(excinfo.strerror))
+
+    def serialize(self):
+        while True:
+            data = pickle.dumps({"version": ScanCache.version, "files": self.files, "directories": self.directories,
+                                 "repositories": self.repositories}, protocol=pickle.HIGHEST_PROTOCOL)
+            if self.max_size == None or len(data) <= self.max_size or len(self.files) + len(self.directories) + len(self.repositories) == 0:
+                return data
+
+            # Drop the least recently used entries in proportion to the overflow.
+            fraction = 1 - self.max_size / len(data) * 0.9
+            for entries in (self.files, self.directories, self.repositories):
+                for _ in range(int(len(entries) * fraction) + 1):
+                    if len(entries) == 0:
+                        break
+                    entries.popitem(last=False)
+
+    # `path` of the file can be given when it's known.
+    def key(self, file, path=None):
+        return os.path.normpath(os.path.join(self.cwd, path if path != None else file.path))
+
+    # Guesses depend on the command line too, so it's stored with every entry.
+    def current_settings(self):
+        if self.settings == None:
+            include = tuple(name for name in config.args.include if name.startswith("/"))
+            exclude = tuple(name for name in config.args.exclude if name.startswith("/"))
+            self.settings = (config.args.no_open, include, exclude)
+        return self.settings
+
+    def get_guesses(self, file, path=None):
+        if not file.has_stat():
+            return None
+
+        key = self.key(file, path)
+        entry = self.files.get(key)
+        if entry == None:
+            return None
+
+        stat_key, settings, compact_guesses = entry
+        if stat_key != file.stat_key() or settings != self.current_settings():
+            return None
+
+        self.files.move_to_end(key)
+        return DetectorRegistry.instance.expand_guesses(compact_guesses)
+
+    def put_guesses(self, file, guesses, path=None):
+        if not file.has_stat() or time.time_ns() - file.st_mtime_ns < ScanCache.min_age_ns:
+            return
+
+        # Version control state isn't covered by the file stat.
+        for guess in guesses:
+            if guess.file_type.clazz == FileType.Class.VersionControl:
+                return
+
+        key = self.key(file, path)
+        self.files[key] = (file.stat_key(), self.current_settings(), DetectorRegistry.instance.compact_guesses(guesses))
+        self.files.move_to_end(key)
+        self.modified = True
+
+    # Returns list of (name, is directory, is symlink) or None.
+    def get_listing(self, directory):
+        if not directory.has_stat():
+            return None
+
+        key = self.key(directory)
+        entry = self.directories.get(key)
+        if entry == None or entry[0] != directory.st_mtime_ns:
+            return None
+
+        self.directories.move_to_end(key)
+        return entry[1]
+
+    def put_listing(self, directory, listing):
+        if not directory.has_stat() or time.time_ns() - directory.st_mtime_ns < ScanCache.min_age_ns:
+            return
+
+        key = self.key(directory)
+        self.directories[key] = (directory.st_mtime_ns, listing)
+        self.directories.move_to_end(key)
+        self.modified = True
+
+    def get_commit_count(self, file, fingerprint):
+        key = self.key(file)
+        entry = self.repositories.get(key)
+        if entry == None or entry[0] != fingerprint:
+            return None
+
+        self.repositories.move_to_end(key)
+        return entry[1]
+
+    def put_commit_count(self, file, fingerprint, commit_count):
+        key = self.key(file)
+        self.repositories[key] = (fingerprint, commit_count)
+        self.repositories.move_to_end(key)
+        self.modified = True
@@ -0,0 +1,104 @@
+import json
+import os
+import shutil
+import stat
+import sys
+
+from .logging import *
+
+# `project-status serve` keeps scanned trees in memory and answers queries of
+# the commands below over a Unix socket, so that repeated queries don't pay for
+# startup and a full scan. Other commands and --stream always run locally.
+#
+# Protocol: the client sends one JSON line {"args": parsed command line,
+# "cwd": ..., "ansi": ..., "unicode": ..., "columns": ...}, and the server
+# replies with JSON lines {"stdout": text} and {"stderr": text} in the order
+# output was written, followed by {"exit": status}, once the query is answered.
+#
+# This is the client side, which every command imports; the server is in
+# ps.server. Modules which only some queries need are imported when used.
+SERVED_COMMANDS = ["list", "list-files", "info", "display-tree"]
+
+# Without $XDG_RUNTIME_DIR, the socket is in a directory of the user's own in
+# /tmp, which `serve` creates (see ps.server.check_socket_directory()).
+def default_socket_path():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir == None or runtime_dir == "":
+        import tempfile
+        return os.path.join(tempfile.gettempdir(), "project-status-{}".format(os.getuid()), "server.sock")
+    return os.path.join(runtime_dir, "project-status.sock")
+
+# Output of a server is only trusted when it's run by the same user. Other
+# users can create files in places like /tmp, so the socket must be ours, and
+# so must be the process listening on it (checked in query()).
+def is_own_socket(path):
+    try:
+        status = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(status.st_mode) and status.st_uid == os.getuid()
+
+# Sends a request and yields reply messages. Raises OSError if no server is
+# listening on `socket_path` or it's run by another user, and TimeoutError (an
+# OSError) if the server doesn't reply in `timeout` seconds.
+def query(socket_path, request, timeout=None):
+    import socket
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(timeout)
+    try:
+        connection.connect(socket_path)
+        if hasattr(socket, "SO_PEERCRED"):
+            import struct
+            credentials = struct.Struct("3i")
+            pid, uid, gid = credentials.unpack(connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, credentials.size))
+            if uid != os.getuid():
+                raise PermissionError("Server at " + socket_path + " is run by another user")
+        with connection.makefile("rwb") as stream:
+            stream.write(json.dumps(request).encode() + b"\n")
+            stream.flush()
+            for line in stream:
+                yield json.loads(line)
+    finally:
+        connection.close()
+
+# Runs the command of `args` in the server and copies its output to ours.
+# Returns exit status, or None if no server is running or it doesn't start
+# replying in --server-timeout seconds (for example, because it's busy
+# scanning), so that the command runs here. Once output was copied, it's too
+# late for that.
+def run_in_server(socket_path, args):
+    # Don't pay for importing socket when there is no server.
+    if not os.path.lexists(socket_path):
+        return None
+    if not is_own_socket(socket_path):
+        print_error("Not asking the server at " + socket_path + ", it's not a socket of this user")
+        return None
+    request = {
+        "args": vars(args),
+        "cwd": os.getcwd(),
+        "ansi": allow_ansi_escape_codes(),
+        "unicode": allow_unicode(),
+        "columns": shutil.get_terminal_size()[0],
+    }
+    messages = query(socket_path, request, args.server_timeout)
+    try:
+        message = next(messages)
+    except PermissionError:
+        print_error(str(sys.exc_info()[1]))
+        return None
+    except (OSError, StopIteration):
+        return None
+    
+    while True:
+        if "stdout" in message:
+            sys.stdout.write(message["stdout"])
+        elif "stderr" in message:
+            sys.stdout.flush()
+            sys.stderr.write(message["stderr"])
+        elif "exit" in message:
+            return message["exit"]
+        try:
+            message = next(messages)
+        except (OSError, StopIteration):
+            print_error("Connection to server at " + socket_path + " lost")
+            return 1
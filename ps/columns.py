@@ -0,0 +1,233 @@
+import array
+
+# Scan results kept as parallel columns, so that `info` can compute totals and
+# breakdowns with group-by operations instead of loops over guesses. Rows are
+# added by collapse_tree() while it walks the tree anyway. Columns are stdlib
+# arrays; queries use NumPy views of them if it's available and there are
+# enough rows to make up for importing it.
+#
+# There are three tables:
+#  - guesses: type id, file size, lines of code (-1 if not known) and file count
+#    of every guess of every file and directory, before collapsing;
+#  - files: extension id, directory row and size of every regular file;
+#  - directories: parent row of every directory, in post-order.
+
+NUMPY_MIN_ROWS = 1 << 17
+
+numpy = None
+numpy_imported = False
+
+def import_numpy():
+    global numpy, numpy_imported
+    if not numpy_imported:
+        numpy_imported = True
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+    return numpy
+
+class ColumnStore:
+    instance = None
+
+    def __init__(self, **kwargs):
+        if ColumnStore.instance == None:
+            ColumnStore.instance = self
+        else:
+            raise AssertionError("Double singleton")
+
+        self.allow_numpy = kwargs.get("use_numpy") != False
+        self.use_numpy = False
+
+        self.type_ids = {}
+        # Cache of type ids by (interned) FileType.
+        self.type_ids_by_file_type = {}
+        self.extension_ids = {}
+        self.extensions = []
+
+        self.guess_type = array.array("q")
+        self.guess_size = array.array("q")
+        self.guess_lines = array.array("q")
+        self.guess_file_count = array.array("q")
+
+        self.file_extension = array.array("q")
+        self.file_directory = array.array("q")
+        self.file_size = array.array("q")
+
+        self.directory_parent = array.array("q")
+        self.directories = []
+        # Rows of directories whose parent wasn't added yet.
+        self.pending_directory_rows = {}
+
+    def type_id(self, file_type):
+        key = (file_type.clazz, file_type.value)
+        type_id = self.type_ids.get(key)
+        if type_id == None:
+            type_id = len(self.type_ids)
+            self.type_ids[key] = type_id
+        self.type_ids_by_file_type[file_type] = type_id
+        return type_id
+
+    def add_guesses(self, guesses):
+        type_ids = self.type_ids_by_file_type
+        for guess in guesses:
+            type_id = type_ids.get(guess.file_type)
+            self.guess_type.append(type_id if type_id != None else self.type_id(guess.file_type))
+            # Fixed attributes are read from the slots directly, this runs for every file.
+            self.guess_size.append(guess.m_file_size or 0)
+            self.guess_lines.append(guess.m_lines_of_code if guess.m_lines_of_code != None else -1)
+            self.guess_file_count.append(guess.m_file_count or 0)
+
+    # Directories must be added after their subdirectories, with their own
+    # guesses (before children were collapsed into them).
+    def add_directory(self, directory, guesses):
+        row = len(self.directories)
+        self.directories.append(directory)
+        self.directory_parent.append(-1)
+        self.add_guesses(guesses)
+
+        for file in directory.files.values():
+            if file.is_directory():
+                child_row = self.pending_directory_rows.pop(id(file), None)
+                if child_row != None:
+                    self.directory_parent[child_row] = row
+                else:
+                    # Collapsed before the store existed; only its totals are known.
+                    self.add_guesses(file.collapsed_guesses())
+                continue
+
+            extension_id = self.extension_ids.get(file.extension)
+            if extension_id == None:
+                extension_id = len(self.extensions)
+                self.extension_ids[file.extension] = extension_id
+                self.extensions.append(file.extension)
+            self.file_extension.append(extension_id)
+            self.file_directory.append(row)
+            self.file_size.append(file.size())
+            self.add_guesses(file.guesses())
+
+        self.pending_directory_rows[id(directory)] = row
+
+    # Queries call it first to decide whether to use NumPy.
+    def prepare(self):
+        self.use_numpy = self.allow_numpy and len(self.guess_type) + len(self.file_size) >= NUMPY_MIN_ROWS and import_numpy() != None
+
+    def column(self, values):
+        if self.use_numpy:
+            return numpy.frombuffer(values, dtype=numpy.int64) if len(values) > 0 else numpy.zeros(0, dtype=numpy.int64)
+        return values
+
+    # Returns, for every guess in `guesses` (of distinct types), the sum of the
+    # attribute over all rows of its type, or None if no row has it.
+    def totals(self, guesses, attribute):
+        column = {"file_size": self.guess_size, "lines_of_code": self.guess_lines, "file_count": self.guess_file_count}[attribute]
+        type_count = len(self.type_ids)
+
+        self.prepare()
+        if self.use_numpy:
+            types = self.column(self.guess_type)
+            values = self.column(column)
+            present = values >= 0
+            sums = numpy.zeros(type_count, dtype=numpy.int64)
+            numpy.add.at(sums, types[present], values[present])
+            has_value = numpy.bincount(types[present], minlength=type_count) > 0
+            sums = sums.tolist()
+            has_value = has_value.tolist()
+        else:
+            sums = [0] * type_count
+            has_value = [False] * type_count
+            for type_id, value in zip(self.guess_type, column):
+                if value >= 0:
+                    sums[type_id] += value
+                    has_value[type_id] = True
+
+        result = []
+        for guess in guesses:
+            type_id = self.type_ids.get((guess.file_type.clazz, guess.file_type.value))
+            result.append(sums[type_id] if type_id != None and has_value[type_id] else None)
+        return result
+
+    # Returns (extension, file count, total size, [size percentiles]) for every
+    # extension, by decreasing total size. Percentiles are linearly interpolated.
+    def extension_breakdown(self, percentiles):
+        extension_count = len(self.extensions)
+        if extension_count == 0:
+            return []
+
+        self.prepare()
+        if self.use_numpy:
+            extensions = self.column(self.file_extension)
+            sizes = self.column(self.file_size)
+            order = numpy.lexsort((sizes, extensions))
+            sorted_sizes = sizes[order].astype(numpy.float64)
+            counts = numpy.bincount(extensions, minlength=extension_count)
+            totals = numpy.bincount(extensions, weights=sizes, minlength=extension_count).astype(numpy.int64)
+            starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+
+            values = []
+            for percentile in percentiles:
+                position = (counts - 1) * (percentile / 100)
+                lower = numpy.floor(position).astype(numpy.int64)
+                upper = numpy.ceil(position).astype(numpy.int64)
+                lower_values = sorted_sizes[starts + lower]
+                upper_values = sorted_sizes[starts + upper]
+                values.append((lower_values + (upper_values - lower_values) * (position - lower)).tolist())
+            counts = counts.tolist()
+            totals = totals.tolist()
+            values = [list(row) for row in zip(*values)]
+        else:
+            groups = [[] for _ in range(extension_count)]
+            for extension_id, size in zip(self.file_extension, self.file_size):
+                groups[extension_id].append(size)
+            counts = [len(group) for group in groups]
+            totals = [sum(group) for group in groups]
+            values = []
+            for group in groups:
+                group.sort()
+                values.append([interpolate_percentile(group, percentile) for percentile in percentiles])
+
+        result = [(self.extensions[index], counts[index], totals[index], values[index]) for index in range(extension_count)]
+        result.sort(key=lambda row: row[2], reverse=True)
+        return result
+
+    # Returns (directory, total size of files in its subtree) for the `count`
+    # directories with most data.
+    def largest_directories(self, count):
+        directory_count = len(self.directories)
+        self.prepare()
+        if self.use_numpy:
+            totals = numpy.bincount(self.column(self.file_directory), weights=self.column(self.file_size), minlength=directory_count)
+            totals = totals.astype(numpy.int64).tolist()
+        else:
+            totals = [0] * directory_count
+            for row, size in zip(self.file_directory, self.file_size):
+                totals[row] += size
+
+        # Rows are in post-order, so children are summed before their parents.
+        for row in range(directory_count):
+            parent = self.directory_parent[row]
+            if parent >= 0:
+                totals[parent] += totals[row]
+
+        rows = sorted(range(directory_count), key=lambda row: totals[row], reverse=True)[:count]
+        return [(self.directories[row], totals[row]) for row in rows]
+
+def interpolate_percentile(sorted_values, percentile):
+    position = (len(sorted_values) - 1) * (percentile / 100)
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+# Returns indices sorting `values` (None counting as 0), keeping order of ties.
+def sort_order(values):
+    values = [value if value != None else 0 for value in values]
+    if numpy != None and len(values) > 0:
+        return numpy.argsort(numpy.array(values, dtype=numpy.int64), kind="stable").tolist()
+    return sorted(range(len(values)), key=lambda index: values[index])
+
+# Returns value * scale // total for every value (None counting as 0).
+def shares(values, scale, total):
+    values = [value if value != None else 0 for value in values]
+    if numpy != None and len(values) > 0:
+        return (numpy.array(values, dtype=numpy.int64) * scale // total).tolist()
+    return [value * scale // total for value in values]
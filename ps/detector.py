@@ -1,4 +1,10 @@
-from .guessers import FileGuess
+import re
+import time
+
+from .filters import FileFilter
+from .guess import FileGuess, FileType
+from .logging import *
+from .profile import Profiler
 
 class FileTypeGuesser:
     def guess(self, file):
@@ -14,56 +20,183 @@ class DetectorRegistry:
             raise AssertionError("Double singleton")
         
         self.file_type_guessers = {}
+        self.guessers_by_name = {}
+        # (name, factory, description, priority) of guessers not created yet.
+        self.lazy_guessers = []
+        self.index_compiled = False
+        self.index_filter = None
         
     def register_file_type_guesser(self, name, guesser, **kwargs):
         guesser.name = name
+        self.guessers_by_name[name] = guesser
         priority = kwargs.get("priority")
         priority = priority if priority != None else 0
         if not priority in self.file_type_guessers:
             self.file_type_guessers[priority] = []
         self.file_type_guessers[priority].append(guesser)
+        self.index_compiled = False
+
+    # Registers a guesser created by `factory` (a class or function in
+    # ps.guessers) when guessers are first needed, so that commands which don't
+    # guess anything don't import them.
+    def register_lazy_guesser(self, name, factory, description, **kwargs):
+        self.lazy_guessers.append((name, factory, description, kwargs.get("priority")))
+        self.index_compiled = False
+
+    def load_guessers(self):
+        if len(self.lazy_guessers) == 0:
+            return
+        from . import guessers
+        lazy_guessers = self.lazy_guessers
+        self.lazy_guessers = []
+        for name, factory, description, priority in lazy_guessers:
+            self.register_file_type_guesser(name, getattr(guessers, factory)(description), priority=priority)
+
+    # Names of all guessers by priority, without loading them.
+    def guesser_names(self):
+        names = {}
+        for priority, guesser_list in self.file_type_guessers.items():
+            names.setdefault(priority, []).extend([guesser.name for guesser in guesser_list])
+        for name, factory, description, priority in self.lazy_guessers:
+            names.setdefault(priority if priority != None else 0, []).append(name)
+        return names
+
+    def guesser(self, name):
+        self.load_guessers()
+        return self.guessers_by_name[name]
+
+    # Guessers disabled by --include/--exclude are left out of the index.
+    def compile_index(self):
+        self.load_guessers()
+        self.index_filter = FileFilter.instance
+        self.extension_index = {}
+        self.basename_index = {}
+        self.pattern_index = []
+        self.fallback_guessers = []
+        self.candidates_by_extension = {}
+
+        order = 0
+        for guesser_list in self.file_type_guessers.values():
+            for guesser in guesser_list:
+                guesser.order = order
+                order += 1
+                if self.index_filter != None and not self.index_filter.is_guesser_active(guesser.name):
+                    continue
+
+                for extension in guesser.extensions:
+                    self.extension_index.setdefault(extension, []).append(guesser)
+                for basename in guesser.basenames:
+                    self.basename_index.setdefault(basename, []).append(guesser)
+                for pattern in guesser.patterns:
+                    self.pattern_index.append((re.compile(pattern), guesser))
+
+                if len(guesser.extensions) == 0 and len(guesser.basenames) == 0 and len(guesser.patterns) == 0:
+                    self.fallback_guessers.append(guesser)
+
+        self.index_compiled = True
+
+    def candidate_guessers(self, file):
+        if not self.index_compiled or self.index_filter is not FileFilter.instance:
+            self.compile_index()
+
+        # Guessers matching by extension (plus the fallback ones) are the same for
+        # every file with that extension, so merge them once.
+        candidates = self.candidates_by_extension.get(file.extension)
+        if candidates == None:
+            candidates = self.fallback_guessers + self.extension_index.get(file.extension, [])
+            candidates.sort(key=lambda guesser: guesser.order)
+            self.candidates_by_extension[file.extension] = candidates
+
+        extra = self.basename_index.get(file.basename, [])
+        for pattern, guesser in self.pattern_index:
+            if pattern.search(file.basename):
+                extra = extra + [guesser]
+
+        if len(extra) == 0:
+            return candidates
+        return sorted(set(candidates).union(extra), key=lambda guesser: guesser.order)
         
     def guess_file_type(self, file):
         matching_guesses = []
         type_classes = set()
+        profiler = Profiler.instance
         
-        """
-        If the file has multiple guesses, just one need to be in include/exclude list
-        # to be included/excluded.
-        """
-        for guesser_list in self.file_type_guessers.values():
-            for guesser in guesser_list:
-                # Exclude/include
-                if "/" + guesser.name in config.args.exclude:
-                    continue
-
-                if len(config.args.include) > 0 and not "/" + guesser.name in config.args.include:
-                    continue
-                
-                # Actual guess
+        for guesser in self.candidate_guessers(file):
+            # Actual guess
+            if profiler == None:
                 guess = guesser.guess(file)
-                if guess != None:
-                    guess_added = []
-                    for one_guess in guess:
-                        one_guess.guesser = guesser
-                        one_guess.attributes["file_count"] = 1
-                        try:
-                            one_guess.attributes["file_size"] = os.path.getsize(file.path)
-                        except:
-                            one_guess.attributes["file_size"] = 0
-                            
-                        if not one_guess.file_type.clazz in type_classes:
-                            type_classes.add(one_guess.file_type.clazz)
-                            guess_added.append(one_guess)
+            else:
+                start = time.perf_counter()
+                guess = guesser.guess(file)
+                profiler.add_guesser_call(guesser.name, time.perf_counter() - start)
+            if guess != None:
+                guess_added = []
+                for one_guess in guess:
+                    one_guess.guesser = guesser
+                    one_guess.set_attribute("file_count", 1)
+                    one_guess.set_attribute("file_size", file.size())
                         
-                    matching_guesses += guess_added
+                    if not one_guess.file_type.clazz in type_classes:
+                        type_classes.add(one_guess.file_type.clazz)
+                        guess_added.append(one_guess)
                     
+                matching_guesses += guess_added
+                
+        file.release_content()
+        
         if len(matching_guesses) == 0:
             print_verbose("Couldn't guess file type: " + file.path)
         
         return matching_guesses
 
-from .guessers import *
+    # Guesses as plain tuples, so that they can be sent between processes or stored.
+    def compact_guesses(self, guesses):
+        return [(guess.guesser.name, guess.file_type.clazz, guess.file_type.value, guess.file_type.user_readable_value, dict(guess.attributes.items())) for guess in guesses]
+
+    def expand_guesses(self, compact_guesses):
+        guesses = []
+        for name, clazz, value, user_readable_value, attributes in compact_guesses:
+            guess = FileGuess(FileType.get(clazz, value, user_readable_value), **attributes)
+            guess.guesser = self.guesser(name)
+            guesses.append(guess)
+        return guesses
+
+# Guessers: name (used by --include/--exclude and in the scan cache), class or
+# function of ps.guessers creating it, description and priority. Guessers are
+# called in this order.
+GUESSERS = [
+    ("magic",     "magic_guesser",           "Guesser which uses file patterns to detect formats", -100),
+    ("asm",       "Guesser_Assembly",        "Assembly sources", 0),
+    ("ci",        "Guesser_CI",              "Continuous integration files", 0),
+    ("cmake",     "Guesser_CMake",           "CMake build system", 0),
+    ("compress",  "Guesser_CompressArchive", "Compressed and archive files", 0),
+    ("config",    "Guesser_ConfigGeneric",   "Generic config files", 0),
+    ("cpp",       "Guesser_Cpp",             "C++ and executable files", 0),
+    ("data",      "Guesser_Data",            "Data(base) files", 0),
+    ("docker",    "Guesser_Docker",          "Docker config files", 0),
+    ("document",  "Guesser_Document",        "Various document files", 0),
+    ("evs",       "Guesser_Evs",             "EvoScript sources", 0),
+    ("font",      "Guesser_Font",            "Font files", 0),
+    ("git",       "Guesser_Git",             "Git config files", 0),
+    ("image",     "Guesser_Image",           "Image (picture) files", 0),
+    ("inode",     "Guesser_Inode",           "Directories etc.", 0),
+    ("java",      "Guesser_Java",            "Java sources", 0),
+    ("js",        "Guesser_JavaScript",      "JS sources", 0),
+    ("make",      "Guesser_GNUMake",         "GNU Make build system", 0),
+    ("markup",    "Guesser_Markup",          "Markup/formatting languages", 0),
+    ("ninja",     "Guesser_Ninja",           "Ninja build system", 0),
+    ("node",      "Guesser_Node",            "Node.js / NPM build system", 0),
+    ("pycache",   "Guesser_Pycache",         "Python runtime (__pycache__)", 0),
+    ("python",    "Guesser_Python",          "Python sources", 0),
+    ("shell",     "Guesser_Shell",           "Shell scripts", 0),
+    ("sound",     "Guesser_Sound",           "Sound files", 0),
+    ("systemd ",  "Guesser_Systemd",         "systemd config", 0),
+    ("video",     "Guesser_Video",           "Videos", 0),
+    ("web",       "Guesser_Web",             "Web-related formats", 0),
+    ("signature", "signature_guesser",       "Guesser which uses file patterns to detect formats of otherwise unknown files", 90),
+    ("generic",   "Guesser_Generic",         "Plaintext and unknown files", 100),
+]
+
 DetectorRegistry()
-register_all_guessers(DetectorRegistry.instance)
-    
+for name, factory, description, priority in GUESSERS:
+    DetectorRegistry.instance.register_lazy_guesser(name, factory, description, priority=priority)
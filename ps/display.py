@@ -1,8 +1,9 @@
 import config as config
-import math
+import shutil
 
 from .logging import *
-from .guessers import FileGuess, FileType
+from .columns import ColumnStore, shares, sort_order
+from .guess import FileGuess, FileType
 
 colors = []
 
@@ -49,13 +50,11 @@ def generate_hsv_lookup_table(count):
 
 generate_hsv_lookup_table(9)
 
-def fancy_display(data, attribute, **kwargs):
+# `values` are the attribute values of guesses in `data`, or None if missing.
+def fancy_display(data, values, **kwargs):
     
     # Count total attribute value.
-    total_attribute_value = 0
-    for guess in data:
-        attribute_value = guess.attributes.get(attribute)
-        total_attribute_value += (attribute_value if attribute_value != None else 0)
+    total_attribute_value = sum(value for value in values if value != None)
 
     # Do not display anything if no data
     if total_attribute_value == 0:
@@ -63,22 +62,19 @@ def fancy_display(data, attribute, **kwargs):
         return
         
     # TODO: Display other guesses as "Other" category
-    display_size = os.get_terminal_size()[0]*3//4 - 10
+    display_size = terminal_width()*3//4 - 10
     total_line_count = 0
     
-    # Generate display size for each guess
-    for guess in data:
-        attribute_value = guess.attributes.get(attribute)
-        attribute_value = attribute_value if attribute_value != None else 0
-        format_display_size = int(attribute_value * display_size / total_attribute_value)
-        guess.attributes["format_display_size"] = format_display_size
+    # Generate display size and percentage for each guess
+    format_display_sizes = shares(values, display_size, total_attribute_value)
+    percentages = shares(values, 100, total_attribute_value)
 
     # Print list of guesses
     print()
     
-    for guess in reversed(data):
-        if guess.attributes.get(attribute) != None:
-            print(unicode(" • ") + guess.file_type.to_fancy_string() + sgr("32", (" (/" + guess.guesser.name + ")")) + " - " + sgr("1", str(guess.attributes.get(attribute))) + " " + kwargs.get("description"))
+    for guess, attribute_value in reversed(list(zip(data, values))):
+        if attribute_value != None:
+            print(unicode(" • ") + guess.file_type.to_fancy_string() + sgr("32", (" (/" + guess.guesser.name + ")")) + " - " + sgr("1", str(attribute_value)) + " " + kwargs.get("description"))
     
     # Display total
     print(unicode(" • ") + sgr("1;95;3", "Total") + " - " + sgr("1", str(total_attribute_value)) + " " + kwargs.get("description"))
@@ -88,51 +84,60 @@ def fancy_display(data, attribute, **kwargs):
 
     # Labels
     for i in range(len(data)):
-        attribute_value = data[i].attributes.get(attribute)
-        attribute_value = attribute_value if attribute_value != None else 0
-        
-        if data[i].attributes["format_display_size"] > 0:  
-            print("    ", end="")
-                    
+        if format_display_sizes[i] <= 0:
+            continue
+        line = ["    "]
         for j in range(i):
-            if data[i].attributes["format_display_size"] > 0 and data[j].attributes["format_display_size"] > 0:  
-                sgr_val = "38;2;" + str(HSV(colors[j % len(colors)], 0.5, 0.8).to_rgb())
-                print(sgr(sgr_val, unicode("│")) + (math.floor(data[j].attributes["format_display_size"] - 1) * " "), end="")
-        
-        if data[i].attributes["format_display_size"] > 0:  
-            sgr_val = "38;2;" + str(HSV(colors[i % len(colors)], 0.5, 0.8).to_rgb())
-            print(sgr(sgr_val, unicode("╭─── ")) + data[i].file_type.to_fancy_string() + " - " + sgr("1", str(attribute_value * 100 // total_attribute_value)) + "%")
+            if format_display_sizes[j] > 0:
+                line.append(sgr(label_color(j), unicode("│")) + (format_display_sizes[j] - 1) * " ")
+        line.append(sgr(label_color(i), unicode("╭─── ")) + data[i].file_type.to_fancy_string() + " - " + sgr("1", str(percentages[i])) + "%")
+        print("".join(line))
                     
     # Last lines
-    print("    ", end="")
+    line = ["    "]
     for j in range(len(data)):
-        if data[j].attributes["format_display_size"] > 0:
-            sgr_val = "38;2;" + str(HSV(colors[j % len(colors)], 0.5, 0.8).to_rgb())
-            spaces = math.floor(data[j].attributes["format_display_size"] - 1) * " "
-            print(sgr(sgr_val, unicode("│") + spaces), end="")
+        if format_display_sizes[j] > 0:
+            line.append(sgr(label_color(j), unicode("│") + (format_display_sizes[j] - 1) * " "))
     
     # The chart itself
-    print("\n    ", end="")
-    
-    color = 0
-    total_format_display_size = 0
-    for guess in data:
-        format_display_size = guess.attributes["format_display_size"]
-
-        range_val = math.floor(format_display_size)
-        for i in range(range_val):
-            v = ((((i / range_val) - 0.5) * 2)**2/2)/2 + 0.6
-            print(sgr("1;38;2;" + str(HSV(colors[color % len(colors)], 0.5, v).to_rgb()), unicode("▀")), end="")
-
-        color += 1
-        total_format_display_size += format_display_size
-    
-    other_display_size = display_size - total_format_display_size
-    for i in range(other_display_size):
-        v = ((((i / other_display_size) - 0.5) * 2)**2/2)/2 + 0.6
-        print(sgr("1;38;2;" + str(HSV(colors[color % len(colors)], 0, v).to_rgb()), unicode("▀")), end="")
-    
-    print("\n")
+    line.append("\n    ")
+    for color, format_display_size in enumerate(format_display_sizes):
+        line.append(chart_bar(color, 0.5, format_display_size))
+    line.append(chart_bar(len(format_display_sizes), 0, display_size - sum(format_display_sizes)))
+    print("".join(line) + "\n")
+
+# Colours and chart bars are computed once. Bars depend on formatting, which
+# differs between clients of the server.
+label_colors = {}
+chart_bars = {}
+
+def label_color(index):
+    color = label_colors.get(index)
+    if color == None:
+        color = "38;2;" + str(HSV(colors[index % len(colors)], 0.5, 0.8).to_rgb())
+        label_colors[index] = color
+    return color
+
+# Returns bar of `width` cells with brightness gradient, in colour number `index`.
+def chart_bar(index, saturation, width):
+    key = (index % len(colors), saturation, width, allow_ansi_escape_codes(), allow_unicode())
+    bar = chart_bars.get(key)
+    if bar == None:
+        cell = unicode("▀")
+        cells = []
+        for i in range(width):
+            v = ((((i / width) - 0.5) * 2)**2/2)/2 + 0.6
+            cells.append(sgr("1;38;2;" + str(HSV(colors[key[0]], saturation, v).to_rgb()), cell))
+        bar = "".join(cells)
+        chart_bars[key] = bar
+    return bar
+
+# Width of the terminal, or $COLUMNS or 80 when the output isn't a terminal.
+def terminal_width():
+    return shutil.get_terminal_size()[0]
+
+def print_header(text):
+    print("   -- " + sgr("1", text) + " --")
 
 def directory_fancy_display(dir):
     global colors
@@ -146,10 +151,6 @@ def directory_fancy_display(dir):
     def compare_guesses(guess):
         return guess.file_type.value
     
-    def compare_guesses_by_attribute(guess, attribute):
-        attribute = guess.attributes.get(attribute)
-        return attribute if attribute != None else 0
-    
     for guess in dir.collapsed_guesses():
         if guess.file_type.clazz == "$build":
             build_systems.append(guess)
@@ -164,11 +165,21 @@ def directory_fancy_display(dir):
 
     build_systems.sort(key=compare_guesses)
     cis.sort(key=compare_guesses)
-    formats_by_storage = sorted(formats, key=lambda guess : compare_guesses_by_attribute(guess, "file_size"))
-    formats.sort(key=lambda guess : compare_guesses_by_attribute(guess, "lines_of_code"))
     
-    def print_header(text):
-        print("   -- " + sgr("1", text) + " --")
+    # Totals over the whole tree, computed from the columns if they were collected.
+    store = ColumnStore.instance
+    def attribute_values(guesses, attribute):
+        if store != None and len(store.directories) > 0 and store.directories[-1] is dir:
+            return store.totals(guesses, attribute)
+        return [guess.attributes.get(attribute) for guess in guesses]
+    
+    def sorted_by_values(guesses, values):
+        order = sort_order(values)
+        return [guesses[index] for index in order], [values[index] for index in order]
+    
+    formats_by_storage, storage_values = sorted_by_values(formats, attribute_values(formats, "file_size"))
+    formats, code_values = sorted_by_values(formats, attribute_values(formats, "lines_of_code"))
+    build_system_file_counts = attribute_values(build_systems, "file_count")
     
     print()
     print_header("General")
@@ -206,10 +217,30 @@ def directory_fancy_display(dir):
             print("   - " + sgr("34", "Last commit: ") + guess.guesser.fancy_display_commit(head))
     
     print_header("Storage")
-    fancy_display(formats_by_storage, "file_size", description="bytes")
+    fancy_display(formats_by_storage, storage_values, description="bytes")
     
     print_header("Build systems")
-    fancy_display(build_systems, "file_count", description="config file(s)")
+    fancy_display(build_systems, build_system_file_counts, description="config file(s)")
     
     print_header("Code")
-    fancy_display(formats, "lines_of_code", description="line(s) of code")
+    fancy_display(formats, code_values, description="line(s) of code")
+
+def extension_fancy_display(store):
+    print_header("Extensions")
+    print()
+    rows = store.extension_breakdown([50, 90, 99])
+    if len(rows) == 0:
+        print(sgr("1;31", " (No data)\n"))
+        return
+    
+    for extension, file_count, total_size, percentiles in rows:
+        print(unicode(" • ") + sgr("1", extension if extension != "" else "(none)") + " - " + str(file_count) + " file(s), " + str(total_size) + " bytes"
+              + sgr("34", " (p50: {:.0f}, p90: {:.0f}, p99: {:.0f})".format(*percentiles)))
+    print()
+
+def largest_directories_fancy_display(store, count):
+    print_header("Largest directories")
+    print()
+    for directory, total_size in store.largest_directories(count):
+        print(unicode(" • ") + sgr("1;34", directory.path) + " - " + sgr("1", str(total_size)) + " bytes")
+    print()
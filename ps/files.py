@@ -1,13 +1,23 @@
+import concurrent.futures
 import copy
-import fnmatch
+import io
 import os
 
+from collections import OrderedDict
+
 import config as config
+from .cache import ScanCache
+from .columns import ColumnStore
 from .detector import DetectorRegistry
-from .guessers import FileType, FileGuess
+from .filters import FileFilter
+from .gitignore import IgnoreRules
+from .guess import FileType, FileGuess
 from .logging import *
+from .profile import Profiler, phase
 from .util import *
 
+# Keeps up to `maxfds` files open, closing the least recently used one when
+# another file needs to be opened.
 class FileDescriptorManager:
     instance = None
     
@@ -17,48 +27,167 @@ class FileDescriptorManager:
         else:
             raise AssertionError("Double singleton")
         
-        self.descriptor_queue = []
-        self.descriptors = {}
+        self.descriptors = OrderedDict()
         self.maxfds = maxfds
     
     def get_by_path(self, path):
-        # Pop from current position and move to front of queue
-        
         fd = self.descriptors.get(path)
-        if not fd in self.descriptor_queue:
+        if fd == None:
             return self.open_and_push_file(path)
-        else:
-            self.descriptor_queue.remove(fd)
-            self.descriptor_queue.append(fd)
-            return fd
+        self.descriptors.move_to_end(path)
+        return fd
             
     def open_and_push_file(self, path):
         print_verbose("open_and_push_file " + path)
-        if len(self.descriptor_queue) + 1 > self.maxfds:
-            fd = self.descriptor_queue[0]
+        if len(self.descriptors) + 1 > self.maxfds:
+            oldpath, fd = self.descriptors.popitem(last=False)
             print_verbose("too much fds opened, removing " + str(fd))
-            oldpath = fd.name
             fd.close()
-            del self.descriptor_queue[0]
-            if oldpath in self.descriptors:
-                del self.descriptors[oldpath]
+            if Profiler.instance != None:
+                Profiler.instance.count("fd evictions")
 
         try:
             fd = open(path, mode="rb")
-            self.descriptor_queue.append(fd)
-            self.descriptors[path] = len(self.descriptor_queue)
+            self.descriptors[path] = fd
+            if Profiler.instance != None:
+                Profiler.instance.count("files opened")
             return fd
         except OSError:
             excinfo = sys.exc_info()[1]
+            if Profiler.instance != None:
+                Profiler.instance.count("open failures")
             print_error("Failed to open file " + excinfo.filename + ": " + excinfo.strerror)
+    
+    def release(self, path):
+        fd = self.descriptors.pop(path, None)
+        if fd != None:
+            fd.close()
 
-class File:
-    def __init__(self, parent, path):
+# Reads contents of a file once. Guessers look at the head (see head()); those
+# needing the whole file register a consumer (having feed(buffer, length) and
+# finish()), and after all guessers ran the body is streamed once to all of
+# them, continuing after the already read head.
+class FileContent:
+    head_size = 4096
+    
+    def __init__(self, path):
         self.path = path
+        self.head_data = None
+        self.head_complete = False
+        self.consumers = []
+    
+    def descriptor(self):
+        return FileDescriptorManager.instance.get_by_path(self.path)
+    
+    def head(self, size):
+        if self.head_data == None or (len(self.head_data) < size and not self.head_complete):
+            fd = self.descriptor()
+            if fd == None:
+                self.head_data = b""
+                self.head_complete = True
+                return self.head_data
+            
+            read_size = max(size, FileContent.head_size)
+            fd.seek(0)
+            self.head_data = fd.read(read_size)
+            self.head_complete = len(self.head_data) < read_size
+            if Profiler.instance != None:
+                Profiler.instance.count("bytes read", len(self.head_data))
+        return self.head_data[:size]
+    
+    def add_consumer(self, consumer):
+        self.consumers.append(consumer)
+    
+    def stream(self):
+        if len(self.consumers) > 0:
+            fd = self.descriptor()
+            if fd != None:
+                try:
+                    offset = 0
+                    if self.head_data != None:
+                        offset = len(self.head_data)
+                        for consumer in self.consumers:
+                            consumer.feed(self.head_data, offset)
+                    
+                    if not self.head_complete:
+                        read = 0
+                        for buffer, length in read_blocks(fd, offset):
+                            read += length
+                            for consumer in self.consumers:
+                                consumer.feed(buffer, length)
+                        if Profiler.instance != None:
+                            Profiler.instance.count("bytes read", read)
+                    
+                    for consumer in self.consumers:
+                        consumer.finish()
+                except OSError:
+                    print_error("Failed to read file " + self.path + ": " + str(sys.exc_info()[1].strerror))
+        
+        FileDescriptorManager.instance.release(self.path)
+
+# Trees can have millions of entries, so nodes only keep their own name (the
+# path is built from parent links) and the fields of the stat result that are
+# actually used.
+class File:
+    __slots__ = ("name", "parent", "extension", "type_guesses", "file_content", "symlink", "st_dev", "st_ino", "st_size", "st_mtime_ns")
+    
+    def __init__(self, parent, path, **kwargs):
+        self.name = os.path.basename(path) if parent != None else path
         self.parent = parent
-        self.basename = os.path.basename(path)
-        self.extension = os.path.splitext(path)[1]
+        self.extension = sys.intern(os.path.splitext(self.name)[1])
         self.type_guesses = None
+        self.file_content = None
+        
+        # Type, size, mtime and inode all come from a single stat() done when the
+        # entry is listed; guessers and attribute collectors only read this cache.
+        entry = kwargs.get("entry")
+        self.symlink = False
+        stat_result = None
+        try:
+            if "stat_key" in kwargs:
+                self.symlink = kwargs.get("symlink")
+                stat_result = kwargs.get("stat_key")
+            elif "stat_result" in kwargs:
+                self.symlink = kwargs.get("symlink")
+                stat_result = kwargs.get("stat_result")
+            elif entry != None:
+                self.symlink = entry.is_symlink()
+                stat_result = entry.stat()
+            else:
+                self.symlink = os.path.islink(path)
+                stat_result = os.stat(path)
+        except OSError:
+            pass
+        
+        if isinstance(stat_result, tuple) and not isinstance(stat_result, os.stat_result):
+            self.st_dev, self.st_ino, self.st_size, self.st_mtime_ns = stat_result
+        elif stat_result != None:
+            self.st_dev, self.st_ino, self.st_size, self.st_mtime_ns = stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns
+        else:
+            self.st_dev, self.st_ino, self.st_size, self.st_mtime_ns = None, None, None, None
+    
+    @property
+    def path(self):
+        if self.parent == None:
+            return self.name
+        names = []
+        file = self
+        while file != None:
+            names.append(file.name)
+            file = file.parent
+        names.reverse()
+        return "/".join(names)
+    
+    @property
+    def basename(self):
+        return self.name if self.parent != None else os.path.basename(self.name)
+    
+    def has_stat(self):
+        return self.st_mtime_ns != None
+    
+    # Identifies the file contents as far as stat() can tell.
+    def stat_key(self):
+        return (self.st_dev, self.st_ino, self.st_size, self.st_mtime_ns)
         
     def __str__(self, depth=0, **kwargs):
         return depth_indent(depth) + sgr("33", self.path) + sgr("90", " -> ") + str(self.collapsed_guesses()) + "\n"
@@ -66,6 +195,12 @@ class File:
     def is_directory(self):
         return False
     
+    def is_symlink(self):
+        return self.symlink
+    
+    def size(self):
+        return self.st_size if self.st_size != None else 0
+    
     def guesses(self):
         if self.type_guesses == None:
             self.type_guesses = self.generate_guesses()
@@ -74,7 +209,20 @@ class File:
     def collapsed_guesses(self):
         return self.guesses()
     
-    def generate_guesses(self):
+    # Callers knowing the path give it, so that it isn't built from parent links.
+    def generate_guesses(self, path=None):
+        if ScanCache.instance == None or self.is_directory():
+            return self.guess_file_type(path)
+        
+        guesses = ScanCache.instance.get_guesses(self, path)
+        if guesses == None:
+            guesses = self.guess_file_type(path)
+            ScanCache.instance.put_guesses(self, guesses, path)
+        return guesses
+    
+    def guess_file_type(self, path):
+        if path != None and self.file_content == None and not self.is_directory():
+            self.file_content = FileContent(path)
         return DetectorRegistry.instance.guess_file_type(self)
     
     def is_special(self):
@@ -83,11 +231,18 @@ class File:
                 return True
         return False
     
-    def descriptor(self):
+    def content(self):
         if self.is_directory():
             return None
-        else:
-            return FileDescriptorManager.instance.get_by_path(self.path)
+        if self.file_content == None:
+            self.file_content = FileContent(self.path)
+        return self.file_content
+    
+    # Called when guessing is done; streams the body to consumers and closes the file.
+    def release_content(self):
+        if self.file_content != None:
+            self.file_content.stream()
+            self.file_content = None
         
     def print_fancy(self):
         print(self.path, end=" ")
@@ -103,101 +258,189 @@ class File:
                     break
 
 class Directory(File):
+    __slots__ = ("files", "m_is_project", "collapsed_type_guesses", "max_depth", "ignore_rules")
+    
     def __init__(self, parent, path, **kwargs):
         print_verbose(path)
-        File.__init__(self, parent, path)
+        File.__init__(self, parent, path, **kwargs)
         self.files = {}
         self.m_is_project = None
-        self.collapsed_type_guesses = []
+        self.collapsed_type_guesses = None
+        self.max_depth = kwargs.get("max_depth")
+        # Rules of --respect-gitignore, given for the root and derived from the
+        # parent's for subdirectories when they are listed.
+        self.ignore_rules = kwargs.get("ignore_rules")
+        
+        # With `defer_listing` the caller lists the directory later (see
+        # walk_directory()), otherwise the whole subtree is listed right away.
+        if kwargs.get("defer_listing"):
+            return
         
-        max_depth = kwargs.get("max_depth")
+        self.list_directory(visitor=kwargs.get("visitor"))
+            
+        # "Collapse" attributes.
+        if parent == None:
+            collapse_tree(self)
+    
+    # Returns subdirectories which weren't listed yet because of `defer_listing`.
+    # `visitor` is notified about every entry as soon as it's listed (see
+    # StreamVisitor); it's only supported when listing the whole subtree.
+    def list_directory(self, **kwargs):
+        visitor = kwargs.get("visitor")
+        if visitor != None:
+            visitor.enter_directory(self)
+        subdirectories = self.list_entries(**kwargs)
+        if visitor != None:
+            visitor.leave_directory(self)
+        return subdirectories
+    
+    def list_entries(self, **kwargs):
+        defer_listing = kwargs.get("defer_listing")
+        visitor = kwargs.get("visitor")
+        max_depth = self.max_depth
+        subdirectories = []
         
         if not self.should_traverse_into() or max_depth == 0:
-            print_verbose("Special path: " + path)
-            return
+            print_verbose("Special path: " + self.path)
+            return subdirectories
         
-        try:
-            for file in os.listdir(path):
-                isdir = os.path.isdir(path + "/" + file)
-                if self.should_be_excluded(file, isdir):
+        # Paths aren't stored, so build this one just once.
+        directory_path = self.path
+        file_filter = FileFilter.instance
+        relative_prefix = file_filter.relative_prefix(self) if file_filter != None else None
+        ignore_rules = self.ignore_rules
+        if ignore_rules == None and self.parent != None and self.parent.ignore_rules != None:
+            ignore_rules = self.ignore_rules = self.parent.ignore_rules.for_subdirectory(directory_path, self.name)
+        listing = ScanCache.instance.get_listing(self) if ScanCache.instance != None else None
+        if listing != None:
+            for file, isdir, symlink in listing:
+                if file_filter != None and file_filter.is_excluded(file, isdir, relative_prefix):
+                    continue
+                if ignore_rules != None and ignore_rules.is_ignored(file, isdir):
                     continue
                 
+                path = directory_path + "/" + file
+                try:
+                    stat_result = os.stat(path)
+                except OSError:
+                    stat_result = None
                 if isdir:
-                    self.files[file] = Directory(self, path + "/" + file, max_depth=max_depth-1 if max_depth != None else None)
+                    directory = Directory(self, path, max_depth=max_depth-1 if max_depth != None else None, stat_result=stat_result, symlink=symlink, defer_listing=defer_listing, visitor=visitor)
+                    self.files[directory.name] = directory
+                    subdirectories.append(directory)
                 else:
-                    self.files[file] = File(self, path + "/" + file)
+                    regular_file = File(self, path, stat_result=stat_result, symlink=symlink)
+                    self.files[regular_file.name] = regular_file
+                    if visitor != None:
+                        visitor.visit_file(regular_file)
+            return subdirectories
+        
+        try:
+            listing = []
+            with os.scandir(directory_path) as entries:
+                for entry in entries:
+                    file = entry.name
+                    isdir = entry.is_dir()
+                    listing.append((file, isdir, entry.is_symlink()))
+                    if file_filter != None and file_filter.is_excluded(file, isdir, relative_prefix):
+                        continue
+                    if ignore_rules != None and ignore_rules.is_ignored(file, isdir):
+                        continue
+                    
+                    if isdir:
+                        directory = Directory(self, directory_path + "/" + file, max_depth=max_depth-1 if max_depth != None else None, entry=entry, defer_listing=defer_listing, visitor=visitor)
+                        self.files[directory.name] = directory
+                        subdirectories.append(directory)
+                    else:
+                        regular_file = File(self, directory_path + "/" + file, entry=entry)
+                        self.files[regular_file.name] = regular_file
+                        if visitor != None:
+                            visitor.visit_file(regular_file)
+            if ScanCache.instance != None:
+                ScanCache.instance.put_listing(self, listing)
         except OSError:
             excinfo = sys.exc_info()[1]
             print_error("Failed to open file " + excinfo.filename + ": " + excinfo.strerror)
-            
-        # "Collapse" attributes.
-        if parent == None:
-            self.collapsed_type_guesses = self.generate_collapsed_guesses()
+        
+        return subdirectories
             
     def __str__(self, depth=0, **kwargs):
-        out = File.__str__(self, depth)
-        out = out[:-1]
-        out += (sgr("1;32", " (IS A PROJECT)\n") if self.should_display_as_project() else "\n")
-        for value in self.files.values():
-            if len(value.guesses()) > 0:
-                out = out + value.__str__(depth + 1)
-        return out
+        output = io.StringIO()
+        TreePrinter(output).print_tree(self, depth)
+        return output.getvalue()
     
     def is_directory(self):
         return True
     
     def is_project(self):
+        if self.m_is_project != None:
+            return self.m_is_project
+        
         has_non_mimetype_guess = False
         for file in self.files.values():
             for guess in file.collapsed_guesses():
                 if guess.file_type.clazz != FileType.Class.MimeType:
                     has_non_mimetype_guess = True
             
-        m_is_project = has_non_mimetype_guess
-        return m_is_project
+        self.m_is_project = has_non_mimetype_guess
+        return self.m_is_project
     
     def should_display_as_project(self):
-        if self.parent != None and self.parent.is_project():
-            # Don't allow nested projects for now.
+        if not self.is_project():
             return False
         
-        return self.is_project()
+        # Don't allow nested projects for now.
+        return self.parent == None or not self.parent.is_project()
+    
+    # Drops the subtree after it was streamed, keeping what the parent still needs.
+    # A project always makes its parent a project too (its collapsed guesses
+    # include the non-MIME ones), so this is known before the parent is finished.
+    def release_files(self):
+        self.collapsed_guesses()
+        if self.is_project() and self.parent != None:
+            self.parent.m_is_project = True
+        self.files = {}
     
     def collapsed_guesses(self):
-        if self.collapsed_type_guesses == []:
+        if self.collapsed_type_guesses == None:
             self.collapsed_type_guesses = self.generate_collapsed_guesses()
         return self.collapsed_type_guesses
     
-    def generate_collapsed_guesses(self):
-        if self.collapsed_type_guesses != []:
+    # Merges collapsed guesses of the children into own guesses, matched by
+    # (class, value). Children should be collapsed first (see collapse_tree()).
+    def generate_collapsed_guesses(self, guesses=None):
+        if self.collapsed_type_guesses != None:
             raise AssertionError("Collapsed guesses generated double")
         
-        guesses = DetectorRegistry.instance.guess_file_type(self)
+        if guesses == None:
+            guesses = DetectorRegistry.instance.guess_file_type(self)
+        
+        # Probes queued by guessers fill in attributes, which must be done
+        # before they are collapsed.
+        if ProcessProbeQueue.instance != None:
+            ProcessProbeQueue.instance.flush()
         
-        # FIXME: O(n^3) complexity?
+        guesses_by_type = {}
+        for guess in guesses:
+            guesses_by_type[(guess.file_type.clazz, guess.file_type.value)] = guess
+        
+        # Files are guessed here, with their paths built from this one.
+        directory_path = None
         for file in self.files.values():
+            if file.type_guesses == None and not file.is_directory():
+                if directory_path == None:
+                    directory_path = self.path
+                file.type_guesses = file.generate_guesses(directory_path + "/" + file.name)
             for other_guess in file.collapsed_guesses():
-                done = False
-                
-                # Find matching guess
-                guess = None
-                for my_guess in guesses:
-                    if my_guess.file_type.clazz == other_guess.file_type.clazz and my_guess.file_type.value == other_guess.file_type.value:
-                        guess = my_guess
-                
-                # If guess matches, collapse attributes
-                if guess != None:
-                    for name, value in other_guess.attributes.items():
-                        guess.collapse_attribute(name, value)
-                # Else, create a new guess
-                else:
+                key = (other_guess.file_type.clazz, other_guess.file_type.value)
+                guess = guesses_by_type.get(key)
+                if guess == None:
                     guess = FileGuess(other_guess.file_type)
                     guess.guesser = other_guess.guesser
                     guesses.append(guess)
-                    
-                    # Try to collapse attributes
-                    for name, value in other_guess.attributes.items():
-                        guess.collapse_attribute(name, value)
+                    guesses_by_type[key] = guess
+                
+                guess.collapse(other_guess)
 
         return guesses
     
@@ -217,27 +460,13 @@ class Directory(File):
     def should_traverse_into(self):
         return not self.is_special()
     
-    def should_be_excluded(self, filename, isdir):
-        for exclude_pattern in config.args.exclude:
-            if len(exclude_pattern) > 0 and not exclude_pattern.startswith("/") and fnmatch.fnmatch(filename, exclude_pattern):
-                return True
-        if len(config.args.include) > 0 and not isdir:
-            non_guesser_count = 0
-            for include_pattern in config.args.include:
-                if not include_pattern.startswith("/"):
-                    non_guesser_count += 1
-                    if len(include_pattern) > 0 and fnmatch.fnmatch(filename, include_pattern):
-                        return False
-            return non_guesser_count > 0
-        return False
-    
     def print_if_has_guesses(self, guesses):
         File.print_if_has_guesses(self, guesses)
         
         for file in self.files.values():
             file.print_if_has_guesses(guesses)
             
-    def print_project_log_for_guess(self, version_control, format):
+    def print_project_log_for_guess(self, version_control, format, **kwargs):
         matching_version_control_guess = None
         for guess in self.collapsed_guesses():
             if guess.file_type.clazz == "$version" and (guess.file_type.value == version_control or version_control == None):
@@ -246,7 +475,7 @@ class Directory(File):
                     return
                 matching_version_control_guess = guess
                 
-        matching_version_control_guess.guesser.print_log(self, format)
+        matching_version_control_guess.guesser.print_log(self, format, **kwargs)
         
     def run_build_command(self, build_system, command, **args):
         matching_build_system_guesses = []
@@ -295,3 +524,280 @@ class Directory(File):
             print_error("Exception while running build system command! " + str(sys.exc_info()))
             pass
         print_error("No working build system found!")
+
+def walk_directory(path, **kwargs):
+    jobs = kwargs.get("jobs")
+    processes = kwargs.get("processes")
+    visitor = kwargs.get("visitor")
+    ignore_rules = IgnoreRules.for_root(path) if kwargs.get("respect_gitignore") else None
+    root = Directory(None, path, max_depth=kwargs.get("max_depth"), defer_listing=True, ignore_rules=ignore_rules)
+    
+    # Streamed output is generated during the walk, which therefore can't be
+    # parallel. The visitor collapses what it needs itself.
+    if visitor != None:
+        with phase("list"):
+            root.list_directory(visitor=visitor)
+        return root
+    
+    with phase("list"):
+        if jobs == None or jobs <= 1:
+            root.list_directory()
+        else:
+            # Every directory is listed by one pool task, which queues the listing of its
+            # subdirectories. Each task fills only its own `files`, in listing order, so
+            # the tree is the same as the one built sequentially.
+            with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+                pending = {executor.submit(root.list_directory, defer_listing=True)}
+                while len(pending) > 0:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        for directory in future.result():
+                            pending.add(executor.submit(directory.list_directory, defer_listing=True))
+    
+    if processes != None and processes > 1:
+        with phase("guess in processes"):
+            guess_files_in_processes(root, processes)
+    
+    # Files not guessed yet are guessed when they are collapsed.
+    with phase("guess and collapse"):
+        collapse_tree(root)
+    return root
+
+# Collapses guesses of all directories in one post-order pass, so that every
+# directory merges only the already collapsed guesses of its children. It's
+# iterative, so that deep trees don't hit the recursion limit. All directories
+# are guessed before merging, so that probes queued by guessers run together.
+def collapse_tree(root):
+    directories = []
+    stack = [(root, False)]
+    while len(stack) > 0:
+        directory, children_done = stack.pop()
+        if children_done:
+            directories.append(directory)
+            continue
+        
+        stack.append((directory, True))
+        for file in directory.files.values():
+            if file.is_directory() and file.collapsed_type_guesses == None:
+                stack.append((file, False))
+    
+    own_guesses = [DetectorRegistry.instance.guess_file_type(directory) for directory in directories]
+    for directory, guesses in zip(directories, own_guesses):
+        # Own guesses are collapsed into, so they must be stored before.
+        if ColumnStore.instance != None:
+            ColumnStore.instance.add_directory(directory, guesses)
+        directory.collapsed_type_guesses = directory.generate_collapsed_guesses(guesses)
+
+def list_regular_files(directory):
+    files = []
+    directories = [directory]
+    while len(directories) > 0:
+        for file in directories.pop().files.values():
+            if file.is_directory():
+                directories.append(file)
+            elif file.type_guesses == None:
+                files.append(file)
+    return files
+
+def init_guess_worker(args, profile):
+    config.args = args
+    ScanCache.instance = None
+    ProcessProbeQueue.instance = None
+    FileDescriptorManager.instance = None
+    FileDescriptorManager()
+    FileFilter.instance = None
+    FileFilter(args.include, args.exclude)
+    Profiler.instance = None
+    if profile:
+        Profiler()
+
+def guess_files_shard(shard):
+    results = []
+    for path, parent_path, stat_key, symlink in shard:
+        parent = File(None, parent_path, stat_result=None, symlink=False)
+        file = File(parent, path, stat_key=stat_key, symlink=symlink)
+        results.append(DetectorRegistry.instance.compact_guesses(file.guesses()))
+    # Profiler counters are sent back with every shard.
+    return results, Profiler.instance.take_counters() if Profiler.instance != None else None
+
+# Guess regular files in worker processes. Directories are still guessed here,
+# since their guesses depend on the tree. Workers send back compact tuples which
+# are turned into FileGuesses again, so collapsing works as usual.
+def guess_files_in_processes(root, processes):
+    files = list_regular_files(root)
+    if ScanCache.instance != None:
+        missing_files = []
+        for file in files:
+            file.type_guesses = ScanCache.instance.get_guesses(file)
+            if file.type_guesses == None:
+                missing_files.append(file)
+        files = missing_files
+    if len(files) == 0:
+        return
+    
+    shard_size = max(1, min(1024, len(files) // (processes * 8)))
+    shards = []
+    for start in range(0, len(files), shard_size):
+        shards.append([(file.path, file.parent.path, file.stat_key() if file.has_stat() else None, file.symlink) for file in files[start:start + shard_size]])
+    
+    print_verbose("Guessing {} files in {} processes".format(len(files), processes))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=init_guess_worker, initargs=(config.args, Profiler.instance != None)) as executor:
+        offset = 0
+        for results, counters in executor.map(guess_files_shard, shards):
+            if counters != None:
+                Profiler.instance.merge_counters(counters)
+            for compact_guesses in results:
+                files[offset].type_guesses = DetectorRegistry.instance.expand_guesses(compact_guesses)
+                if ScanCache.instance != None:
+                    ScanCache.instance.put_guesses(files[offset], files[offset].type_guesses)
+                offset += 1
+
+# Receives entries during the walk: directories before (enter_directory()) and
+# after (leave_directory()) their contents, and files as they are listed.
+class StreamVisitor:
+    def enter_directory(self, directory):
+        pass
+    
+    def visit_file(self, file):
+        pass
+    
+    def leave_directory(self, directory):
+        pass
+
+# Same as `display-tree` but each directory is printed after its contents, as
+# soon as its subtree is finished. Paths of the directories being walked are
+# kept, so that entries' ones aren't built from parent links.
+class TreeStreamPrinter(StreamVisitor):
+    def __init__(self):
+        self.printer = TreePrinter()
+        self.paths = []
+        self.hidden_depth = None
+    
+    def is_hidden(self, file, path):
+        if self.hidden_depth != None:
+            return True
+        if file.type_guesses == None and not file.is_directory():
+            file.type_guesses = file.generate_guesses(path)
+        # Entries without guesses are not printed, and neither are their contents.
+        return file.parent != None and len(file.guesses()) == 0
+    
+    def enter_directory(self, directory):
+        self.paths.append(directory.name if directory.parent == None else self.paths[-1] + "/" + directory.name)
+        if self.hidden_depth == None and self.is_hidden(directory, self.paths[-1]):
+            self.hidden_depth = len(self.paths)
+    
+    def visit_file(self, file):
+        path = self.paths[-1] + "/" + file.name
+        if not self.is_hidden(file, path):
+            self.printer.write_entry(file, len(self.paths), path)
+            self.printer.flush()
+    
+    def leave_directory(self, directory):
+        directory.release_files()
+        if self.hidden_depth == None:
+            self.printer.write_entry(directory, len(self.paths) - 1, self.paths[-1],
+                                     self.printer.project_suffix if directory.should_display_as_project() else "\n")
+            self.printer.flush()
+        elif self.hidden_depth == len(self.paths):
+            self.hidden_depth = None
+        self.paths.pop()
+
+# Same as `list`. A directory can be displayed as a project only when its parent
+# is known not to be one, so projects are printed once the parent is finished.
+class ProjectStreamPrinter(StreamVisitor):
+    def leave_directory(self, directory):
+        if directory.parent == None and directory.should_display_as_project():
+            directory.print_as_project()
+        for file in directory.files.values():
+            if file.is_directory() and file.should_display_as_project():
+                file.print_as_project()
+        directory.release_files()
+
+# Same as `list-files`.
+class GuessStreamPrinter(StreamVisitor):
+    def __init__(self, guesses):
+        self.guesses = guesses
+    
+    def enter_directory(self, directory):
+        File.print_if_has_guesses(directory, self.guesses)
+    
+    def visit_file(self, file):
+        file.print_if_has_guesses(self.guesses)
+    
+    def leave_directory(self, directory):
+        directory.files = {}
+
+# Renders `display-tree` into `output` while walking the tree, in time linear
+# in the number of entries. Lines are written in chunks of about
+# OUTPUT_CHUNK_SIZE characters, so memory doesn't grow with the tree. Paths are
+# built from the parent's path, and indents and escape sequences are computed
+# once.
+class TreePrinter:
+    OUTPUT_CHUNK_SIZE = 1 << 16
+    
+    def __init__(self, output=None):
+        self.output = output if output != None else sys.stdout
+        self.path_start, self.path_end = sgr("33", "\0").split("\0")
+        self.arrow = sgr("90", " -> ")
+        self.project_suffix = sgr("1;32", " (IS A PROJECT)\n")
+        self.indents = [""]
+        # FileType -> start of repr() of its guesses (see FileGuess.__repr__()).
+        self.guess_prefixes = {}
+        self.chunk = []
+        self.chunk_size = 0
+    
+    def indent(self, depth):
+        while len(self.indents) <= depth:
+            self.indents.append(depth_indent(len(self.indents)))
+        return self.indents[depth]
+    
+    # Same as str() of the guess list.
+    def format_guesses(self, guesses):
+        parts = []
+        for guess in guesses:
+            prefix = self.guess_prefixes.get(guess.file_type)
+            if prefix == None:
+                prefix = sgr("1", "FileGuess") + " { " + sgr("3;34", "type: ") + str(guess.file_type) + "; " + sgr("3;34", "attributes: ")
+                self.guess_prefixes[guess.file_type] = prefix
+            parts.append(prefix + repr(dict(guess.attribute_items())) + " }")
+        return "[" + ", ".join(parts) + "]"
+    
+    # Same as File.__str__(), with `suffix` instead of the final "\n".
+    def write_entry(self, file, depth, path, suffix="\n"):
+        line = self.indent(depth) + self.path_start + path + self.path_end + self.arrow + self.format_guesses(file.collapsed_guesses()) + suffix
+        self.chunk.append(line)
+        self.chunk_size += len(line)
+        if self.chunk_size >= TreePrinter.OUTPUT_CHUNK_SIZE:
+            self.flush()
+    
+    def write_directory(self, directory, depth, path, parent_is_project):
+        # Same as should_display_as_project(), with the parent's status passed down.
+        is_project = directory.is_project()
+        self.write_entry(directory, depth, path, self.project_suffix if is_project and not parent_is_project else "\n")
+        return is_project
+    
+    def flush(self):
+        if len(self.chunk) > 0:
+            self.output.write("".join(self.chunk))
+            self.chunk = []
+            self.chunk_size = 0
+    
+    # Writes the same as str(root). Iterative, so that deep trees don't hit the
+    # recursion limit.
+    def print_tree(self, root, depth=0):
+        is_project = self.write_directory(root, depth, root.path, root.parent != None and root.parent.is_project())
+        stack = [(iter(root.files.values()), depth + 1, root.path, is_project)]
+        while len(stack) > 0:
+            files, depth, parent_path, parent_is_project = stack[-1]
+            for file in files:
+                if len(file.guesses()) == 0:
+                    continue
+                path = parent_path + "/" + file.name
+                if file.is_directory():
+                    is_project = self.write_directory(file, depth, path, parent_is_project)
+                    stack.append((iter(file.files.values()), depth + 1, path, is_project))
+                    break
+                self.write_entry(file, depth, path)
+            else:
+                stack.pop()
+        self.flush()
@@ -0,0 +1,121 @@
+import fnmatch
+import re
+
+# --include and --exclude, compiled once. Entries starting with "/" name
+# guessers; the others are file globs. Globs without "/" match the file name
+# (as fnmatch does), the others match the path relative to the scanned
+# directory, where "*" and "?" don't match "/" and "**" matches any number of
+# directories ("build/**" matches build and everything in it). All globs of a
+# kind are combined into one regex.
+class FileFilter:
+    instance = None
+
+    def __init__(self, include, exclude):
+        if FileFilter.instance == None:
+            FileFilter.instance = self
+        else:
+            raise AssertionError("Double singleton")
+
+        include_globs = [pattern for pattern in include if not pattern.startswith("/")]
+        exclude_globs = [pattern for pattern in exclude if not pattern.startswith("/")]
+
+        self.exclude_name = compile_name_globs(exclude_globs)
+        self.exclude_path = compile_path_globs(exclude_globs)
+        # Files are excluded unless they match an include glob, if there are any.
+        self.has_include_globs = len(include_globs) > 0
+        self.include_name = compile_name_globs(include_globs)
+        self.include_path = compile_path_globs(include_globs)
+        self.needs_paths = self.exclude_path != None or self.include_path != None
+
+        self.excluded_guessers = set(pattern[1:] for pattern in exclude if pattern.startswith("/"))
+        # Any --include disables guessers not listed in it.
+        self.included_guessers = set(pattern[1:] for pattern in include if pattern.startswith("/")) if len(include) > 0 else None
+
+    def is_guesser_active(self, name):
+        if name in self.excluded_guessers:
+            return False
+        return self.included_guessers == None or name in self.included_guessers
+
+    # Returns path of `directory` relative to the scanned one, with a trailing
+    # "/", to be passed to is_excluded() for its entries.
+    def relative_prefix(self, directory):
+        if not self.needs_paths:
+            return None
+        names = []
+        while directory.parent != None:
+            names.append(directory.name)
+            directory = directory.parent
+        return "".join(name + "/" for name in reversed(names))
+
+    def is_excluded(self, name, isdir, relative_prefix):
+        if self.exclude_name != None and self.exclude_name(name):
+            return True
+        if self.exclude_path != None and self.exclude_path(relative_prefix + name):
+            return True
+        if self.has_include_globs and not isdir:
+            if self.include_name != None and self.include_name(name):
+                return False
+            if self.include_path != None and self.include_path(relative_prefix + name):
+                return False
+            return True
+        return False
+
+# Returns match function of a regex matching any of the globs, or None.
+def combine(regexes):
+    if len(regexes) == 0:
+        return None
+    return re.compile("|".join("(?:" + regex + ")" for regex in regexes)).match
+
+def compile_name_globs(globs):
+    return combine([fnmatch.translate(glob) for glob in globs if glob != "" and not "/" in glob])
+
+def compile_path_globs(globs):
+    return combine([translate_path_glob(glob.strip("/")) for glob in globs if "/" in glob])
+
+def translate_path_glob(glob):
+    if glob.startswith("./"):
+        glob = glob[2:]
+    regex = ""
+    index = 0
+    while index < len(glob):
+        char = glob[index]
+        if glob.startswith("**/", index) and (index == 0 or glob[index - 1] == "/"):
+            regex += "(?:.*/)?"
+            index += 3
+            continue
+        if glob.startswith("**", index) and index + 2 == len(glob) and index > 0 and glob[index - 1] == "/":
+            # "dir/**" matches the directory itself too.
+            regex = regex[:-1] + "(?:/.*)?"
+            index += 2
+            continue
+        if char == "*":
+            if glob.startswith("**", index):
+                regex += ".*"
+                index += 2
+            else:
+                regex += "[^/]*"
+                index += 1
+            continue
+        if char == "?":
+            regex += "[^/]"
+        elif char == "[":
+            # Like in fnmatch, "]" right after "[" or "[!" is part of the set.
+            start = index + 1
+            if glob.startswith("!", start):
+                start += 1
+            if glob.startswith("]", start):
+                start += 1
+            end = glob.find("]", start)
+            if end == -1:
+                regex += re.escape(char)
+            else:
+                content = glob[index + 1:end]
+                if content.startswith("!"):
+                    content = "^" + content[1:]
+                regex += "[" + content.replace("\\", "\\\\") + "]"
+                index = end + 1
+                continue
+        else:
+            regex += re.escape(char)
+        index += 1
+    return "(?s:" + regex + r")\Z"
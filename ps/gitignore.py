@@ -0,0 +1,187 @@
+import os
+import re
+
+# Ignore rules of git (see gitignore(5)), used by --respect-gitignore to skip
+# ignored files and not to list ignored directories at all.
+#
+# Rules come from .gitignore files and .git/info/exclude. A later rule wins
+# over an earlier one in the same file, and rules of deeper .gitignore files
+# win over those of their parents, which win over info/exclude. A nested
+# repository (a directory containing .git) starts again with its own rules.
+# Global excludes (core.excludesFile) and the index aren't read, so files that
+# are tracked despite matching a rule are skipped too.
+
+class IgnoreRule:
+    __slots__ = ("match", "negate", "directory_only", "name_only")
+
+    def __init__(self, match, negate, directory_only, name_only):
+        self.match = match
+        self.negate = negate
+        self.directory_only = directory_only
+        # Rules without "/" (other than a trailing one) match names at any depth.
+        self.name_only = name_only
+
+# Rules of one file. Patterns are matched against paths relative to the
+# directory containing it.
+class IgnoreFile:
+    def __init__(self, lines):
+        self.rules = []
+        name_regexes = []
+        path_regexes = []
+        for line in lines:
+            rule = parse_rule(line)
+            if rule == None:
+                continue
+            regex, negate, directory_only, name_only = rule
+            self.rules.append(IgnoreRule(re.compile(regex).match, negate, directory_only, name_only))
+            (name_regexes if name_only else path_regexes).append(regex)
+
+        # Most entries don't match any rule, which these check at once.
+        self.match_any_name = re.compile("|".join(name_regexes)).match if len(name_regexes) > 0 else None
+        self.match_any_path = re.compile("|".join(path_regexes)).match if len(path_regexes) > 0 else None
+
+    @staticmethod
+    def load(path):
+        try:
+            with open(path, encoding="utf-8", errors="replace") as file:
+                ignore_file = IgnoreFile(file.read().split("\n"))
+        except OSError:
+            return None
+        return ignore_file if len(ignore_file.rules) > 0 else None
+
+    # Returns True if the entry is ignored, False if it is explicitly not
+    # ignored (by a "!" rule) and None if no rule matches.
+    def match(self, name, path, isdir):
+        if (self.match_any_name == None or self.match_any_name(name) == None) and (self.match_any_path == None or self.match_any_path(path) == None):
+            return None
+        for rule in reversed(self.rules):
+            if rule.directory_only and not isdir:
+                continue
+            if rule.match(name if rule.name_only else path) != None:
+                return not rule.negate
+        return None
+
+# Rules applying to entries of one directory: ignore files with the path of the
+# directory relative to each of them (as prefix ending with "/", or "").
+class IgnoreRules:
+    __slots__ = ("sources",)
+
+    def __init__(self, sources):
+        self.sources = sources
+
+    @staticmethod
+    def for_repository(path):
+        sources = []
+        for ignore_path in [os.path.join(path, ".git", "info", "exclude"), os.path.join(path, ".gitignore")]:
+            ignore_file = IgnoreFile.load(ignore_path)
+            if ignore_file != None:
+                sources.append((ignore_file, ""))
+        return IgnoreRules(tuple(sources))
+
+    # Rules for the scanned directory, including .gitignore files between it
+    # and the top of its repository.
+    @staticmethod
+    def for_root(path):
+        path = os.path.abspath(path)
+        top = path
+        while not os.path.exists(os.path.join(top, ".git")):
+            parent = os.path.dirname(top)
+            if parent == top:
+                # Not in a repository; use .gitignore files anyway.
+                top = path
+                break
+            top = parent
+
+        rules = IgnoreRules.for_repository(top)
+        if top != path:
+            current = top
+            for name in os.path.relpath(path, top).split(os.sep):
+                current = os.path.join(current, name)
+                rules = rules.for_subdirectory(current, name)
+        return rules
+
+    def for_subdirectory(self, path, name):
+        if os.path.exists(os.path.join(path, ".git")):
+            return IgnoreRules.for_repository(path)
+        sources = [(ignore_file, prefix + name + "/") for ignore_file, prefix in self.sources]
+        ignore_file = IgnoreFile.load(os.path.join(path, ".gitignore"))
+        if ignore_file != None:
+            sources.append((ignore_file, ""))
+        return IgnoreRules(tuple(sources))
+
+    def is_ignored(self, name, isdir):
+        for ignore_file, prefix in reversed(self.sources):
+            result = ignore_file.match(name, prefix + name, isdir)
+            if result != None:
+                return result
+        return False
+
+# Returns (regex, negate, directory only, name only) or None for blank lines
+# and comments.
+def parse_rule(line):
+    line = line.rstrip("\r")
+    # Trailing spaces are ignored unless escaped.
+    while line.endswith(" ") and not line.endswith("\\ "):
+        line = line[:-1]
+    if line == "" or line.startswith("#"):
+        return None
+
+    negate = line.startswith("!")
+    if negate:
+        line = line[1:]
+    directory_only = line.endswith("/")
+    if directory_only:
+        line = line[:-1]
+    name_only = not "/" in line
+    if line.startswith("/"):
+        line = line[1:]
+    if line == "":
+        return None
+    return "(?s:" + translate_pattern(line) + r")\Z", negate, directory_only, name_only
+
+def translate_pattern(pattern):
+    regex = ""
+    index = 0
+    length = len(pattern)
+    while index < length:
+        char = pattern[index]
+        if char == "*":
+            end = index
+            while end < length and pattern[end] == "*":
+                end += 1
+            # "**" is special only as a whole path component.
+            if end - index >= 2 and (index == 0 or pattern[index - 1] == "/") and (end == length or pattern[end] == "/"):
+                if end == length:
+                    regex += ".*"
+                else:
+                    regex += "(?:.*/)?"
+                    end += 1
+            else:
+                regex += "[^/]*"
+            index = end
+            continue
+        if char == "?":
+            regex += "[^/]"
+        elif char == "\\" and index + 1 < length:
+            regex += re.escape(pattern[index + 1])
+            index += 2
+            continue
+        elif char == "[":
+            start = index + 1
+            if pattern.startswith(("!", "^"), start):
+                start += 1
+            if pattern.startswith("]", start):
+                start += 1
+            end = pattern.find("]", start)
+            if end != -1:
+                content = pattern[index + 1:end]
+                if content.startswith("!"):
+                    content = "^" + content[1:]
+                regex += "[" + content.replace("\\", "\\\\") + "]"
+                index = end + 1
+                continue
+            regex += re.escape(char)
+        else:
+            regex += re.escape(char)
+        index += 1
+    return regex
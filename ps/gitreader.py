@@ -0,0 +1,317 @@
+import datetime
+import hashlib
+import mmap
+import os
+import re
+import struct
+import zlib
+
+# Minimal reader of .git directories, so that refs and the head commit can be
+# loaded without spawning git. Anything it doesn't understand raises
+# GitReaderError, and the caller is expected to fall back to the git binary.
+
+class GitReaderError(Exception):
+    pass
+
+OBJ_COMMIT = 1
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+class PackIndex:
+    def __init__(self, idx_path):
+        self.pack_path = idx_path[:-4] + ".pack"
+        with open(idx_path, "rb") as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:8] != b"\377tOc\0\0\0\2":
+            raise GitReaderError("Unsupported pack index " + idx_path)
+        self.fanout = struct.unpack_from(">256I", self.data, 8)
+        self.count = self.fanout[255]
+
+    def find(self, sha):
+        first = sha[0]
+        low = self.fanout[first - 1] if first > 0 else 0
+        high = self.fanout[first]
+        while low < high:
+            middle = (low + high) // 2
+            entry = self.data[1032 + 20 * middle:1032 + 20 * middle + 20]
+            if entry < sha:
+                low = middle + 1
+            elif entry > sha:
+                high = middle
+            else:
+                return self.offset(middle)
+        return None
+
+    def offset(self, index):
+        offset = struct.unpack_from(">I", self.data, 1032 + 24 * self.count + 4 * index)[0]
+        if offset & 0x80000000:
+            large_index = offset & 0x7fffffff
+            offset = struct.unpack_from(">Q", self.data, 1032 + 28 * self.count + 8 * large_index)[0]
+        return offset
+
+def apply_delta(base, delta):
+    def read_size(position):
+        size = 0
+        shift = 0
+        while True:
+            byte = delta[position]
+            position += 1
+            size |= (byte & 0x7f) << shift
+            shift += 7
+            if not byte & 0x80:
+                return size, position
+
+    base_size, position = read_size(0)
+    result_size, position = read_size(position)
+    if base_size != len(base):
+        raise GitReaderError("Corrupted delta")
+
+    result = bytearray()
+    while position < len(delta):
+        opcode = delta[position]
+        position += 1
+        if opcode & 0x80:
+            offset = 0
+            size = 0
+            for bit in range(4):
+                if opcode & (1 << bit):
+                    offset |= delta[position] << (8 * bit)
+                    position += 1
+            for bit in range(3):
+                if opcode & (1 << (4 + bit)):
+                    size |= delta[position] << (8 * bit)
+                    position += 1
+            result += base[offset:offset + (size or 0x10000)]
+        elif opcode != 0:
+            result += delta[position:position + opcode]
+            position += opcode
+        else:
+            raise GitReaderError("Corrupted delta")
+
+    if len(result) != result_size:
+        raise GitReaderError("Corrupted delta")
+    return bytes(result)
+
+class GitRepository:
+    def __init__(self, path):
+        self.git_dir = path
+        if os.path.isfile(path):
+            # Worktrees and submodules use a .git file pointing to the real directory.
+            with open(path) as file:
+                match = re.match(r"gitdir: (.*)", file.read())
+            if match == None:
+                raise GitReaderError("Invalid .git file")
+            self.git_dir = os.path.join(os.path.dirname(path), match.group(1).strip())
+
+        # Linked worktrees share refs and objects with another directory.
+        if os.path.exists(os.path.join(self.git_dir, "commondir")):
+            raise GitReaderError("Linked worktrees are not supported")
+        if os.path.exists(os.path.join(self.git_dir, "objects", "info", "alternates")):
+            raise GitReaderError("Alternate object directories are not supported")
+        try:
+            with open(os.path.join(self.git_dir, "config")) as file:
+                config_text = file.read()
+        except OSError:
+            raise GitReaderError("Missing config")
+        if re.search(r"^\s*(objectformat|refstorage)\s*=", config_text, re.M | re.I):
+            raise GitReaderError("Unsupported repository format")
+
+        # `git log` applies the mailmap, which isn't supported here.
+        self.has_mailmap = os.path.exists(os.path.join(os.path.dirname(path), ".mailmap"))
+        self.pack_indexes = None
+
+    def read_text(self, *path):
+        try:
+            with open(os.path.join(self.git_dir, *path)) as file:
+                return file.read()
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    # Returns dict of refname -> target, where target is either a sha or "ref: ...".
+    def raw_refs(self):
+        refs = {}
+        packed_refs = self.read_text("packed-refs")
+        if packed_refs != None:
+            for line in packed_refs.split("\n"):
+                if line == "" or line.startswith("#") or line.startswith("^"):
+                    continue
+                sha, name = line.split(" ", 1)
+                refs[name] = sha
+
+        refs_dir = os.path.join(self.git_dir, "refs")
+        for dirpath, dirnames, filenames in os.walk(refs_dir):
+            for filename in filenames:
+                full_path = os.path.join(dirpath, filename)
+                name = "refs/" + os.path.relpath(full_path, refs_dir).replace(os.sep, "/")
+                try:
+                    with open(full_path) as file:
+                        target = file.read().strip()
+                except OSError:
+                    continue
+                if target != "":
+                    refs[name] = target
+        return refs
+
+    def resolve(self, target, refs, depth=0):
+        if depth > 5:
+            raise GitReaderError("Symbolic ref loop")
+        if target.startswith("ref: "):
+            name = target[5:].strip()
+            if not name in refs:
+                return None
+            return self.resolve(refs[name], refs, depth + 1)
+        if re.fullmatch("[0-9a-f]{40}", target) == None:
+            raise GitReaderError("Invalid ref " + target)
+        return target
+
+    # Returns (sorted ref names, head sha or None, fingerprint of all ref tips).
+    def refs(self):
+        refs = self.raw_refs()
+        head = self.read_text("HEAD")
+        if head == None:
+            raise GitReaderError("Missing HEAD")
+        head = self.resolve(head.strip(), refs)
+
+        tips = hashlib.sha1()
+        tips.update(b"HEAD " + (head or "").encode() + b"\n")
+        for name in sorted(refs):
+            tips.update(name.encode() + b" " + (self.resolve(refs[name], refs) or "").encode() + b"\n")
+        return sorted(refs), head, tips.hexdigest()
+
+    def read_object(self, sha):
+        try:
+            with open(os.path.join(self.git_dir, "objects", sha[:2], sha[2:]), "rb") as file:
+                data = zlib.decompress(file.read())
+        except FileNotFoundError:
+            return self.read_packed_object(bytes.fromhex(sha))
+
+        header, content = data.split(b"\0", 1)
+        type_name = header.split(b" ", 1)[0]
+        return {b"commit": OBJ_COMMIT, b"tree": 2, b"blob": 3, b"tag": 4}[type_name], content
+
+    def read_packed_object(self, binary_sha):
+        if self.pack_indexes == None:
+            self.pack_indexes = []
+            pack_dir = os.path.join(self.git_dir, "objects", "pack")
+            try:
+                names = sorted(os.listdir(pack_dir))
+            except FileNotFoundError:
+                names = []
+            for name in names:
+                if name.endswith(".idx"):
+                    self.pack_indexes.append(PackIndex(os.path.join(pack_dir, name)))
+
+        for index in self.pack_indexes:
+            offset = index.find(binary_sha)
+            if offset != None:
+                with open(index.pack_path, "rb") as pack:
+                    return self.read_pack_entry(pack, offset)
+        raise GitReaderError("Object not found: " + binary_sha.hex())
+
+    def read_pack_entry(self, pack, offset):
+        pack.seek(offset)
+        header = pack.read(32)
+        byte = header[0]
+        type = (byte >> 4) & 7
+        position = 1
+        while byte & 0x80:
+            byte = header[position]
+            position += 1
+
+        if type == OBJ_OFS_DELTA:
+            byte = header[position]
+            position += 1
+            base_distance = byte & 0x7f
+            while byte & 0x80:
+                byte = header[position]
+                position += 1
+                base_distance = ((base_distance + 1) << 7) | (byte & 0x7f)
+            type, base = self.read_pack_entry(pack, offset - base_distance)
+            pack.seek(offset + position)
+            return type, apply_delta(base, self.inflate(pack))
+        elif type == OBJ_REF_DELTA:
+            base_sha = header[position:position + 20]
+            type, base = self.read_object(base_sha.hex())
+            pack.seek(offset + position + 20)
+            return type, apply_delta(base, self.inflate(pack))
+
+        pack.seek(offset + position)
+        return type, self.inflate(pack)
+
+    @staticmethod
+    def inflate(file):
+        decompressor = zlib.decompressobj()
+        output = []
+        while not decompressor.eof:
+            chunk = file.read(8192)
+            if chunk == b"":
+                raise GitReaderError("Truncated pack")
+            output.append(decompressor.decompress(chunk))
+        return b"".join(output)
+
+    # Returns the commit in the same shape as parsed from `git log` output.
+    def read_commit(self, sha):
+        if self.has_mailmap:
+            raise GitReaderError("Mailmap is not supported")
+        type, data = self.read_object(sha)
+        if type != OBJ_COMMIT:
+            raise GitReaderError("Not a commit: " + sha)
+
+        headers, _, message = data.partition(b"\n\n")
+        author = None
+        for line in headers.split(b"\n"):
+            if line.startswith(b"author "):
+                author = line[7:].decode("utf-8", "replace")
+            elif line.startswith(b"encoding ") and line[9:].lower() not in (b"utf-8", b"utf8"):
+                raise GitReaderError("Unsupported commit encoding")
+
+        match = re.fullmatch(r"(.*) <(.*)> (\d+) ([+-])(\d\d)(\d\d)", author or "")
+        if match == None:
+            raise GitReaderError("Invalid author line")
+
+        offset = (int(match.group(5)) * 60 + int(match.group(6))) * (-1 if match.group(4) == "-" else 1)
+        date = datetime.datetime.fromtimestamp(int(match.group(3)), datetime.timezone(datetime.timedelta(minutes=offset)))
+        date_string = "{} {} {} {:02}:{:02}:{:02} {} {}{}{}".format(WEEKDAYS[date.weekday()], MONTHS[date.month - 1], date.day,
+                                                                   date.hour, date.minute, date.second, date.year,
+                                                                   match.group(4), match.group(5), match.group(6))
+
+        return make_commit(sha, match.group(1), match.group(2), date_string, message.decode("utf-8", "replace"))
+
+# Builds the commit dict shown by fancy_display_commit(), in the shape of the
+# default `git log` output: the message is the indented subject line and the
+# description the indented lines after the one following it.
+def make_commit(sha, full_name, email, date, text):
+    lines = text.rstrip("\n").split("\n")
+    description = "".join("    " + line + "\n" for line in lines[2:])
+    if description == "":
+        description = "    <No description>\n"
+    return {"hash": sha, "author": {"full_name": full_name, "email": email}, "date": date,
+            "message": "    " + lines[0] + "\n", "description": description}
+
+# `git log` arguments giving output for parse_git_log(): fields separated with
+# NUL and commits terminated with the ASCII record separator, which can't
+# appear in names and are very unlikely in messages.
+GIT_LOG_FORMAT = "--format=%H%x00%aN%x00%aE%x00%ad%x00%B%x1e"
+
+# Yields commits from `git log` output in GIT_LOG_FORMAT as soon as they are read.
+def parse_git_log(stream, block_size=1 << 16):
+    pending = b""
+    while True:
+        block = stream.read1(block_size)
+        if block == b"":
+            break
+        records = (pending + block).split(b"\x1e")
+        pending = records.pop()
+        for record in records:
+            yield parse_git_log_record(record)
+    stream.close()
+
+def parse_git_log_record(record):
+    fields = record.lstrip(b"\n").decode("utf-8", "replace").split("\0", 4)
+    if len(fields) != 5:
+        raise GitReaderError("Invalid git log record")
+    sha, full_name, email, date, text = fields
+    return make_commit(sha, full_name, email, date, text)
@@ -0,0 +1,375 @@
+import sys
+
+from collections.abc import MutableMapping
+
+from .logging import *
+
+# Guesses and the types of files they are of. The guessers making them are in
+# ps.guessers, which isn't imported until something is guessed (see
+# DetectorRegistry.load_guessers()).
+
+# Attributes almost every guess has are stored in fixed fields, other ones in
+# `extra_attributes`. The order in which attributes were added (which is the
+# order they are printed in) is kept in an AttributeNames shared by all guesses
+# having the same attributes.
+FIXED_ATTRIBUTES = {"file_count": "m_file_count", "file_size": "m_file_size", "lines_of_code": "m_lines_of_code",
+                    "source": "m_source", "special": "m_special"}
+
+class AttributeNames:
+    __slots__ = ("names", "slots", "following")
+    
+    def __init__(self, names):
+        self.names = names
+        # (name, fixed field or None) of every name.
+        self.slots = tuple((name, FIXED_ATTRIBUTES.get(name)) for name in names)
+        self.following = {}
+    
+    def add(self, name):
+        result = self.following.get(name)
+        if result == None:
+            result = self.following.setdefault(name, AttributeNames(self.names + (sys.intern(name),)))
+        return result
+    
+    def remove(self, name):
+        result = AttributeNames.empty
+        for other in self.names:
+            if other != name:
+                result = result.add(other)
+        return result
+
+AttributeNames.empty = AttributeNames(())
+
+class FileGuess:
+    __slots__ = ("file_type", "guesser", "attribute_names", "extra_attributes") + tuple(FIXED_ATTRIBUTES.values())
+    
+    def __init__(self, file_type=None, **attributes):
+        self.file_type = file_type
+        self.guesser = "unknown"
+        self.attribute_names = AttributeNames.empty
+        self.extra_attributes = None
+        self.m_file_count = None
+        self.m_file_size = None
+        self.m_lines_of_code = None
+        self.m_source = None
+        self.m_special = None
+        for name, value in attributes.items():
+            self.set_attribute(name, value)
+    
+    # Dict-like view of all attributes.
+    @property
+    def attributes(self):
+        return FileGuessAttributes(self)
+    
+    def get_attribute(self, name, default=None):
+        if not name in self.attribute_names.names:
+            return default
+        slot = FIXED_ATTRIBUTES.get(name)
+        if slot != None:
+            return getattr(self, slot)
+        return self.extra_attributes[name]
+    
+    def set_attribute(self, name, value):
+        attribute_names = self.attribute_names
+        if not name in attribute_names.names:
+            following = attribute_names.following.get(name)
+            self.attribute_names = following if following != None else attribute_names.add(name)
+        slot = FIXED_ATTRIBUTES.get(name)
+        if slot != None:
+            setattr(self, slot, value)
+            return
+        if self.extra_attributes == None:
+            self.extra_attributes = {}
+        self.extra_attributes[name] = value
+    
+    def remove_attribute(self, name):
+        if not name in self.attribute_names.names:
+            raise KeyError(name)
+        self.attribute_names = self.attribute_names.remove(name)
+        slot = FIXED_ATTRIBUTES.get(name)
+        if slot != None:
+            setattr(self, slot, None)
+        else:
+            del self.extra_attributes[name]
+        
+    def __repr__(self):
+        return sgr("1", "FileGuess") + " { " + sgr("3;34", "type: ") + str(self.file_type) + "; " + sgr("3;34", "attributes: ") + str(self.attributes) + " }"
+    
+    def to_user_readable_string(self):
+        output = ""
+        output += self.file_type.to_user_readable_string() + sgr("32", " (" + self.guesser.name + ")\n")
+        
+        for name, value in self.attributes.items():
+            output += "   - " + name + ": " + str(value) + "\n"
+        
+        return output
+
+    def collapse_attribute(self, name, value):
+        if not name in self.attribute_names.names:
+            # Lists are extended in place below, so they must not be shared
+            # with the guess collapsed from.
+            self.set_attribute(name, list(value) if isinstance(value, list) else value)
+            return
+
+        slot = FIXED_ATTRIBUTES.get(name)
+        current = getattr(self, slot) if slot != None else self.extra_attributes[name]
+        if isinstance(current, bool):
+            current |= value
+        elif isinstance(current, int):
+            current += value
+        elif isinstance(current, list):
+            current.append(value)
+            return
+        else:
+            current = [current, value]
+        
+        if slot != None:
+            setattr(self, slot, current)
+        else:
+            self.extra_attributes[name] = current
+    
+    # Collapses all attributes of `other` into this guess. A guess without
+    # attributes yet takes a copy of them, and counts and flags in fixed fields,
+    # which most attributes are, are combined here.
+    def collapse(self, other):
+        if self.attribute_names is AttributeNames.empty:
+            self.attribute_names = other.attribute_names
+            for name, slot in other.attribute_names.slots:
+                value = getattr(other, slot) if slot != None else other.extra_attributes[name]
+                # Lists are extended in place (see collapse_attribute()).
+                if isinstance(value, list):
+                    value = list(value)
+                if slot != None:
+                    setattr(self, slot, value)
+                    continue
+                if self.extra_attributes == None:
+                    self.extra_attributes = {}
+                self.extra_attributes[name] = value
+            return
+        
+        for name, slot in other.attribute_names.slots:
+            if slot != None:
+                value = getattr(other, slot)
+                if name in self.attribute_names.names:
+                    current = getattr(self, slot)
+                    if type(current) is int:
+                        setattr(self, slot, current + value)
+                        continue
+                    if type(current) is bool:
+                        setattr(self, slot, current | value)
+                        continue
+            else:
+                value = other.extra_attributes[name]
+            self.collapse_attribute(name, value)
+    
+    def attribute_items(self):
+        items = []
+        for name, slot in self.attribute_names.slots:
+            items.append((name, getattr(self, slot) if slot != None else self.extra_attributes[name]))
+        return items
+
+    def is_special(self):
+        return self.m_special
+    
+    def is_source(self):
+        return self.m_source
+    
+    def lines_of_code(self):
+        return self.m_lines_of_code
+    
+    def file_count(self):
+        return self.m_file_count
+
+class FileGuessAttributes(MutableMapping):
+    __slots__ = ("guess",)
+    
+    def __init__(self, guess):
+        self.guess = guess
+    
+    def __getitem__(self, name):
+        if not name in self.guess.attribute_names.names:
+            raise KeyError(name)
+        return self.guess.get_attribute(name)
+    
+    def __setitem__(self, name, value):
+        self.guess.set_attribute(name, value)
+    
+    def __delitem__(self, name):
+        self.guess.remove_attribute(name)
+    
+    def __iter__(self):
+        return iter(self.guess.attribute_names.names)
+    
+    def __len__(self):
+        return len(self.guess.attribute_names.names)
+    
+    def __contains__(self, name):
+        return name in self.guess.attribute_names.names
+    
+    def get(self, name, default=None):
+        return self.guess.get_attribute(name, default)
+    
+    def items(self):
+        return self.guess.attribute_items()
+    
+    def __repr__(self):
+        return repr(dict(self.guess.attribute_items()))
+
+class FileType:
+    __slots__ = ("clazz", "value", "user_readable_value")
+    
+    class Class:
+        MimeType = "$mime"
+        VersionControl = "$version"
+        BuildSystem = "$build"
+        ContinuousIntegration = "$ci"
+    
+    instances = {}
+    
+    def __init__(self, clazz, value, user_readable_value=None):
+        self.clazz = clazz
+        self.value = value
+        self.user_readable_value = user_readable_value if user_readable_value != None else value
+    
+    # Returns the one FileType instance with these values, so that guesses
+    # created separately (e.g. for each unknown file or from the scan cache)
+    # share it.
+    @staticmethod
+    def get(clazz, value, user_readable_value=None):
+        key = (clazz, value, user_readable_value)
+        file_type = FileType.instances.get(key)
+        if file_type == None:
+            file_type = FileType.instances.setdefault(key, FileType(clazz, value, user_readable_value))
+        return file_type
+    
+    @staticmethod
+    def mime(value, description):
+        return FileType.get(FileType.Class.MimeType, value, description)
+    
+    @staticmethod
+    def version_control(value, description):
+        return FileType.get(FileType.Class.VersionControl, value, description)
+    
+    @staticmethod
+    def build_system(value, description):
+        return FileType.get(FileType.Class.BuildSystem, value, description)
+    
+    @staticmethod
+    def continuous_integration(value, description):
+        return FileType.get(FileType.Class.ContinuousIntegration, value, description)
+    
+    def __repr__(self):
+        return sgr("1;33", self.clazz) + " (" + sgr("3;32", self.value) + ")"
+    
+    def to_user_readable_string(self):
+        output = ""
+        
+        # FIXME: Make it better!
+        if self.clazz == FileType.Class.MimeType:
+            output += "Format/Language"
+        elif self.clazz == FileType.Class.VersionControl:
+            output += "Version control"
+        elif self.clazz == FileType.Class.BuildSystem:
+            output += "Build system"
+        elif self.clazz == FileType.Class.ContinuousIntegration:
+            output += "Continuous Integration"
+        
+        output = sgr("1;32", output)
+        
+        output += ": "
+        output += self.to_fancy_string()
+        return output
+    
+    def is_unknown(self):
+        return self.clazz == FileType.Class.MimeType and self.value.startswith("?(")
+    
+    # Descriptions are stored unformatted, so that guesses (and the scan cache
+    # and server trees holding them) don't depend on the terminal.
+    def to_fancy_string(self):
+        description = sgr("33", self.user_readable_value) if self.is_unknown() else self.user_readable_value
+        return sgr("3;35", description) + sgr("3;36", " (" + self.value + ")")
+
+class filetypes:
+
+    # MIME types
+    mime_asm =              FileType.mime("text/x-asm", "Assembly")
+    mime_bmp =              FileType.mime("image/bmp", "BMP image")
+    mime_cmake =            FileType.mime("custom$cmake", "CMake")
+    mime_config =           FileType.mime("custom$config", "Config")
+    mime_cpp =              FileType.mime("text/x-c", "C/C++")
+    mime_css =              FileType.mime("text/css", "CSS")
+    mime_csv =              FileType.mime("text/csv", "CSV")
+    mime_directory =        FileType.mime("inode/directory", "Directory")
+    mime_doc =              FileType.mime("application/msword", "MS Word document")
+    mime_docker =           FileType.mime("custom$docker", "Dockerfile")
+    mime_dynamic_library =  FileType.mime("custom$dynamic_library", "Dynamic library")
+    mime_elf =              FileType.mime("custom$elf", "ELF binary")
+    mime_evs =              FileType.mime("custom$evs", "EvoScript")
+    mime_gif =              FileType.mime("image/gif", "GIF image")
+    mime_gitignore =        FileType.mime("custom$git/ignore", ".gitignore")
+    mime_gitattributes =    FileType.mime("custom$git/attributes", ".gitattributes")
+    mime_go =               FileType.mime("custom$go", "Go")
+    mime_gz =               FileType.mime("application/x-compressed$gz", "Gzip-compressed file")
+    mime_html =             FileType.mime("text/html", "HTML")
+    mime_ico =              FileType.mime("image/x-icon", "Icon (ICO)")
+    mime_ini =              FileType.mime("custom$ini", "INI config")
+    mime_jar =              FileType.mime("custom$jar", "JAR")
+    mime_java =             FileType.mime("text/x-java-source", "Java")
+    mime_jpg =              FileType.mime("image/jpg", "JPG image")
+    mime_js =               FileType.mime("application/js", "JavaScript")
+    mime_json =             FileType.mime("application/json", "JSON")
+    mime_ld_script =        FileType.mime("custom$ld", "Linker script")
+    mime_macho =            FileType.mime("custom$macho", "Mach-O binary")
+    mime_makefile =         FileType.mime("custom$makefile", "Makefile")
+    mime_markdown =         FileType.mime("custom$markdown", "Markdown")
+    mime_mkv =              FileType.mime("video/mkv", "MKV video")
+    mime_mp3 =              FileType.mime("sound/mp3", "MP3 sound")
+    mime_mp4 =              FileType.mime("video/mp4", "MP4 video")
+    mime_ninja =            FileType.mime("custom$ninja", "Ninja config")
+    mime_object =           FileType.mime("custom$object", "Object")
+    mime_ods =              FileType.mime("custom$ods", "OpenOffice Spreadsheet document")
+    mime_odt =              FileType.mime("custom$odt", "OpenOffice Writer document")
+    mime_ogg =              FileType.mime("sound/ogg", "OGG sound")
+    mime_patch =            FileType.mime("custom$patch", "Patch/diff")
+    mime_pe =               FileType.mime("custom$pe", "Portable Executable image")
+    mime_pdf =              FileType.mime("application/pdf", "PDF document")
+    mime_php =              FileType.mime("custom$php", "PHP")
+    mime_png =              FileType.mime("image/png", "PNG image")
+    mime_python =           FileType.mime("application/x-python", "Python")
+    mime_scss =             FileType.mime("text/scss", "SCSS/Sass")
+    mime_shell =            FileType.mime("application/x-sh", "Shell")
+    mime_static_library =   FileType.mime("custom$static_library", "Static library")
+    mime_svg =              FileType.mime("custom$svg", "SVG image")
+    mime_symlink =          FileType.mime("inode/symlink", "Symlink")
+    mime_systemd_service =  FileType.mime("custom$systemd/service", "systemd service")
+    mime_tar =              FileType.mime("application/x-tar", "Tar archive")
+    mime_text_plain =       FileType.mime("text/plain", "Plain text")
+    mime_ts =               FileType.mime("application/ts", "TypeScript")
+    mime_ttf =              FileType.mime("font/ttf", "TTF font")
+    mime_vue =              FileType.mime("text/vue", "Vue.js")
+    mime_wasm =             FileType.mime("custom$wasm", "WebAssembly")
+    mime_wav =              FileType.mime("sound/wav", "WAV sound")
+    mime_xls =              FileType.mime("application/excel", "MS Excel document")
+    mime_yaml =             FileType.mime("custom$yaml", "YML")
+    mime_zip =              FileType.mime("application/x-zip-compressed", "ZIP archive")
+    
+    @staticmethod
+    def mime_unknown(ext):
+        return FileType.mime("?(" + ext + ")", "Unknown (" + ext + ")")
+    
+    # Version controls
+    version_git = FileType.version_control("git", "Git")
+                  
+    # Build systems
+    build_cmake =  FileType.build_system("cmake", "CMake")
+    build_docker =  FileType.build_system("docker", "Docker")
+    build_gnu_make = FileType.build_system("gnu_make", "GNU Make")
+    build_gradle = FileType.build_system("gradle", "Gradle")
+    build_gulp = FileType.build_system("gulp", "Gulp")
+    build_ninja = FileType.build_system("ninja", "Ninja")
+    build_node_js = FileType.build_system("node_js", "Node.js")
+    build_python =  FileType.build_system("python", "Python (__pycache__)")
+    build_tsconfig = FileType.build_system("tsconfig", "TypeScript")
+    
+    # CI
+    ci_github_actions = FileType.continuous_integration("github_actions", "GitHub Actions")
+    ci_travis = FileType.continuous_integration("travis", "Travis")
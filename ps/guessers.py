@@ -3,217 +3,42 @@ import re
 import stat
 import sys
 import traceback
-
-from enum import Enum
-from io import StringIO
+import zlib
 
 import config as config
+from .gitreader import GIT_LOG_FORMAT, GitReaderError, GitRepository, parse_git_log, parse_git_log_record
+from .guess import *
 from .logging import *
 from .util import *
 
-class FileGuess:
-    def __init__(self, file_type=None, **attributes):
-        self.file_type = file_type
-        self.attributes = attributes
-        self.guesser = "unknown"
-        
-    def __repr__(self):
-        return sgr("1", "FileGuess") + " { " + sgr("3;34", "type: ") + str(self.file_type) + "; " + sgr("3;34", "attributes: ") + str(self.attributes) + " }"
-    
-    def to_user_readable_string(self):
-        output = ""
-        output += self.file_type.to_user_readable_string() + sgr("32", " (" + self.guesser.name + ")\n")
-        
-        for name, value in self.attributes.items():
-            output += "   - " + name + ": " + str(value) + "\n"
-        
-        return output
-
-    def collapse_attribute(self, name, value):
-        if not name in self.attributes:
-            self.attributes[name] = value
-            return
-
-        if isinstance(self.attributes[name], bool):
-            self.attributes[name] |= value
-        elif isinstance(self.attributes[name], int):
-            self.attributes[name] += value
-        elif isinstance(self.attributes[name], list):
-            self.attributes[name].append(value)
-        else:
-            self.attributes[name] = [self.attributes[name], value]
-
-    def is_special(self):
-        return self.attributes.get("special")
-    
-    def is_source(self):
-        return self.attributes.get("source")
-    
-    def lines_of_code(self):
-        return self.attributes.get("lines_of_code")
+class SourceLineCounter(LineCounter):
+    def __init__(self, guess):
+        LineCounter.__init__(self)
+        self.guess = guess
     
-    def file_count(self):
-        return self.attributes.get("file_count")
+    def finish(self):
+        LineCounter.finish(self)
+        self.guess.set_attribute("lines_of_code", self.lines)
 
+# Lines are counted when the file contents are streamed, after all guessers ran.
 def guess_source_file(filetype, file):
+    guess = FileGuess(filetype, source=True, lines_of_code=0)
     
-    if config.args.no_open:
-        lines_of_code = 0
-    else:
-        fd = file.descriptor()
-        if fd != None:
-            try:
-                with fd as _file:
-                    lines_of_code = sum(1 for _ in _file)
-            except KeyboardInterrupt:
-                raise
-            except:
-                print_error(sys.exc_info())
-                lines_of_code = 0
-        else:
-            lines_of_code = 0
-
-    return FileGuess(filetype, source=True, lines_of_code=lines_of_code)
+    if not config.args.no_open:
+        content = file.content()
+        if content != None:
+            content.add_consumer(SourceLineCounter(guess))
 
-class FileType:
-    class Class:
-        MimeType = "$mime"
-        VersionControl = "$version"
-        BuildSystem = "$build"
-        ContinuousIntegration = "$ci"
-    
-    def __init__(self, clazz, value, user_readable_value=None):
-        self.clazz = clazz
-        self.value = value
-        self.user_readable_value = user_readable_value if user_readable_value != None else value
-    
-    @staticmethod
-    def mime(value, description):
-        return FileType(FileType.Class.MimeType, value, description)
-    
-    @staticmethod
-    def version_control(value, description):
-        return FileType(FileType.Class.VersionControl, value, description)
-    
-    @staticmethod
-    def build_system(value, description):
-        return FileType(FileType.Class.BuildSystem, value, description)
-    
-    @staticmethod
-    def continuous_integration(value, description):
-        return FileType(FileType.Class.ContinuousIntegration, value, description)
-    
-    def __repr__(self):
-        return sgr("1;33", self.clazz) + " (" + sgr("3;32", self.value) + ")"
-    
-    def to_user_readable_string(self):
-        output = ""
-        
-        # FIXME: Make it better!
-        if self.clazz == FileType.Class.MimeType:
-            output += "Format/Language"
-        elif self.clazz == FileType.Class.VersionControl:
-            output += "Version control"
-        elif self.clazz == FileType.Class.BuildSystem:
-            output += "Build system"
-        elif self.clazz == FileType.Class.ContinuousIntegration:
-            output += "Continuous Integration"
-        
-        output = sgr("1;32", output)
-        
-        output += ": "
-        output += self.to_fancy_string()
-        return output
-    
-    def to_fancy_string(self):
-        return sgr("3;35", self.user_readable_value) + sgr("3;36", " (" + self.value + ")")
-
-class filetypes:
-
-    # MIME types
-    mime_asm =              FileType.mime("text/x-asm", "Assembly")
-    mime_bmp =              FileType.mime("image/bmp", "BMP image")
-    mime_cmake =            FileType.mime("custom$cmake", "CMake")
-    mime_config =           FileType.mime("custom$config", "Config")
-    mime_cpp =              FileType.mime("text/x-c", "C/C++")
-    mime_css =              FileType.mime("text/css", "CSS")
-    mime_csv =              FileType.mime("text/csv", "CSV")
-    mime_directory =        FileType.mime("inode/directory", "Directory")
-    mime_doc =              FileType.mime("application/msword", "MS Word document")
-    mime_docker =           FileType.mime("custom$docker", "Dockerfile")
-    mime_dynamic_library =  FileType.mime("custom$dynamic_library", "Dynamic library")
-    mime_elf =              FileType.mime("custom$elf", "ELF binary")
-    mime_evs =              FileType.mime("custom$evs", "EvoScript")
-    mime_gif =              FileType.mime("image/gif", "GIF image")
-    mime_gitignore =        FileType.mime("custom$git/ignore", ".gitignore")
-    mime_gitattributes =    FileType.mime("custom$git/attributes", ".gitattributes")
-    mime_go =               FileType.mime("custom$go", "Go")
-    mime_gz =               FileType.mime("application/x-compressed$gz", "Gzip-compressed file")
-    mime_html =             FileType.mime("text/html", "HTML")
-    mime_ico =              FileType.mime("image/x-icon", "Icon (ICO)")
-    mime_ini =              FileType.mime("custom$ini", "INI config")
-    mime_jar =              FileType.mime("custom$jar", "JAR")
-    mime_java =             FileType.mime("text/x-java-source", "Java")
-    mime_jpg =              FileType.mime("image/jpg", "JPG image")
-    mime_js =               FileType.mime("application/js", "JavaScript")
-    mime_json =             FileType.mime("application/json", "JSON")
-    mime_ld_script =        FileType.mime("custom$ld", "Linker script")
-    mime_makefile =         FileType.mime("custom$makefile", "Makefile")
-    mime_markdown =         FileType.mime("custom$markdown", "Markdown")
-    mime_mkv =              FileType.mime("video/mkv", "MKV video")
-    mime_mp3 =              FileType.mime("sound/mp3", "MP3 sound")
-    mime_mp4 =              FileType.mime("video/mp4", "MP4 video")
-    mime_ninja =            FileType.mime("custom$ninja", "Ninja config")
-    mime_object =           FileType.mime("custom$object", "Object")
-    mime_ods =              FileType.mime("custom$ods", "OpenOffice Spreadsheet document")
-    mime_odt =              FileType.mime("custom$odt", "OpenOffice Writer document")
-    mime_ogg =              FileType.mime("sound/ogg", "OGG sound")
-    mime_patch =            FileType.mime("custom$patch", "Patch/diff")
-    mime_pe =               FileType.mime("custom$pe", "Portable Executable image")
-    mime_pdf =              FileType.mime("application/pdf", "PDF document")
-    mime_php =              FileType.mime("custom$php", "PHP")
-    mime_png =              FileType.mime("image/png", "PNG image")
-    mime_python =           FileType.mime("application/x-python", "Python")
-    mime_scss =             FileType.mime("text/scss", "SCSS/Sass")
-    mime_shell =            FileType.mime("application/x-sh", "Shell")
-    mime_static_library =   FileType.mime("custom$static_library", "Static library")
-    mime_svg =              FileType.mime("custom$svg", "SVG image")
-    mime_symlink =          FileType.mime("inode/symlink", "Symlink")
-    mime_systemd_service =  FileType.mime("custom$systemd/service", "systemd service")
-    mime_tar =              FileType.mime("application/x-tar", "Tar archive")
-    mime_text_plain =       FileType.mime("text/plain", "Plain text")
-    mime_ts =               FileType.mime("application/ts", "TypeScript")
-    mime_ttf =              FileType.mime("font/ttf", "TTF font")
-    mime_vue =              FileType.mime("text/vue", "Vue.js")
-    mime_wasm =             FileType.mime("custom$wasm", "WebAssembly")
-    mime_wav =              FileType.mime("sound/wav", "WAV sound")
-    mime_xls =              FileType.mime("application/excel", "MS Excel document")
-    mime_yaml =             FileType.mime("custom$yaml", "YML")
-    mime_zip =              FileType.mime("application/x-zip-compressed", "ZIP archive")
-    
-    @staticmethod
-    def mime_unknown(ext):
-        return FileType.mime("?(" + ext + ")", sgr("33", "Unknown (" + ext + ")"))
-    
-    # Version controls
-    version_git = FileType.version_control("git", "Git")
-                  
-    # Build systems
-    build_cmake =  FileType.build_system("cmake", "CMake")
-    build_docker =  FileType.build_system("docker", "Docker")
-    build_gnu_make = FileType.build_system("gnu_make", "GNU Make")
-    build_gradle = FileType.build_system("gradle", "Gradle")
-    build_gulp = FileType.build_system("gulp", "Gulp")
-    build_ninja = FileType.build_system("ninja", "Ninja")
-    build_node_js = FileType.build_system("node_js", "Node.js")
-    build_python =  FileType.build_system("python", "Python (__pycache__)")
-    build_tsconfig = FileType.build_system("tsconfig", "TypeScript")
-    
-    # CI
-    ci_github_actions = FileType.continuous_integration("github_actions", "GitHub Actions")
-    ci_travis = FileType.continuous_integration("travis", "Travis")
+    return guess
 
 class Guesser:
+    # Extensions, basenames and basename regexes this guesser can match. The
+    # registry dispatches files only to guessers that declared a match; guessers
+    # declaring nothing are called for every file.
+    extensions = ()
+    basenames = ()
+    patterns = ()
+
     def __init__(self, description=None):
         self.name = "unknown"
         self.description = description
@@ -225,27 +50,74 @@ class Guesser:
         if self.description != None:
             print(" - " + sgr("3;38;2;208;208;208", self.description), end="")
 
+# Signatures are bucketed by length, so a file is matched with one head read and
+# one dict lookup per distinct signature length, however many are registered.
 class MagicGuesser(Guesser):
+    shebang_max_length = 256
+    
     def __init__(self, description):
         Guesser.__init__(self, description)
         self.subguessers = []
+        self.magics_by_length = {}
+        self.head_length = 0
+        self.interpreters = {}
         
     def register_subguesser(self, magic, filetype, **attributes):
         self.subguessers.append((magic, filetype, attributes))
+        # If signatures of different length match, the first registered one wins.
+        self.magics_by_length.setdefault(len(magic), {}).setdefault(magic, len(self.subguessers) - 1)
+        self.head_length = max(self.head_length, len(magic))
+    
+    # Matches `#!/path/to/name` and `#!/usr/bin/env name` scripts. Version
+    # suffixes are ignored unless registered, so "python" matches `python3.11`.
+    def register_interpreter(self, name, filetype, **attributes):
+        self.interpreters[name] = (filetype, attributes)
+        self.head_length = max(self.head_length, MagicGuesser.shebang_max_length)
+    
+    def match_magic(self, head):
+        match = None
+        for length, magics in self.magics_by_length.items():
+            index = magics.get(head[:length])
+            if index != None and (match == None or index < match):
+                match = index
+        return self.subguessers[match] if match != None else None
+    
+    def match_interpreter(self, head):
+        if not head.startswith(b"#!"):
+            return None
+        arguments = head[2:].split(b"\n", 1)[0].split()
+        if len(arguments) == 0:
+            return None
+        name = os.path.basename(arguments[0])
+        if name == b"env":
+            # Skip options and variable assignments (`env -S`, `env FOO=1`).
+            arguments = [argument for argument in arguments[1:] if not argument.startswith(b"-") and not b"=" in argument]
+            if len(arguments) == 0:
+                return None
+            name = os.path.basename(arguments[0])
+        
+        name = name.decode(errors="replace")
+        interpreter = self.interpreters.get(name)
+        if interpreter == None:
+            interpreter = self.interpreters.get(name.rstrip("0123456789."))
+        return (name, interpreter[0], interpreter[1]) if interpreter != None else None
         
     def guess(self, file):
-        fd = file.descriptor()
-        if fd == None:
+        content = file.content()
+        if content == None:
             return []
-        for magic, filetype, attributes in self.subguessers:
-            fd.seek(0)
-            bytes = fd.read(len(magic))
-            if bytes == magic:
-                print_verbose("Magic guess: " + str(filetype) + " (" + bytes.decode() + ")")
-                if attributes.get("source") != None:
-                    return [guess_source_file(filetype, file)]
-                return [FileGuess(filetype, *attributes)]
-        return []
+        head = content.head(self.head_length)
+        match = self.match_magic(head)
+        if match == None and len(self.interpreters) > 0:
+            match = self.match_interpreter(head)
+        if match == None:
+            return []
+        
+        magic, filetype, attributes = match
+        print_verbose("Magic guess: " + str(filetype) + " (" + (magic if isinstance(magic, str) else magic.decode(errors="replace")) + ")")
+        if attributes.get("source") != None:
+            return [guess_source_file(filetype, file)]
+        return [FileGuess(filetype, **attributes)]
     
     def print_additional_info(self):
         Guesser.print_additional_info(self)
@@ -253,6 +125,9 @@ class MagicGuesser(Guesser):
         for subguesser in self.subguessers:
             print()
             print("   - " + str(subguesser[0]) + unicode(" → ") + str(subguesser[1]), end="")
+        for name, interpreter in self.interpreters.items():
+            print()
+            print("   - #!" + name + unicode(" → ") + str(interpreter[0]), end="")
 
 class BuildSystemGuesser(Guesser):
     
@@ -275,6 +150,9 @@ class BuildSystemGuesser(Guesser):
         pass
 
 class Guesser_CMake(BuildSystemGuesser):
+    extensions = (".cmake",)
+    basenames = ("CMakeLists.txt", "CMakeFiles")
+    
     def guess(self, file):
         if file.basename == "CMakeLists.txt" or file.extension == ".cmake":
             return [FileGuess(filetypes.build_cmake), guess_source_file(filetypes.mime_cmake, file)]
@@ -317,6 +195,8 @@ class Guesser_CMake(BuildSystemGuesser):
         return None
 
 class Guesser_GNUMake(BuildSystemGuesser):
+    patterns = ("Makefile.*",)
+    
     def guess(self, file):
         if re.search("Makefile.*", file.basename):
             return [FileGuess(filetypes.build_gnu_make), guess_source_file(filetypes.mime_makefile, file)]
@@ -346,6 +226,8 @@ class Guesser_GNUMake(BuildSystemGuesser):
         return None
 
 class Guesser_Ninja(BuildSystemGuesser):
+    extensions = (".ninja",)
+    
     def guess(self, file):
         if file.extension == ".ninja":
             return [FileGuess(filetypes.build_ninja), guess_source_file(filetypes.mime_ninja, file)]
@@ -375,6 +257,8 @@ class Guesser_Ninja(BuildSystemGuesser):
         return None
     
 class Guesser_Node(BuildSystemGuesser):
+    basenames = ("package.json", "package-lock.json")
+    
     def guess(self, file):
         if file.basename == "package.json" or file.basename == "package-lock.json":
             return [FileGuess(filetypes.build_node_js)]
@@ -400,6 +284,8 @@ class Guesser_Node(BuildSystemGuesser):
         return None
 
 class Guesser_Pycache(Guesser):
+    basenames = ("__pycache__",)
+    
     def guess(self, file):
         if file.basename == "__pycache__":
             return [FileGuess(filetypes.build_python, special=True)]
@@ -422,11 +308,15 @@ class Guesser_Pycache(Guesser):
 
 # Source guessers!
 class Guesser_Assembly(Guesser):
+    extensions = (".S", ".s", ".asm")
+    
     def guess(self, file):
         if file.extension == ".S" or file.extension == ".s" or file.extension == ".asm":
             return [guess_source_file(filetypes.mime_asm, file)]
     
 class Guesser_CI(Guesser):
+    basenames = ("travis.yml", "workflows")
+    
     def guess(self, file):
         if file.basename == "travis.yml":
             return [FileGuess(filetypes.ci_travis)]
@@ -434,6 +324,8 @@ class Guesser_CI(Guesser):
             return [FileGuess(filetypes.ci_github_actions, special=True)]
 
 class Guesser_ConfigGeneric(Guesser):
+    extensions = (".cfg", ".conf", ".config", ".ini", ".yaml", ".yml")
+    
     def guess(self, file):
         if file.extension == ".cfg" or file.extension == ".conf" or file.extension == ".config":
             return [guess_source_file(filetypes.mime_config, file)]
@@ -443,6 +335,8 @@ class Guesser_ConfigGeneric(Guesser):
             return [guess_source_file(filetypes.mime_yaml, file)]
         
 class Guesser_CompressArchive(Guesser):
+    extensions = (".gz", ".tar", ".zip")
+    
     def guess(self, file):
         if file.extension == ".gz":
             return [FileGuess(filetypes.mime_gz)]
@@ -452,6 +346,8 @@ class Guesser_CompressArchive(Guesser):
             return [FileGuess(filetypes.mime_zip)]
 
 class Guesser_Cpp(Guesser):
+    extensions = (".c", ".cpp", ".h", ".hpp", ".cxx", ".cc", ".hxx", ".o", ".ld", ".a", ".dll", ".so")
+    
     def guess(self, file):
         if file.extension == ".c" or file.extension == ".cpp" or file.extension == ".h" or file.extension == ".hpp" or \
              file.extension == ".cxx" or file.extension == ".cc" or file.extension == ".hxx":
@@ -466,16 +362,23 @@ class Guesser_Cpp(Guesser):
             return [FileGuess(filetypes.mime_dynamic_library)]
 
 class Guesser_Data(Guesser):
+    extensions = (".csv",)
+    
     def guess(self, file):
         if file.extension == ".csv":
             return [guess_source_file(filetypes.mime_csv, file)]
 
 class Guesser_Docker(Guesser):
+    extensions = (".dockerfile",)
+    basenames = ("Dockerfile",)
+    
     def guess(self, file):
         if file.basename == "Dockerfile" or file.extension == ".dockerfile":
             return [guess_source_file(filetypes.mime_docker, file)]
 
 class Guesser_Document(Guesser):
+    extensions = (".doc", ".docx", ".xls", ".xlsx", ".odt", ".ods", ".pdf")
+    
     def guess(self, file):
         if file.extension == ".doc" or file.extension == ".docx":
             return [FileGuess(filetypes.mime_doc)]
@@ -491,11 +394,15 @@ class Guesser_Document(Guesser):
             return [FileGuess(filetypes.mime_pdf)]
 
 class Guesser_Evs(Guesser):
+    extensions = (".evs",)
+    
     def guess(self, file):
         if file.extension == ".evs":
             return [guess_source_file(filetypes.mime_evs, file)]
 
 class Guesser_Font(Guesser):
+    extensions = (".ttf",)
+    
     def guess(self, file):
         if file.extension == ".ttf":
             return [FileGuess(filetypes.mime_ttf)]
@@ -508,7 +415,7 @@ class Guesser_Generic(Guesser):
             return [FileGuess(filetypes.mime_unknown(file.extension), unknown=True)]
 
 class VersionControlGuesser(Guesser):
-    def print_log(self, file, format):
+    def print_log(self, file, format, **kwargs):
         print_error("Invalid VersionControlGuesser")
         return None
     
@@ -527,60 +434,85 @@ class VersionControlGuesser(Guesser):
                                                         sgr("35", data["date"]), data["message"], sgr("90;3", data["description"]))
 
 class Guesser_Git(VersionControlGuesser):
-    def parse_git_log_output(self, output):
-        data = []
-        
-        while True:
-            # If the first match fails, probably we reached EOF :)
-            try:
-                hash = re.search("commit ([a-f0-9]{40})", output.readline().decode()).group(1)
-                
-                author_regex = re.search("Author: (.*) <(.*)>", output.readline().decode())
-                author = {"full_name": author_regex.group(1), "email": author_regex.group(2)}
-                date = re.search("Date:   (.*)", output.readline().decode()).group(1)
-                output.readline() # Skip empty line
-                message = output.readline().decode()
-                description = ""
-            except:
-                break
-            
-            output.readline() # Skip empty line
-            next_line = output.peek().decode()
-            if not next_line.startswith('    '):
-                # No description
-                pass
-            else:
-                while True:
-                    next_line = output.readline().decode()
-
-                    if not next_line.startswith("    "):
-                        break
-
-                    description += next_line
-            
-            if description == "":
-                description = "    <No description>\n"
-            data.append({"hash":hash, "author":author, "date":date, "message":message, "description":description})
-        output.close()
-        return data
+    extensions = (".patch", ".diff")
+    basenames = (".git", ".gitignore", ".gitattributes")
     
     def git_guess(self, file):
-        guess = FileGuess(filetypes.version_git, special=True)
+        try:
+            return self.git_guess_native(file)
+        except (GitReaderError, OSError, ValueError, KeyError, zlib.error):
+            print_verbose("Falling back to git for " + file.path + ": " + str(sys.exc_info()[1]))
+        return self.git_guess_with_process(file)
+    
+    # The commit count needs a walk over the whole history, so it is cached by
+    # the tips of all refs and only recounted after one of them moves.
+    def git_guess_native(self, file):
+        from .cache import ScanCache
+        
+        repository = GitRepository(file.path)
+        refs, head_sha, fingerprint = repository.refs()
+        head = repository.read_commit(head_sha) if head_sha != None else {}
+        guess = FileGuess(filetypes.version_git, special=True, commit_count=None, refs=refs + [""], head=head)
         
+        cache = ScanCache.instance
+        commit_count = cache.get_commit_count(file, fingerprint) if cache != None else None
+        if commit_count != None:
+            guess.attributes["commit_count"] = commit_count
+        elif head_sha == None and len(refs) == 0:
+            guess.attributes["commit_count"] = 0
+        else:
+            def set_commit_count(output):
+                if not self.set_git_attribute(guess, "commit_count", output, lambda output: int(output)):
+                    return
+                if cache != None:
+                    cache.put_commit_count(file, fingerprint, guess.attributes["commit_count"])
+            run_process_in_dir_deferred(file.path, "git rev-list --all --count", set_commit_count)
+        return [guess]
+    
+    # Attributes are added right away so that their order doesn't depend on
+    # which command finishes first, and removed if it fails.
+    def set_git_attribute(self, guess, name, output, parse):
         try:
-            guess.attributes["commit_count"] = int(run_process_in_dir_and_return_stdout(file.path, "git rev-list --all --count"))
-            guess.attributes["refs"] = run_process_in_dir_and_return_stdout(file.path, "git for-each-ref --format=%(refname)").split('\n')
-            head = self.parse_git_log_output(run_process_in_dir_and_return_stdout_stream(file.path, "git log HEAD^..HEAD"))
-            guess.attributes["head"] = head[0] if len(head) > 0 else {}
+            guess.attributes[name] = parse(output.decode())
+            return True
         except:
-            pass
-            
+            del guess.attributes[name]
+            return False
+    
+    def git_guess_with_process(self, file):
+        guess = FileGuess(filetypes.version_git, special=True, commit_count=None, refs=None, head=None)
+        
+        def parse_head(output):
+            return parse_git_log_record(output.rstrip("\n").rstrip("\x1e").encode()) if output != "" else {}
+        
+        run_process_in_dir_deferred(file.path, "git rev-list --all --count",
+                                    lambda output: self.set_git_attribute(guess, "commit_count", output, lambda output: int(output)))
+        run_process_in_dir_deferred(file.path, "git for-each-ref --format=%(refname)",
+                                    lambda output: self.set_git_attribute(guess, "refs", output, lambda output: output.split('\n')))
+        run_process_in_dir_deferred(file.path, ["git", "log", "--max-count=1", GIT_LOG_FORMAT],
+                                    lambda output: self.set_git_attribute(guess, "head", output, parse_head))
         return [guess]
     
-    def print_log(self, file, format):
-        log = self.parse_git_log_output(run_process_in_dir_and_return_stdout_stream(file.path, "git log --reverse"))
-        for commit in log:
-            print(self.fancy_display_commit(commit, format))
+    # Commits are printed as git outputs them; the limits are passed to git so
+    # that it doesn't read more history than needed.
+    def print_log(self, file, format, **kwargs):
+        args = ["git", "log", "--reverse", GIT_LOG_FORMAT]
+        if kwargs.get("max_count") != None:
+            args.append("--max-count=" + str(kwargs.get("max_count")))
+        if kwargs.get("since") != None:
+            args.append("--since=" + kwargs.get("since"))
+        if kwargs.get("until") != None:
+            args.append("--until=" + kwargs.get("until"))
+        
+        stream = run_process_in_dir_and_return_stdout_stream(file.path, args)
+        if stream == "":
+            return
+        writer = kwargs.get("writer")
+        for commit in parse_git_log(stream):
+            if writer != None:
+                writer.write_commit(commit)
+            else:
+                print(self.fancy_display_commit(commit, format))
     
     def guess(self, file):
         if file.basename == ".git":
@@ -593,6 +525,8 @@ class Guesser_Git(VersionControlGuesser):
             return [guess_source_file(filetypes.mime_patch, file)]
 
 class Guesser_Image(Guesser):
+    extensions = (".gif", ".png", ".svg", ".jpg", ".ico", ".bmp")
+    
     def guess(self, file):
         if file.extension == ".gif":
             return [FileGuess(filetypes.mime_gif)]
@@ -611,10 +545,13 @@ class Guesser_Inode(Guesser):
     def guess(self, file):
         if file.is_directory():
             return [FileGuess(filetypes.mime_directory, subfile_count=len(file.files.keys()))]
-        elif os.path.islink(file.path):
+        elif file.is_symlink():
             return [FileGuess(filetypes.mime_symlink, target=os.readlink(file.path))]
         
 class Guesser_Java(Guesser):
+    extensions = (".java", ".jar")
+    basenames = ("gradlew", "gradlew.bat", "gradle.properties", "build.gradle")
+    
     def guess(self, file):
         if file.basename == "gradlew" or file.basename == "gradlew.bat" or file.basename == "gradle.properties" or file.basename == "build.gradle":
             return [FileGuess(filetypes.build_gradle)]
@@ -624,6 +561,10 @@ class Guesser_Java(Guesser):
             return [FileGuess(filetypes.mime_jar)]
 
 class Guesser_JavaScript(Guesser):
+    extensions = (".js", ".cjs", ".mjs", ".json", ".ts")
+    basenames = ("node_modules", "tsconfig.json")
+    patterns = (r"^gulpfile\..*\.js$",)
+    
     def guess(self, file):
         if file.basename == "node_modules":
             return [FileGuess(filetypes.build_node_js, special=True)]
@@ -639,6 +580,8 @@ class Guesser_JavaScript(Guesser):
             return [guess_source_file(filetypes.mime_ts, file)]
 
 class Guesser_Markup(Guesser):
+    extensions = (".html", ".htm", ".md")
+    
     def guess(self, file):
         if file.extension == ".html" or file.extension == ".htm":
             return [guess_source_file(filetypes.mime_html, file)]
@@ -646,16 +589,22 @@ class Guesser_Markup(Guesser):
             return [guess_source_file(filetypes.mime_markdown, file)]
 
 class Guesser_Python(Guesser):
+    extensions = (".py",)
+    
     def guess(self, file):
         if file.extension == ".py":
             return [guess_source_file(filetypes.mime_python, file)]
 
 class Guesser_Shell(Guesser):
+    extensions = (".sh",)
+    
     def guess(self, file):
         if file.extension == ".sh":
             return [guess_source_file(filetypes.mime_shell, file)]
 
 class Guesser_Sound(Guesser):
+    extensions = (".wav", ".ogg", ".mp3")
+    
     def guess(self, file):
         if file.extension == ".wav":
             return [FileGuess(filetypes.mime_wav)]
@@ -665,11 +614,15 @@ class Guesser_Sound(Guesser):
             return [FileGuess(filetypes.mime_mp3)]
 
 class Guesser_Systemd(Guesser):
+    extensions = (".service",)
+    
     def guess(self, file):
         if file.extension == ".service":
             return [guess_source_file(filetypes.mime_systemd_service, file)]
 
 class Guesser_Video(Guesser):
+    extensions = (".mkv", ".mp4")
+    
     def guess(self, file):
         if file.extension == ".mkv":
             return [FileGuess(filetypes.mime_mkv)]
@@ -677,6 +630,8 @@ class Guesser_Video(Guesser):
             return [FileGuess(filetypes.mime_mp4)]
 
 class Guesser_Web(Guesser):
+    extensions = (".php", ".css", ".scss", ".vue", ".wasm")
+    
     def guess(self, file):
         if file.extension == ".php":
             return [guess_source_file(filetypes.mime_php, file)]
@@ -690,44 +645,33 @@ class Guesser_Web(Guesser):
             return [guess_source_file(filetypes.mime_wasm, file)]
         
 
-def register_all_guessers(registry):
-    # High priority
-    magic_guesser = MagicGuesser("Guesser which uses file patterns to detect formats")
-    magic_guesser.register_subguesser(b'\x7fELF',                   filetypes.mime_elf)
-    magic_guesser.register_subguesser(b'PE\0\0',                    filetypes.mime_pe)
-    magic_guesser.register_subguesser(b'#!/usr/bin/env python',     filetypes.mime_python, source=True)
-    magic_guesser.register_subguesser(b'#!/usr/bin/python',         filetypes.mime_python, source=True)
-    magic_guesser.register_subguesser(b'#!/bin/sh',                 filetypes.mime_shell, source=True)
-    magic_guesser.register_subguesser(b'#!/bin/bash',               filetypes.mime_shell, source=True)
-    registry.register_file_type_guesser("magic",    magic_guesser, priority=-100)
-    
-    registry.register_file_type_guesser("asm",      Guesser_Assembly("Assembly sources"))
-    registry.register_file_type_guesser("ci",       Guesser_CI("Continuous integration files"))
-    registry.register_file_type_guesser("cmake",    Guesser_CMake("CMake build system"))
-    registry.register_file_type_guesser("compress", Guesser_CompressArchive("Compressed and archive files"))
-    registry.register_file_type_guesser("config",   Guesser_ConfigGeneric("Generic config files"))
-    registry.register_file_type_guesser("cpp",      Guesser_Cpp("C++ and executable files"))
-    registry.register_file_type_guesser("data",     Guesser_Data("Data(base) files"))
-    registry.register_file_type_guesser("docker",   Guesser_Docker("Docker config files"))
-    registry.register_file_type_guesser("document", Guesser_Document("Various document files"))
-    registry.register_file_type_guesser("evs",      Guesser_Evs("EvoScript sources"))
-    registry.register_file_type_guesser("font",     Guesser_Font("Font files"))
-    registry.register_file_type_guesser("git",      Guesser_Git("Git config files"))
-    registry.register_file_type_guesser("image",    Guesser_Image("Image (picture) files"))
-    registry.register_file_type_guesser("inode",    Guesser_Inode("Directories etc."))
-    registry.register_file_type_guesser("java",     Guesser_Java("Java sources"))
-    registry.register_file_type_guesser("js",       Guesser_JavaScript("JS sources"))
-    registry.register_file_type_guesser("make",     Guesser_GNUMake("GNU Make build system"))
-    registry.register_file_type_guesser("markup",   Guesser_Markup("Markup/formatting languages"))
-    registry.register_file_type_guesser("ninja",    Guesser_Ninja("Ninja build system"))
-    registry.register_file_type_guesser("node",     Guesser_Node("Node.js / NPM build system"))
-    registry.register_file_type_guesser("pycache",  Guesser_Pycache("Python runtime (__pycache__)"))
-    registry.register_file_type_guesser("python",   Guesser_Python("Python sources"))
-    registry.register_file_type_guesser("shell",    Guesser_Shell("Shell scripts"))
-    registry.register_file_type_guesser("sound",    Guesser_Sound("Sound files"))
-    registry.register_file_type_guesser("systemd ", Guesser_Systemd("systemd config"))
-    registry.register_file_type_guesser("video",    Guesser_Video("Videos"))
-    registry.register_file_type_guesser("web",      Guesser_Web("Web-related formats"))
-    
-    # Low priority
-    registry.register_file_type_guesser("generic", Guesser_Generic("Plaintext and unknown files"), priority=100)
+# Guessers which aren't just a class (see GUESSERS in ps.detector).
+
+def magic_guesser(description):
+    guesser = MagicGuesser(description)
+    guesser.register_subguesser(b'\x7fELF',                   filetypes.mime_elf)
+    guesser.register_subguesser(b'PE\0\0',                    filetypes.mime_pe)
+    guesser.register_interpreter("python",                    filetypes.mime_python, source=True)
+    guesser.register_interpreter("sh",                        filetypes.mime_shell, source=True)
+    guesser.register_interpreter("bash",                      filetypes.mime_shell, source=True)
+    guesser.register_interpreter("dash",                      filetypes.mime_shell, source=True)
+    guesser.register_interpreter("ksh",                       filetypes.mime_shell, source=True)
+    guesser.register_interpreter("zsh",                       filetypes.mime_shell, source=True)
+    return guesser
+
+# Formats which are usually recognized by extension (a .jar or .docx is a ZIP
+# file too); signatures are used for files not recognized otherwise.
+def signature_guesser(description):
+    guesser = MagicGuesser(description)
+    guesser.register_subguesser(b'\x1f\x8b',                    filetypes.mime_gz)
+    guesser.register_subguesser(b'\x89PNG\r\n\x1a\n',           filetypes.mime_png)
+    guesser.register_subguesser(b'\x00asm',                     filetypes.mime_wasm)
+    guesser.register_subguesser(b'\xce\xfa\xed\xfe',            filetypes.mime_macho)
+    guesser.register_subguesser(b'\xcf\xfa\xed\xfe',            filetypes.mime_macho)
+    guesser.register_subguesser(b'\xfe\xed\xfa\xce',            filetypes.mime_macho)
+    guesser.register_subguesser(b'\xfe\xed\xfa\xcf',            filetypes.mime_macho)
+    guesser.register_subguesser(b'%PDF-',                       filetypes.mime_pdf)
+    guesser.register_subguesser(b'GIF87a',                      filetypes.mime_gif)
+    guesser.register_subguesser(b'GIF89a',                      filetypes.mime_gif)
+    guesser.register_subguesser(b'PK\x03\x04',                  filetypes.mime_zip)
+    return guesser
@@ -1,5 +1,4 @@
 import os
-import platform
 import sys
 
 import config as config
@@ -7,6 +6,7 @@ import config as config
 class __internal__:
     ansi_enabled = None
     unicode_enabled = None
+    status_enabled = True
 
 def allow_ansi_escape_codes():
     if __internal__.ansi_enabled == None:
@@ -22,6 +22,14 @@ def allow_unicode():
     return __internal__.unicode_enabled
     
 
+# Formats output for another terminal than ours (see ps.server).
+def set_formatting(ansi_enabled, unicode_enabled):
+    __internal__.ansi_enabled = ansi_enabled
+    __internal__.unicode_enabled = unicode_enabled
+
+def disable_status():
+    __internal__.status_enabled = False
+
 def sgr(code, text):
     return ("\033[" + str(code) + "m" + str(text) + "\033[0m") if allow_ansi_escape_codes() else text
 
@@ -46,7 +54,7 @@ def print_verbose(text):
     print_status("verbose", text)
 
 def print_status(status, text = ""):
-    if not allow_ansi_escape_codes():
+    if not __internal__.status_enabled or not allow_ansi_escape_codes():
         # we can't do anything with these terminals :(
         return
     
@@ -0,0 +1,104 @@
+import contextlib
+import json
+import sys
+import threading
+import time
+
+# Counters collected with --profile: time and calls per guesser, file I/O,
+# subprocesses and time of phases. Instrumented code only checks whether
+# `Profiler.instance` is None when profiling is off.
+class Profiler:
+    instance = None
+
+    def __init__(self):
+        if Profiler.instance == None:
+            Profiler.instance = self
+        else:
+            raise AssertionError("Double singleton")
+
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.guessers = {}  # name -> [calls, seconds]
+        self.counters = {}  # name -> value
+        self.phases = []    # [depth, name, seconds], in order of start
+        self.depth = 0
+
+    def add_guesser_call(self, name, seconds):
+        with self.lock:
+            entry = self.guessers.get(name)
+            if entry == None:
+                self.guessers[name] = [1, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        entry = [self.depth, name, 0.0]
+        self.phases.append(entry)
+        self.depth += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry[2] = time.perf_counter() - start
+            self.depth -= 1
+
+    # Counters of worker processes are sent back and added here (see init_guess_worker()).
+    def take_counters(self):
+        with self.lock:
+            counters = (self.guessers, self.counters)
+            self.guessers = {}
+            self.counters = {}
+        return counters
+
+    def merge_counters(self, counters):
+        guessers, other_counters = counters
+        with self.lock:
+            for name, (calls, seconds) in guessers.items():
+                entry = self.guessers.setdefault(name, [0, 0.0])
+                entry[0] += calls
+                entry[1] += seconds
+            for name, value in other_counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self):
+        return {
+            "total_seconds": time.perf_counter() - self.start,
+            "phases": [{"name": name, "depth": depth, "seconds": seconds} for depth, name, seconds in self.phases],
+            "guessers": sorted([{"name": name, "calls": calls, "seconds": seconds} for name, (calls, seconds) in self.guessers.items()],
+                               key=lambda guesser: guesser["seconds"], reverse=True),
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+    def print_report(self, file=sys.stderr):
+        report = self.report()
+        print("Profile (total {:.3f} s)".format(report["total_seconds"]), file=file)
+
+        print("\nPhases:", file=file)
+        for phase in report["phases"]:
+            print("  {:<32} {:10.3f} s".format("  " * phase["depth"] + phase["name"], phase["seconds"]), file=file)
+
+        print("\nGuessers:", file=file)
+        print("  {:<24} {:>10} {:>12} {:>12}".format("name", "calls", "total [ms]", "per call [us]"), file=file)
+        for guesser in report["guessers"]:
+            print("  {:<24} {:>10} {:>12.1f} {:>12.1f}".format("/" + guesser["name"], guesser["calls"], guesser["seconds"] * 1e3,
+                                                               guesser["seconds"] * 1e6 / guesser["calls"]), file=file)
+
+        print("\nCounters:", file=file)
+        for name, value in report["counters"].items():
+            print("  {:<32} {:>14}".format(name, "{:.3f}".format(value) if isinstance(value, float) else value), file=file)
+
+    def write_report(self, path):
+        with open(path, "w") as file:
+            json.dump(self.report(), file, indent=2)
+
+# Profiles time spent in the `with` block if profiling is on.
+def phase(name):
+    if Profiler.instance == None:
+        return contextlib.nullcontext()
+    return Profiler.instance.phase(name)
@@ -0,0 +1,208 @@
+import json
+import sys
+
+from .files import StreamVisitor
+
+# Output of --format json and --format ndjson, for tools which would otherwise
+# parse the text. Entries are written as records like
+#
+#   {"path": "./src/main.c", "directory": false, "guesses": [
+#       {"type": {"class": "$mime", "value": "text/x-c", "description": "C/C++"},
+#        "guesser": "cpp", "attributes": {"source": true, "lines_of_code": 10, ...}}]}
+#
+# and directories have "project" too. `list` and `display-tree` give collapsed
+# guesses (of everything in the directory), `list-files` the entry's own ones.
+# json writes all records as one array, ndjson one record per line; `info`
+# writes a single record. Records are written from the same guesses as text
+# output (file type descriptions are stored unformatted), so json runs share
+# scan cache entries and server trees with terminal runs.
+
+encoder = json.JSONEncoder(separators=(",", ":"), default=str)
+
+class RecordWriter:
+    def __init__(self, format, output=None, array=True):
+        self.output = output if output != None else sys.stdout
+        self.array = array and format == "json"
+        self.separator = "[" if self.array else ""
+        # (FileType, guesser) -> start of a guess record, up to its attributes.
+        self.guess_prefixes = {}
+
+    def write(self, text):
+        if self.array:
+            self.output.write(self.separator + text)
+            self.separator = ",\n"
+        else:
+            self.output.write(text + "\n")
+
+    def write_record(self, record):
+        self.write(encoder.encode(record))
+
+    def write_commit(self, commit):
+        self.write_record(commit_record(commit))
+
+    def format_guess(self, guess):
+        key = (guess.file_type, guess.guesser)
+        prefix = self.guess_prefixes.get(key)
+        if prefix == None:
+            file_type = guess.file_type
+            guesser = getattr(guess.guesser, "name", guess.guesser)
+            prefix = '{"type":' + encoder.encode({"class": file_type.clazz, "value": file_type.value, "description": file_type.user_readable_value}) \
+                     + ',"guesser":' + encoder.encode(guesser) + ',"attributes":'
+            self.guess_prefixes[key] = prefix
+        attributes = dict(guess.attribute_items())
+        if "head" in attributes:
+            attributes["head"] = commit_records(attributes["head"])
+        return prefix + encoder.encode(attributes) + "}"
+
+    # Record of an entry without the closing "}", so that more fields can follow.
+    def format_entry(self, file, path, guesses, project=None):
+        text = '{"path":' + encoder.encode(path) + (',"directory":true' if file.is_directory() else ',"directory":false')
+        if project != None:
+            text += ',"project":true' if project else ',"project":false'
+        return text + ',"guesses":[' + ",".join([self.format_guess(guess) for guess in guesses]) + "]"
+
+    def write_entry(self, file, path, guesses, project=None):
+        self.write(self.format_entry(file, path, guesses, project) + "}")
+
+    def finish(self):
+        if self.array:
+            self.output.write("[]\n" if self.separator == "[" else "]\n")
+        self.output.flush()
+
+# Commits (see make_commit()) keep the message indented as it's displayed;
+# records have it as in git.
+def commit_record(commit):
+    description = commit["description"]
+    if description == "    <No description>\n":
+        description = ""
+    return {"hash": commit["hash"], "author": commit["author"], "date": commit["date"], "message": commit["message"][4:-1],
+            "description": "\n".join(line[4:] for line in description[:-1].split("\n")) if description != "" else ""}
+
+# Commits in attributes of version control guesses; collapsed ones are lists.
+def commit_records(value):
+    if isinstance(value, list):
+        return [commit_records(item) for item in value]
+    if isinstance(value, dict) and "hash" in value:
+        return commit_record(value)
+    return value
+
+# Same entries as `display-tree` (see TreePrinter.print_tree()).
+def write_tree(writer, root):
+    root_is_project = root.is_project()
+    writer.write_entry(root, root.path, root.collapsed_guesses(), root_is_project and not (root.parent != None and root.parent.is_project()))
+    stack = [(iter(root.files.values()), root.path, root_is_project)]
+    while len(stack) > 0:
+        files, parent_path, parent_is_project = stack[-1]
+        for file in files:
+            if len(file.guesses()) == 0:
+                continue
+            path = parent_path + "/" + file.name
+            if file.is_directory():
+                is_project = file.is_project()
+                writer.write_entry(file, path, file.collapsed_guesses(), is_project and not parent_is_project)
+                stack.append((iter(file.files.values()), path, is_project))
+                break
+            writer.write_entry(file, path, file.collapsed_guesses())
+        else:
+            stack.pop()
+
+# Same projects as `list` (see Directory.print_projects()).
+def write_projects(writer, root):
+    stack = [(root, root.path)]
+    while len(stack) > 0:
+        directory, path = stack.pop()
+        if directory.should_display_as_project():
+            writer.write_entry(directory, path, directory.collapsed_guesses(), True)
+        subdirectories = [(file, path + "/" + file.name) for file in directory.files.values() if file.is_directory()]
+        stack += reversed(subdirectories)
+
+def has_guess(file, values):
+    for guess in file.guesses():
+        if guess.file_type.value in values:
+            return True
+    return False
+
+# Same entries as `list-files` (see Directory.print_if_has_guesses()).
+def write_files_with_guesses(writer, root, values):
+    values = set(values)
+    stack = [(root, root.path)]
+    while len(stack) > 0:
+        file, path = stack.pop()
+        if has_guess(file, values):
+            writer.write_entry(file, path, file.guesses())
+        if file.is_directory():
+            stack += reversed([(child, path + "/" + child.name) for child in file.files.values()])
+
+# Collapsed guesses of the whole tree, with the tables of --extensions and
+# --directories if requested.
+def write_info(writer, root, store, extensions, directories):
+    text = writer.format_entry(root, root.path, root.collapsed_guesses(), root.should_display_as_project())
+    if extensions:
+        rows = []
+        for extension, file_count, total_size, percentiles in store.extension_breakdown([50, 90, 99]):
+            rows.append({"extension": extension, "file_count": file_count, "total_size": total_size,
+                         "p50": percentiles[0], "p90": percentiles[1], "p99": percentiles[2]})
+        text += ',"extensions":' + encoder.encode(rows)
+    if directories > 0:
+        rows = [{"path": directory.path, "total_size": total_size} for directory, total_size in store.largest_directories(directories)]
+        text += ',"largest_directories":' + encoder.encode(rows)
+    writer.write(text + "}")
+
+# Write records during the walk, like the --stream printers in ps.files.
+
+class TreeRecordStreamer(StreamVisitor):
+    def __init__(self, writer):
+        self.writer = writer
+        self.paths = []
+        self.hidden_depth = None
+
+    def is_hidden(self, file):
+        return self.hidden_depth != None or (file.parent != None and len(file.guesses()) == 0)
+
+    def enter_directory(self, directory):
+        self.paths.append(directory.name if directory.parent == None else self.paths[-1] + "/" + directory.name)
+        if self.hidden_depth == None and self.is_hidden(directory):
+            self.hidden_depth = len(self.paths)
+
+    def visit_file(self, file):
+        if not self.is_hidden(file):
+            self.writer.write_entry(file, self.paths[-1] + "/" + file.name, file.collapsed_guesses())
+
+    def leave_directory(self, directory):
+        directory.release_files()
+        if self.hidden_depth == None:
+            self.writer.write_entry(directory, self.paths[-1], directory.collapsed_guesses(), directory.should_display_as_project())
+        elif self.hidden_depth == len(self.paths):
+            self.hidden_depth = None
+        self.paths.pop()
+
+class ProjectRecordStreamer(StreamVisitor):
+    def __init__(self, writer):
+        self.writer = writer
+
+    def leave_directory(self, directory):
+        if directory.parent == None and directory.should_display_as_project():
+            self.writer.write_entry(directory, directory.path, directory.collapsed_guesses(), True)
+        for file in directory.files.values():
+            if file.is_directory() and file.should_display_as_project():
+                self.writer.write_entry(file, file.path, file.collapsed_guesses(), True)
+        directory.release_files()
+
+class GuessRecordStreamer(StreamVisitor):
+    def __init__(self, writer, values):
+        self.writer = writer
+        self.values = set(values)
+        self.paths = []
+
+    def enter_directory(self, directory):
+        self.paths.append(directory.name if directory.parent == None else self.paths[-1] + "/" + directory.name)
+        if has_guess(directory, self.values):
+            self.writer.write_entry(directory, self.paths[-1], directory.guesses())
+
+    def visit_file(self, file):
+        if has_guess(file, self.values):
+            self.writer.write_entry(file, self.paths[-1] + "/" + file.name, file.guesses())
+
+    def leave_directory(self, directory):
+        directory.files = {}
+        self.paths.pop()
@@ -0,0 +1,292 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import threading
+import time
+import traceback
+
+from collections import OrderedDict
+
+import config as config
+from .cache import ScanCache
+from .client import is_own_socket
+from .columns import ColumnStore
+from .files import walk_directory
+from .filters import FileFilter
+from .logging import *
+
+# The server of `project-status serve`, answering queries of ps.client (see
+# there for the protocol).
+
+OUTPUT_CHUNK_SIZE = 1 << 16
+
+# Collects output as messages of chunks of it, in the order they're written.
+class MessageOutput(io.TextIOBase):
+    def __init__(self, messages, name):
+        self.messages = messages
+        self.name = name
+        self.chunks = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self.chunks.append(text)
+        self.size += len(text)
+        if self.size >= OUTPUT_CHUNK_SIZE:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if len(self.chunks) > 0:
+            self.messages.append({self.name: "".join(self.chunks)})
+            self.chunks = []
+            self.size = 0
+
+def send_message(stream, message):
+    stream.write(json.dumps(message).encode() + b"\n")
+    stream.flush()
+
+class ScannedRoot:
+    __slots__ = ("tree", "store", "filter", "entries", "scanned_at", "queried_at")
+
+    def __init__(self, tree, store, file_filter, entries):
+        self.tree = tree
+        self.store = store
+        self.filter = file_filter
+        self.entries = entries
+        self.scanned_at = time.monotonic()
+        self.queried_at = self.scanned_at
+
+def count_entries(root):
+    count = 0
+    directories = [root]
+    while len(directories) > 0:
+        for file in directories.pop().files.values():
+            count += 1
+            if file.is_directory():
+                directories.append(file)
+    return count
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if line == b"":
+            return
+        try:
+            self.server.run_query(json.loads(line), self.wfile)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away.
+            pass
+
+# Every connection is served by a thread of its own. Queries of a root take
+# turns on its lock (see root_lock()), from looking the tree up to printing it,
+# so that concurrent ones scan it once. Scanning and printing also use global
+# state (config.args, FileFilter, ColumnStore, sys.stdout, the working
+# directory, ...), which is set up for every query, so they hold `state_lock`
+# too, and a scan of one root still makes queries of others wait. Output is
+# sent after releasing the locks, so a client which is slow to read it, or
+# doesn't send its query, doesn't hold up the others.
+#
+# Trees are kept per root and per options affecting the scan, least recently
+# queried first. A tree is scanned again when it's older than `rescan_after`
+# seconds (unchanged files still come from the scan cache), dropped when it
+# wasn't queried for `evict_after` seconds, and not kept at all when it has
+# more than `max_entries` entries. At most `max_roots` trees are kept.
+class ScanServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, print_output, **kwargs):
+        self.socket_path = socket_path
+        self.print_output = print_output
+        self.max_roots = kwargs.get("max_roots")
+        self.max_entries = kwargs.get("max_entries")
+        self.evict_after = kwargs.get("evict_after")
+        self.rescan_after = kwargs.get("rescan_after")
+        self.verbose = kwargs.get("verbose")
+        self.roots = OrderedDict()
+        # Guards `roots` and `root_locks`.
+        self.lock = threading.Lock()
+        # Root key -> lock held while querying it.
+        self.root_locks = {}
+        self.state_lock = threading.Lock()
+        self.original_cwd = os.getcwd()
+
+        # Only the user can connect.
+        umask = os.umask(0o077)
+        try:
+            socketserver.UnixStreamServer.__init__(self, socket_path, QueryHandler)
+        finally:
+            os.umask(umask)
+
+    # Logs into the server's stderr (not the client's) with `serve --verbose`.
+    def log(self, text):
+        if self.verbose:
+            print(text, file=sys.__stderr__)
+
+    # Called periodically by serve_forever(), while queries may be answered.
+    def service_actions(self):
+        now = time.monotonic()
+        with self.lock:
+            for key, root in list(self.roots.items()):
+                if now - root.queried_at > self.evict_after:
+                    self.log("Evicting " + key[0])
+                    del self.roots[key]
+            for key, lock in list(self.root_locks.items()):
+                if not key in self.roots and not lock.locked():
+                    del self.root_locks[key]
+        # Saving while a query updates the cache would have to wait for it.
+        if ScanCache.instance != None and self.state_lock.acquire(blocking=False):
+            try:
+                ScanCache.instance.save()
+            finally:
+                self.state_lock.release()
+
+    # Not into sys.stderr, which may be redirected to another client meanwhile.
+    def handle_error(self, request, client_address):
+        traceback.print_exc(file=sys.__stderr__)
+
+    def root_lock(self, key):
+        with self.lock:
+            return self.root_locks.setdefault(key, threading.Lock())
+
+    def run_query(self, request, stream):
+        messages = []
+        stdout = MessageOutput(messages, "stdout")
+        stderr = MessageOutput(messages, "stderr")
+        status = 0
+        args = argparse.Namespace(**request["args"])
+        args.exclude = args.exclude.split(",") if args.exclude != None else []
+        args.include = args.include.split(",") if args.include != None else []
+        key = (os.path.realpath(os.path.join(request["cwd"], args.path)), tuple(args.include), tuple(args.exclude), args.respect_gitignore,
+               args.no_open)
+        with self.root_lock(key), self.state_lock:
+            try:
+                with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                    try:
+                        self.answer(request, args, key)
+                    except Exception:
+                        print("Exception :( " + str(sys.exc_info()), file=sys.stderr)
+                        traceback.print_exc()
+                        status = 1
+                    finally:
+                        os.chdir(self.original_cwd)
+            finally:
+                stdout.flush()
+                stderr.flush()
+        for message in messages:
+            send_message(stream, message)
+        send_message(stream, {"exit": status})
+
+    def answer(self, request, args, key):
+        config.args = args
+
+        # Output is formatted for the client's terminal.
+        set_formatting(request["ansi"], request["unicode"])
+        os.environ["COLUMNS"] = str(request["columns"])
+
+        os.chdir(request["cwd"])
+        if ScanCache.instance != None:
+            ScanCache.instance.cwd = request["cwd"]
+            ScanCache.instance.settings = None
+
+        with self.lock:
+            root = self.roots.get(key)
+            if root != None and time.monotonic() - root.scanned_at > self.rescan_after:
+                del self.roots[key]
+                root = None
+            if root != None:
+                self.roots.move_to_end(key)
+                root.queried_at = time.monotonic()
+        if root == None:
+            self.log("Scanning " + key[0])
+            root = self.scan(args)
+            if root.entries <= self.max_entries:
+                with self.lock:
+                    self.roots[key] = root
+                    while len(self.roots) > self.max_roots:
+                        self.roots.popitem(last=False)
+            else:
+                self.log("Not keeping " + key[0] + ", it has " + str(root.entries) + " entries")
+
+        # The tree may be queried by another path than it was scanned with.
+        root.tree.name = args.path
+        FileFilter.instance = root.filter
+        ColumnStore.instance = root.store
+        try:
+            self.print_output(args.command, root.tree, root.store)
+        finally:
+            ColumnStore.instance = None
+
+    def scan(self, args):
+        FileFilter.instance = None
+        file_filter = FileFilter(args.include, args.exclude)
+        ColumnStore.instance = None
+        store = ColumnStore()
+        try:
+            tree = walk_directory(args.path, jobs=args.jobs, processes=args.processes, respect_gitignore=args.respect_gitignore)
+        finally:
+            ColumnStore.instance = None
+        return ScannedRoot(tree, store, file_filter, count_entries(tree))
+
+# Other users mustn't be able to replace the socket, so its directory must be
+# ours (or root's) and not writable by others, unless it's sticky like /tmp.
+# The directory is created, private, if it doesn't exist.
+def check_socket_directory(directory):
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        status = os.lstat(directory)
+    except OSError:
+        print_error("Failed to create " + directory + ": " + sys.exc_info()[1].strerror)
+        return False
+    if not stat.S_ISDIR(status.st_mode) or not status.st_uid in [os.getuid(), 0] \
+            or (status.st_mode & 0o022 != 0 and status.st_mode & stat.S_ISVTX == 0):
+        print_error(directory + " can be changed by other users, not listening there")
+        return False
+    return True
+
+def serve(socket_path, print_output, **kwargs):
+    if not check_socket_directory(os.path.dirname(os.path.abspath(socket_path))):
+        return
+
+    # Replace the socket of a server which isn't running anymore.
+    if os.path.lexists(socket_path):
+        if not is_own_socket(socket_path):
+            print_error(socket_path + " exists and is not a socket of this user")
+            return
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(socket_path)
+            print_error("Server is already running at " + socket_path)
+            return
+        except OSError:
+            pass
+        finally:
+            connection.close()
+        try:
+            os.unlink(socket_path)
+        except OSError:
+            print_error("Failed to remove " + socket_path + ": " + sys.exc_info()[1].strerror)
+            return
+
+    disable_status()
+    server = ScanServer(socket_path, print_output, **kwargs)
+    # Remove the socket when stopped by kill too.
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit(0))
+    print("Listening on " + socket_path, file=sys.stderr)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        try:
+            os.unlink(socket_path)
+        except FileNotFoundError:
+            pass
@@ -1,33 +1,192 @@
-import subprocess
+import threading
+import time
 
 from .logging import print_error
+from .profile import Profiler
+
+# asyncio and subprocess are imported by the functions running processes, as
+# most commands never do and importing asyncio takes longer than the rest of
+# the startup.
+
+# Commands are given either as a string split on spaces, or as a list when
+# arguments may contain spaces themselves.
+def split_command(args):
+    if isinstance(args, str):
+        return args.strip().split(" ")
+    return list(args)
+
+# Runs a process with subprocess.run(), counting it when profiling.
+def run_subprocess(args, **kwargs):
+    import subprocess
+    if Profiler.instance == None:
+        return subprocess.run(args, **kwargs)
+    start = time.perf_counter()
+    try:
+        return subprocess.run(args, **kwargs)
+    finally:
+        Profiler.instance.count("subprocesses")
+        Profiler.instance.count("subprocess seconds", time.perf_counter() - start)
 
 def run_process_in_dir(cwd, args):
-    args = args.strip()
+    args = split_command(args)
     try:
-        process = subprocess.run(args.split(" "), text=True, check=True, cwd=cwd)
+        process = run_subprocess(args, text=True, check=True, cwd=cwd)
     except:
-        print_error("Failed to run: " + args)
+        print_error("Failed to run: " + " ".join(args))
         return False
     return True
 
 def run_process_in_dir_and_return_stdout(cwd, args):
-    args = args.strip()
+    import subprocess
+    args = split_command(args)
     try:
-        process = subprocess.run(args.split(" "), stdout=subprocess.PIPE, text=True, check=True, cwd=cwd)
+        process = run_subprocess(args, stdout=subprocess.PIPE, text=True, check=True, cwd=cwd)
     except:
-        print_error("Failed to run: " + args)
+        print_error("Failed to run: " + " ".join(args))
         return None
     return process.stdout
 
 def run_process_in_dir_and_return_stdout_stream(cwd, args):
-    args = args.strip()
+    import subprocess
+    args = split_command(args)
     try:
-        process = subprocess.Popen(args.split(" "), stdout=subprocess.PIPE, cwd=cwd)
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, cwd=cwd)
+        if Profiler.instance != None:
+            Profiler.instance.count("subprocesses")
         return process.stdout
     except:
-        print_error("Failed to run: " + args)
+        print_error("Failed to run: " + " ".join(args))
         return ""
 
+# Commands queued while scanning, run concurrently with asyncio by flush(). At
+# most `concurrency` of them run at once, each killed after `timeout` seconds.
+class ProcessProbeQueue:
+    instance = None
+    
+    def __init__(self, **kwargs):
+        if ProcessProbeQueue.instance == None:
+            ProcessProbeQueue.instance = self
+        else:
+            raise AssertionError("Double singleton")
+        
+        self.concurrency = kwargs.get("concurrency") or 8
+        self.timeout = kwargs.get("timeout")
+        self.pending = []
+        self.lock = threading.Lock()
+    
+    def add(self, cwd, args, callback):
+        with self.lock:
+            self.pending.append((cwd, split_command(args), callback))
+    
+    def flush(self):
+        with self.lock:
+            probes = self.pending
+            self.pending = []
+        if len(probes) > 0:
+            import asyncio
+            start = time.perf_counter()
+            asyncio.run(self.run_all(probes))
+            if Profiler.instance != None:
+                Profiler.instance.count("probe batches")
+                Profiler.instance.count("probe wait seconds", time.perf_counter() - start)
+    
+    async def run_all(self, probes):
+        import asyncio
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(*[self.run_one(semaphore, cwd, args) for cwd, args, callback in probes])
+        # Callbacks run here, in order, so they don't need to be thread safe.
+        for (cwd, args, callback), stdout in zip(probes, results):
+            callback(stdout)
+    
+    async def run_one(self, semaphore, cwd, args):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                return await self.run_process(cwd, args)
+            finally:
+                if Profiler.instance != None:
+                    Profiler.instance.count("subprocesses")
+                    Profiler.instance.count("subprocess seconds", time.perf_counter() - start)
+    
+    async def run_process(self, cwd, args):
+        import asyncio
+        import subprocess
+        try:
+            process = await asyncio.create_subprocess_exec(*args, stdout=subprocess.PIPE, cwd=cwd)
+        except OSError:
+            print_error("Failed to run: " + " ".join(args))
+            return None
+        try:
+            stdout, _ = await asyncio.wait_for(process.communicate(), self.timeout)
+        except asyncio.TimeoutError:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+            print_error("Timed out: " + " ".join(args) + " (in " + cwd + ")")
+            return None
+        if process.returncode != 0:
+            print_error("Failed to run: " + " ".join(args))
+            return None
+        return stdout
+
+# Runs `args` in `cwd` and calls `callback` with its stdout (bytes, or None on
+# failure); later, concurrently with others, if there is a ProcessProbeQueue.
+def run_process_in_dir_deferred(cwd, args, callback):
+    if ProcessProbeQueue.instance != None:
+        ProcessProbeQueue.instance.add(cwd, args, callback)
+        return
+    
+    import subprocess
+    args = split_command(args)
+    try:
+        process = run_subprocess(args, stdout=subprocess.PIPE, check=True, cwd=cwd)
+    except:
+        print_error("Failed to run: " + " ".join(args))
+        callback(None)
+        return
+    callback(process.stdout)
+
 def depth_indent(depth):
     return "  "*depth;
+
+READ_BLOCK_SIZE = 1 << 20
+
+# Yields (buffer, length) blocks of the file starting at `offset`. The buffer is
+# reused, so consumers must not keep it. Files aren't mapped: slicing a mapping
+# copies each block just like readinto() does, and a file truncated while
+# mapped (a rotated log, or anything under `watch`) kills the process with
+# SIGBUS instead of ending the read early.
+def read_blocks(fd, offset=0):
+    fd.seek(offset)
+    buffer = bytearray(READ_BLOCK_SIZE)
+    while True:
+        length = fd.readinto(buffer)
+        if not length:
+            break
+        yield buffer, length
+
+# Counts lines like iterating over the file does (so a last line without
+# trailing newline is counted too), but counts newlines in whole blocks instead
+# of creating an object for each line.
+class LineCounter:
+    def __init__(self):
+        self.lines = 0
+        self.last_byte = None
+    
+    def feed(self, buffer, length):
+        if length > 0:
+            self.lines += buffer.count(b"\n", 0, length)
+            self.last_byte = buffer[length - 1]
+    
+    def finish(self):
+        if self.last_byte != None and self.last_byte != ord("\n"):
+            self.lines += 1
+
+def count_lines(fd):
+    counter = LineCounter()
+    for buffer, length in read_blocks(fd, 0):
+        counter.feed(buffer, length)
+    counter.finish()
+    return counter.lines
@@ -0,0 +1,554 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+from .detector import DetectorRegistry
+from .files import Directory, File, collapse_tree, walk_directory
+from .filters import FileFilter
+from .guess import FileGuess
+from .logging import *
+from .util import ProcessProbeQueue
+
+# `project-status watch` keeps the tree up to date as files change, and prints
+# the output again after every batch of changes.
+#
+# Watchers report names of entries which may have changed, as (directory,
+# name) pairs. TreeUpdater lists, guesses or removes just these entries, and
+# updates collapsed guesses of the directories above them. When only numbers
+# change (e.g. lines of code of a saved file), the difference is added to every
+# directory up to the root, so an update costs time proportional to the depth
+# of the tree. Other changes collapse the children of the affected directories
+# again.
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_DONT_FOLLOW = 0x2000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF \
+             | IN_ONLYDIR | IN_DONT_FOLLOW
+
+EVENT_HEADER = struct.Struct("iIII")
+
+class WatcherError(Exception):
+    pass
+
+# Directories listed in the tree, and special ones (e.g. .git) which aren't
+# listed but whose changes change their guesses.
+def watched_directories(root):
+    directories = [root]
+    while len(directories) > 0:
+        directory = directories.pop()
+        yield directory
+        for file in directory.files.values():
+            if file.is_directory() and not file.is_symlink():
+                directories.append(file)
+
+# Uses inotify(7) through libc, Linux only.
+class InotifyWatcher:
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise WatcherError("inotify is only available on Linux")
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise WatcherError("inotify_init1 failed: " + os.strerror(ctypes.get_errno()))
+        self.directories = {}  # watch descriptor -> Directory
+        self.overflowed = False
+
+    def close(self):
+        if self.fd != None:
+            os.close(self.fd)
+            self.fd = None
+
+    def add(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory.path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            # Directories can be removed before they are watched.
+            if error in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                return
+            raise WatcherError("Failed to watch " + directory.path + ": " + os.strerror(error)
+                               + (" (see /proc/sys/fs/inotify/max_user_watches)" if error == errno.ENOSPC else ""))
+        # A directory replaced by another one with the same inode keeps the descriptor.
+        self.directories[wd] = directory
+
+    def add_tree(self, root):
+        for directory in watched_directories(root):
+            self.add(directory)
+
+    # Waits up to `timeout` seconds and returns set of (directory, name), or
+    # None if events were lost and everything must be scanned again.
+    def wait(self, timeout):
+        changes = set()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if len(ready) == 0:
+            return changes
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return changes
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0"))
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                self.overflowed = True
+                continue
+            directory = self.directories.get(wd)
+            if directory == None:
+                continue
+            if mask & IN_IGNORED:
+                del self.directories[wd]
+            elif mask & (IN_DELETE_SELF | IN_MOVE_SELF) or name == "" or not directory.should_traverse_into():
+                # Special directories aren't listed, but they are guessed again.
+                if directory.parent != None:
+                    changes.add((directory.parent, directory.name))
+            else:
+                changes.add((directory, name))
+
+        if self.overflowed:
+            self.overflowed = False
+            return None
+        return changes
+
+# Compares the filesystem with what the previous poll saw, every `interval`
+# seconds, for systems without inotify or when there are too many directories
+# to watch. Every poll stats every entry of the tree.
+class PollingWatcher:
+    def __init__(self, interval):
+        self.interval = interval
+        self.root = None
+        self.directory_mtimes = {}
+        self.directory_names = {}
+        self.stat_keys = {}
+
+    def close(self):
+        pass
+
+    def add(self, directory):
+        self.directory_mtimes[directory] = directory.st_mtime_ns
+        self.directory_names[directory] = set(directory.files.keys())
+        for file in directory.files.values():
+            if not file.is_directory():
+                self.stat_keys[(directory, file.name)] = file.stat_key()
+
+    def add_tree(self, root):
+        self.root = root
+        self.directory_mtimes = {}
+        self.directory_names = {}
+        self.stat_keys = {}
+        for directory in watched_directories(root):
+            self.add(directory)
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval) if timeout != None else self.interval)
+        changes = set()
+        directory_mtimes = {}
+        stat_keys = {}
+        for directory in watched_directories(self.root):
+            path = directory.path
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                # Reported once, when it's gone.
+                if directory.parent != None and directory in self.directory_mtimes:
+                    changes.add((directory.parent, directory.name))
+                continue
+            directory_mtimes[directory] = mtime
+
+            previous_mtime = self.directory_mtimes.get(directory)
+            if previous_mtime != mtime:
+                if not directory.should_traverse_into():
+                    if directory.parent != None:
+                        changes.add((directory.parent, directory.name))
+                    continue
+                try:
+                    names = set(os.listdir(path))
+                except OSError:
+                    names = set()
+                for name in names.symmetric_difference(self.directory_names.get(directory, directory.files.keys())):
+                    changes.add((directory, name))
+                self.directory_names[directory] = names
+
+            for file in directory.files.values():
+                if file.is_directory():
+                    continue
+                try:
+                    stat_result = os.stat(path + "/" + file.name)
+                    stat_key = (stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+                except OSError:
+                    stat_key = None
+                key = (directory, file.name)
+                stat_keys[key] = stat_key
+                if stat_key != self.stat_keys.get(key, file.stat_key()):
+                    changes.add(key)
+        self.directory_mtimes = directory_mtimes
+        self.stat_keys = stat_keys
+        return changes
+
+# Attributes of guesses of one file or directory by (class, value), with
+# lists copied, as they are extended in place when collapsing.
+def snapshot(guesses):
+    result = {}
+    for guess in guesses:
+        attributes = {}
+        for name, value in guess.attribute_items():
+            attributes[name] = list(value) if isinstance(value, list) else value
+        result[(guess.file_type.clazz, guess.file_type.value)] = (guess, attributes)
+    return result
+
+def is_number(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+class TreeUpdater:
+    def __init__(self, root, watcher):
+        self.root = root
+        self.watcher = watcher
+        self.added_directories = []
+        # (directory, name) of symlinks by their target and every directory
+        # above it. They are guessed again when the target changes, as that
+        # doesn't report anything for the link.
+        self.symlinks = {}
+        self.add_symlinks(root)
+
+    def add_symlinks(self, root):
+        for directory in watched_directories(root):
+            for file in directory.files.values():
+                if file.is_symlink():
+                    self.add_symlink(directory, file.name)
+
+    def add_symlink(self, directory, name):
+        path = os.path.realpath(directory.path + "/" + name)
+        while True:
+            self.symlinks.setdefault(path, set()).add((directory, name))
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+
+    # Applies changes (set of (directory, name)) to the tree. Returns False if
+    # the whole tree must be scanned again instead.
+    def apply(self, changes):
+        changes = changes | self.linked_changes(changes)
+        changed_entries = {}
+        for directory, name in changes:
+            if not self.is_in_tree(directory):
+                continue
+            # Rules of --respect-gitignore changed, so the directory is listed again.
+            if name == ".gitignore" and directory.ignore_rules != None:
+                if directory.parent == None:
+                    return False
+                directory, name = directory.parent, directory.name
+                changed_entries.setdefault(directory, {})[name] = True
+                continue
+            changed_entries.setdefault(directory, {}).setdefault(name, False)
+
+        # Directories changed by a change above them are updated with them.
+        for directory, names in changed_entries.items():
+            if not self.is_in_tree(directory):
+                continue
+            old_guesses = snapshot(directory.collapsed_guesses())
+            entries_changed = False
+            child_changes = []
+            for name, list_again in sorted(names.items()):
+                entries_changed |= self.update_entry(directory, name, child_changes, list_again)
+
+            if entries_changed:
+                # Own guesses (e.g. the number of entries) changed too.
+                self.refresh_stat(directory)
+                self.sort_entries(directory)
+                self.collapse_again(directory)
+            else:
+                for old, new in child_changes:
+                    if not self.apply_difference(directory.collapsed_type_guesses, old, new):
+                        self.collapse_again(directory)
+                        break
+            directory.m_is_project = None
+            self.update_parents(directory, old_guesses)
+
+        added_directories = self.added_directories
+        self.added_directories = []
+        try:
+            for directory in added_directories:
+                self.watcher.add(directory)
+        except WatcherError:
+            # Too many directories to watch; scanning again falls back to polling.
+            print_verbose(str(sys.exc_info()[1]))
+            return False
+        return True
+
+    # Symlinks whose target is (or is in) a changed entry.
+    def linked_changes(self, changes):
+        result = set()
+        if len(self.symlinks) == 0:
+            return result
+        for directory, name in changes:
+            links = self.symlinks.get(os.path.realpath(directory.path) + "/" + name)
+            if links == None:
+                continue
+            for link in list(links):
+                link_directory, link_name = link
+                file = link_directory.files.get(link_name)
+                if file == None or not file.is_symlink() or not self.is_in_tree(link_directory):
+                    links.discard(link)
+                    continue
+                result.add(link)
+        return result
+
+    def is_in_tree(self, directory):
+        while directory.parent != None:
+            if directory.parent.files.get(directory.name) is not directory:
+                return False
+            directory = directory.parent
+        return directory is self.root
+
+    # Updates entry `name` of `directory`, listing it again if it's a directory
+    # and `list_again` is set. Returns True if it was added or removed,
+    # otherwise adds (old, new) snapshots of its guesses to `child_changes` if
+    # they changed.
+    def update_entry(self, directory, name, child_changes, list_again):
+        old = directory.files.get(name)
+        path = directory.path + "/" + name
+        try:
+            symlink = os.path.islink(path)
+            isdir = os.path.isdir(path)
+            exists = symlink or os.path.exists(path)
+        except OSError:
+            exists = False
+
+        if exists:
+            file_filter = FileFilter.instance
+            if file_filter != None and file_filter.is_excluded(name, isdir, file_filter.relative_prefix(directory)):
+                exists = False
+            elif directory.ignore_rules != None and directory.ignore_rules.is_ignored(name, isdir):
+                exists = False
+        if not exists:
+            if old == None:
+                return False
+            del directory.files[name]
+            return True
+
+        # Listed directories are updated by their own changes, special ones
+        # (which aren't listed) are guessed again.
+        if old != None and old.is_directory() and isdir and old.should_traverse_into() and not list_again:
+            return False
+
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            stat_result = None
+        if isdir:
+            new = Directory(directory, path, stat_result=stat_result, symlink=symlink, defer_listing=True)
+            new.list_directory()
+            collapse_tree(new)
+            self.added_directories += list(watched_directories(new))
+            self.add_symlinks(new)
+        else:
+            new = File(directory, path, stat_result=stat_result, symlink=symlink)
+            if old != None and not old.is_directory() and old.stat_key() == new.stat_key():
+                return False
+            new.guesses()
+        if ProcessProbeQueue.instance != None:
+            ProcessProbeQueue.instance.flush()
+
+        directory.files[name] = new
+        if symlink:
+            self.add_symlink(directory, name)
+        if old == None or old.is_directory() != new.is_directory():
+            return True
+        child_changes.append((snapshot(old.collapsed_guesses()), snapshot(new.collapsed_guesses())))
+        return False
+
+    def refresh_stat(self, directory):
+        try:
+            stat_result = os.stat(directory.path)
+            directory.st_dev, directory.st_ino, directory.st_size, directory.st_mtime_ns = \
+                stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns
+        except OSError:
+            pass
+
+    # Puts entries in the order of listing, as a scan would, since the first
+    # file of a type gives the collapsed guess its guesser.
+    def sort_entries(self, directory):
+        try:
+            order = {name: index for index, name in enumerate(os.listdir(directory.path))}
+        except OSError:
+            return
+        directory.files = dict(sorted(directory.files.items(), key=lambda item: order.get(item[0], len(order))))
+
+    def collapse_again(self, directory):
+        directory.collapsed_type_guesses = None
+        directory.collapsed_type_guesses = directory.generate_collapsed_guesses(DetectorRegistry.instance.guess_file_type(directory))
+
+    # Collapsed guesses of `directory` changed from `old_guesses`; updates the
+    # directories above it.
+    def update_parents(self, directory, old_guesses):
+        new_guesses = snapshot(directory.collapsed_guesses())
+        while directory.parent != None:
+            parent = directory.parent
+            old_parent_guesses = snapshot(parent.collapsed_guesses())
+            if not self.apply_difference(parent.collapsed_type_guesses, old_guesses, new_guesses):
+                self.collapse_again(parent)
+            parent.m_is_project = None
+            directory = parent
+            old_guesses = old_parent_guesses
+            new_guesses = snapshot(parent.collapsed_guesses())
+
+    # Changes collapsed `guesses` of a directory after guesses of one of its
+    # children changed from `old` to `new` (see snapshot()). Returns False if
+    # this can't be done without collapsing all children again, which is when
+    # anything but numbers changed, or when the guesser of a collapsed guess
+    # may change. Guesses are matched by (class, value); "file_count" tells how
+    # many files a guess was collapsed from.
+    def apply_difference(self, guesses, old, new):
+        by_type = {(guess.file_type.clazz, guess.file_type.value): guess for guess in guesses}
+        for key in old.keys() | new.keys():
+            old_guess, old_attributes = old.get(key, (None, {}))
+            new_guess, new_attributes = new.get(key, (None, {}))
+            guess = by_type.get(key)
+            if guess == None:
+                if old_guess != None:
+                    return False
+                # A new type; adding its guess doesn't affect the others.
+                guess = FileGuess(new_guess.file_type)
+                guess.guesser = new_guess.guesser
+                for name, value in new_attributes.items():
+                    if isinstance(value, list):
+                        return False
+                    guess.set_attribute(name, value)
+                guesses.append(guess)
+                by_type[key] = guess
+                continue
+
+            if new_guess == None:
+                # No file of this child has the type anymore. If others still
+                # have it, the first of them gives its guesser.
+                if guess.get_attribute("file_count") != old_attributes.get("file_count"):
+                    return False
+                guesses.remove(guess)
+                del by_type[key]
+                continue
+            if new_guess.guesser is not (old_guess.guesser if old_guess != None else guess.guesser):
+                return False
+
+            for name in old_attributes.keys() | new_attributes.keys():
+                if not name in new_attributes:
+                    return False
+                new_value = new_attributes[name]
+                current = guess.get_attribute(name)
+                if not name in old_attributes:
+                    # The type was added to this child, or the attribute to its guess.
+                    if is_number(new_value) and is_number(current):
+                        guess.set_attribute(name, current + new_value)
+                    elif isinstance(new_value, bool) and isinstance(current, bool):
+                        guess.set_attribute(name, current or new_value)
+                    else:
+                        return False
+                    continue
+                old_value = old_attributes[name]
+                if old_value == new_value and type(old_value) == type(new_value):
+                    continue
+                if not (is_number(old_value) and is_number(new_value) and is_number(current)):
+                    return False
+                guess.set_attribute(name, current + new_value - old_value)
+        return True
+
+# Scans `path` and displays `render(tree)` (which returns the text), and then
+# again after every batch of changes, once no change came for `debounce`
+# seconds. Output is displayed only when it changed.
+def watch(path, render, **kwargs):
+    debounce = kwargs.get("debounce")
+    # Output is rendered into a buffer, but formatted for our terminal.
+    set_formatting(allow_ansi_escape_codes(), allow_unicode())
+
+    def create_watcher(poll):
+        if not poll:
+            try:
+                return InotifyWatcher()
+            except (WatcherError, OSError, AttributeError):
+                print_verbose("inotify not available: " + str(sys.exc_info()[1]))
+        return PollingWatcher(kwargs.get("poll_interval"))
+
+    # Scans the tree and returns it with a new watcher watching it, as watches
+    # of a previous one point to directories of the previous tree. Falls back
+    # to polling when there are too many directories for inotify.
+    def scan(poll):
+        tree = walk_directory(path, jobs=kwargs.get("jobs"), processes=kwargs.get("processes"), respect_gitignore=kwargs.get("respect_gitignore"))
+        watcher = create_watcher(poll)
+        try:
+            watcher.add_tree(tree)
+        except WatcherError:
+            print_error(str(sys.exc_info()[1]) + ", polling instead")
+            watcher.close()
+            watcher = PollingWatcher(kwargs.get("poll_interval"))
+            watcher.add_tree(tree)
+        return tree, watcher
+
+    watcher = None
+    last_output = None
+    def display(tree):
+        nonlocal last_output
+        output = render(tree)
+        if output == last_output:
+            return
+        last_output = output
+        if allow_ansi_escape_codes():
+            # Clear the screen.
+            sys.stdout.write("\033[H\033[2J")
+        sys.stdout.write(output)
+        sys.stdout.flush()
+
+    try:
+        tree, watcher = scan(kwargs.get("poll"))
+        display(tree)
+        updater = TreeUpdater(tree, watcher)
+        while True:
+            changes = watcher.wait(None)
+            # Wait until the changes settle.
+            while changes != None and len(changes) > 0:
+                more_changes = watcher.wait(debounce)
+                if more_changes == None:
+                    changes = None
+                elif len(more_changes) == 0:
+                    break
+                else:
+                    changes |= more_changes
+
+            if changes == None:
+                print_verbose("Events were lost, scanning again")
+            elif len(changes) == 0:
+                continue
+            elif updater.apply(changes):
+                display(tree)
+                continue
+            # Watches are dropped before scanning, so that the new ones fit.
+            watcher.close()
+            tree, watcher = scan(isinstance(watcher, PollingWatcher))
+            updater = TreeUpdater(tree, watcher)
+            display(tree)
+    except KeyboardInterrupt:
+        # That's how watching is stopped; the scan cache is saved then.
+        pass
+    finally:
+        if watcher != None:
+            watcher.close()